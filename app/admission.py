@@ -0,0 +1,236 @@
+"""Admission control: a per-worker cap on requests working with the database, and per-client rate limits."""
+import asyncio
+import math
+import re
+import time
+from collections import OrderedDict, deque
+
+from fastapi.responses import JSONResponse
+
+from app.list_cache import ListCache
+from app.metrics import ADMISSION_BYPASSED, ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_SHED
+
+READ = 0
+WRITE = 1
+_PRIORITY_NAMES = {READ: "read", WRITE: "write"}
+_MAX_CLIENTS = 10000
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token. Returns 0 if there was one, otherwise seconds until there is."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Lets at most max_concurrency requests of this worker work with the database at once.
+
+    Requests over the cap wait in a queue of at most max_queue, reads ahead of writes, for at most
+    queue_timeout seconds, far less than a pool checkout may wait. Requests that don't fit or don't
+    get a slot in time are rejected at once, before they hold a connection or make the queue longer.
+    Each client also has a token bucket of client_burst requests refilled at client_rate per second.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int = 100, queue_timeout: float = 10.0, retry_after: int = 1,
+                 client_rate: float = 0.0, client_burst: int = 50):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+
+        self.in_flight = 0
+        self._waiters: dict[int, deque[asyncio.Future]] = {READ: deque(), WRITE: deque()}
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+        self.admitted = 0
+        self.queued = 0
+        self.bypassed = 0
+        self.shed: dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "client_rate": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def check_client(self, client: str) -> None:
+        """Take a token from the client's bucket, raise Overloaded if it is empty."""
+        if self.client_rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.client_rate, self.client_burst)
+            # Clients that went quiet have a full bucket anyway, forgetting them loses nothing
+            while len(self._buckets) > _MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(client)
+        wait = bucket.take()
+        if wait > 0:
+            self._shed("client_rate")
+            raise Overloaded("client_rate", math.ceil(wait))
+
+    def record_bypass(self) -> None:
+        self.bypassed += 1
+        ADMISSION_BYPASSED.inc()
+
+    async def acquire(self, priority: int) -> None:
+        """Take a slot, waiting in the queue if there is none. Raises Overloaded instead of waiting too long."""
+        if self.in_flight < self.max_concurrency and not self.queue_depth:
+            self._admit()
+            return
+        if self.queue_depth >= self.max_queue:
+            self._shed("queue_full")
+            raise Overloaded("queue_full", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(_PRIORITY_NAMES[priority]).inc()
+        self.queued += 1
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if self._leave(priority, waiter):
+                self._shed("queue_timeout")
+                raise Overloaded("queue_timeout", self.retry_after)
+        except asyncio.CancelledError:
+            # The client went away: a slot handed over meanwhile goes to the next waiter
+            if not self._leave(priority, waiter):
+                self.release()
+            raise
+        # release() handed over its slot, in_flight is already counted
+        ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - started_at)
+
+    def release(self) -> None:
+        for priority in (READ, WRITE):
+            waiters = self._waiters[priority]
+            if waiters:
+                ADMISSION_QUEUE_DEPTH.labels(_PRIORITY_NAMES[priority]).dec()
+                waiters.popleft().set_result(None)
+                self.admitted += 1
+                return
+        self.in_flight -= 1
+        ADMISSION_IN_FLIGHT.dec()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "bypassed": self.bypassed,
+            "shed": dict(self.shed),
+            "clients": len(self._buckets),
+        }
+
+    def _leave(self, priority: int, waiter: asyncio.Future) -> bool:
+        """Take a waiter out of the queue. Returns False if it was given a slot in the meantime."""
+        if waiter.done():
+            return False
+        waiter.cancel()
+        self._waiters[priority].remove(waiter)
+        ADMISSION_QUEUE_DEPTH.labels(_PRIORITY_NAMES[priority]).dec()
+        return True
+
+    def _admit(self) -> None:
+        self.in_flight += 1
+        self.admitted += 1
+        ADMISSION_IN_FLIGHT.inc()
+
+    def _shed(self, reason: str) -> None:
+        self.shed[reason] += 1
+        ADMISSION_SHED.labels(reason).inc()
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware putting API requests through an AdmissionController.
+
+    Reads of a list that is in the list cache (full document or 304) need no database and skip the
+    queue. Event streams hold no connection while they are open and skip it too. Rejected requests
+    get 503, or 429 for a client over its rate, with Retry-After.
+    """
+
+    def __init__(self, app, controller: AdmissionController, list_cache: ListCache, client_header: str = "",
+                 api_prefix: str = "", exempt_paths: tuple[str, ...] = ("/metrics", "/stats", "/docs", "/openapi.json")):
+        self.app = app
+        self.controller = controller
+        self.list_cache = list_cache
+        self.client_header = client_header.lower().encode()
+        self.api_prefix = api_prefix
+        self.exempt_paths = exempt_paths
+        self._list_path = re.compile(rf"^{re.escape(api_prefix)}/lists/([^/]+)$")
+        self._events_path = re.compile(rf"^{re.escape(api_prefix)}/lists/[^/]+/events$")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or self._is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self.controller.check_client(self._client(scope))
+        except Overloaded as exc:
+            await self._reject(scope, receive, send, exc, 429)
+            return
+
+        read = scope["method"] in ("GET", "HEAD")
+        if read and (self._events_path.match(scope["path"]) or self._is_cached(scope["path"])):
+            self.controller.record_bypass()
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(READ if read else WRITE)
+        except Overloaded as exc:
+            await self._reject(scope, receive, send, exc, 503)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+    def _is_exempt(self, path: str) -> bool:
+        return path in self.exempt_paths or path.removeprefix(self.api_prefix) in self.exempt_paths
+
+    def _client(self, scope) -> str:
+        if self.client_header:
+            for name, value in scope["headers"]:
+                if name == self.client_header:
+                    return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    def _is_cached(self, path: str) -> bool:
+        match = self._list_path.match(path)
+        return match is not None and self.list_cache.peek(match.group(1)) is not None
+
+    async def _reject(self, scope, receive, send, exc: Overloaded, status_code: int) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content={
+                "error": True,
+                "message": "too many requests" if status_code == 429 else "service overloaded",
+                "details": f"Request rejected by admission control ({exc.reason}), retry after {exc.retry_after}s.",
+            },
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+        await response(scope, receive, send)
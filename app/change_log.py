@@ -0,0 +1,193 @@
+"""Change log of todo lists: change records and their background compaction."""
+import asyncio
+import logging
+import uuid
+
+from sqlalchemy import func, select
+
+from app.db.database import Database
+from app.db.models import TodoListChangeOrm
+from app.entities import TodoListEventType
+
+logger = logging.getLogger(__name__)
+
+# Only one worker at a time trims and compacts the log
+_COMPACT_LOCK_KEY = 0x63686C67
+
+
+def make_change(op: TodoListEventType, task_id: uuid.UUID | None = None, **fields) -> dict:
+    """Change record for TodoListChangeRepository.append, keeping only the fields that were set."""
+    data = {key: value for key, value in fields.items() if value is not None}
+    return {"op": op.value, "task_id": task_id, "data": data or None}
+
+
+def compact_changes(changes: list[TodoListChangeOrm]) -> tuple[list[int], list[dict]]:
+    """Merge the changes of one list, given in log order, into one change per task.
+
+    Returns IDs of the changes to delete and the rows that replace them. A merged change keeps the
+    version and created_at of the last change it replaces, so a client that has seen some of the
+    replaced changes gets their fields once more, with the values they have now. Creation followed
+    by updates stays a creation, anything followed by a deletion becomes the deletion. Changes before
+    the last list_reloaded are dropped: a client that far behind gets a snapshot anyway.
+    """
+    reloads = [position for position, change in enumerate(changes) if change.op == TodoListEventType.LIST_RELOADED.value]
+    start = reloads[-1] if reloads else 0
+    deleted = [change.id for change in changes[:start]]
+
+    merged: dict[uuid.UUID | None, list[TodoListChangeOrm]] = {}
+    for change in changes[start:]:
+        if change.op == TodoListEventType.LIST_RELOADED.value:
+            continue
+        # List changes have no task_id and merge with each other under None
+        merged.setdefault(change.task_id, []).append(change)
+
+    replacements = []
+    for group in merged.values():
+        if len(group) == 1:
+            continue
+        last = group[-1]
+        if last.op == TodoListEventType.TASK_DELETED.value:
+            op, data = last.op, None
+        else:
+            created = group[0].op == TodoListEventType.TASK_CREATED.value
+            op, data = TodoListEventType.TASK_CREATED.value if created else last.op, {}
+            for change in group:
+                data.update(change.data or {})
+        deleted.extend(change.id for change in group)
+        replacements.append({
+            "todo_list_id": last.todo_list_id,
+            "version": last.version,
+            "op": op,
+            "task_id": last.task_id,
+            "data": data or None,
+            "created_at": last.created_at,
+        })
+    return deleted, replacements
+
+
+class ChangeLogCompactor:
+    """Trims the change log and merges the changes of lists with long logs.
+
+    Changes older than retention seconds, or more than max_versions versions behind their list, are deleted:
+    a client that far behind gets a snapshot instead of changes. Lists with more than threshold changes
+    left have their changes merged per task. Every step is its own short transaction. Only lists with changes
+    appended since the previous pass are looked at, so a pass costs what was appended meanwhile and not
+    what the log holds.
+    """
+
+    def __init__(self, interval: float = 60.0, retention: float = 86400.0, max_versions: int = 1000,
+                 threshold: int = 200, batch_size: int = 1000):
+        self.interval = interval
+        self.retention = retention
+        self.max_versions = max_versions
+        self.threshold = threshold
+        self.batch_size = batch_size
+
+        self._database: Database | None = None
+        self._task: asyncio.Task | None = None
+        # Highest change ID seen, a new worker starts from the beginning of the log once
+        self._after_id = 0
+
+        self.trimmed = 0
+        self.compacted_lists = 0
+        self.merged = 0
+        self.runs = 0
+
+    async def start(self, database: Database) -> None:
+        self._database = database
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def changed_lists(self) -> list[uuid.UUID]:
+        """IDs of lists with changes appended since the previous call."""
+        # A change whose transaction commits after changes with higher IDs were seen is missed here,
+        # its list is looked at again with its next change
+        list_ids: dict[uuid.UUID, None] = {}
+        while True:
+            async with self._database.get_unit_of_work() as uow:
+                rows = await uow.todo_list_changes.get_list_ids_after(uow.session, self._after_id, self.batch_size)
+            for change_id, list_id in rows:
+                list_ids[list_id] = None
+            if rows:
+                self._after_id = rows[-1][0]
+            if len(rows) < self.batch_size:
+                return list(list_ids)
+
+    async def trim(self, list_ids: list[uuid.UUID]) -> int:
+        """Delete expired changes, and changes of list_ids too far behind, until none are left.
+
+        Returns number of deleted changes.
+        """
+        trimmed = await self._trim(lambda uow: uow.todo_list_changes.delete_older_than(uow.session, self.retention, self.batch_size))
+        for list_id in list_ids:
+            trimmed += await self._trim(lambda uow: uow.todo_list_changes.delete_behind(
+                uow.session, list_id, self.max_versions, self.batch_size))
+        return trimmed
+
+    async def compact(self, list_ids: list[uuid.UUID]) -> int:
+        """Merge the changes of those of list_ids with more than threshold of them. Returns number of removed changes."""
+        long_list_ids = []
+        for start in range(0, len(list_ids), self.batch_size):
+            async with self._database.get_unit_of_work() as uow:
+                long_list_ids += await uow.todo_list_changes.get_list_ids_over(
+                    uow.session, list_ids[start:start + self.batch_size], self.threshold)
+        removed = 0
+        for list_id in long_list_ids:
+            async with self._database.get_unit_of_work() as uow:
+                if not await self._lock(uow):
+                    return removed
+                # Changes committed after this read have higher versions and are left as they are
+                changes = await uow.todo_list_changes.get_by_list_id(uow.session, list_id)
+                deleted, replacements = compact_changes(changes)
+                await uow.todo_list_changes.delete_by_ids(uow.session, deleted)
+                await uow.todo_list_changes.bulk_create(uow.session, replacements)
+                await uow.commit()
+            if deleted:
+                self.compacted_lists += 1
+                self.merged += len(deleted) - len(replacements)
+                removed += len(deleted) - len(replacements)
+        return removed
+
+    def stats(self) -> dict:
+        return {
+            "trimmed": self.trimmed,
+            "compacted_lists": self.compacted_lists,
+            "merged": self.merged,
+            "runs": self.runs,
+        }
+
+    async def _lock(self, uow) -> bool:
+        return await uow.session.scalar(select(func.pg_try_advisory_xact_lock(_COMPACT_LOCK_KEY)))
+
+    async def _trim(self, delete_batch) -> int:
+        trimmed = 0
+        while True:
+            async with self._database.get_unit_of_work() as uow:
+                if not await self._lock(uow):
+                    return trimmed
+                deleted = await delete_batch(uow)
+                await uow.commit()
+            self.trimmed += deleted
+            trimmed += deleted
+            if deleted < self.batch_size:
+                return trimmed
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                list_ids = await self.changed_lists()
+                await self.trim(list_ids)
+                await self.compact(list_ids)
+                self.runs += 1
+            except Exception:
+                logger.exception("Failed to compact the change log")
+            await asyncio.sleep(self.interval)
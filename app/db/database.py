@@ -1,44 +1,107 @@
-import random
-from sqlalchemy import select, text
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import asyncio
+import logging
+import time
+from pathlib import Path
+
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 
-from app.db.models import Base, TodoTaskOrm, TodoListOrm
+from app.db.models import Base
 from app.db.unit_of_work import UnitOfWork
 from app.core import settings
-import uuid
+from app.db.pooling import engine_options, pool_stats
+from app.metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent.parent / "alembic.ini"
 
-import time
 
 class Database:
-    def __init__(self, database_url: str):
-        self.engine = create_engine(
-            database_url, 
-            echo=settings.db_echo,
-            pool_size=settings.db_pool_size, 
-            max_overflow=settings.db_max_overflow,
-            pool_timeout=settings.db_pool_timeout,
-            pool_recycle=settings.db_pool_recycle,
-        )
-        with self.engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-            print("✅ Подключение к базе данных успешно!")
+    def __init__(self, database_url: str, read_database_url: str | None = None):
+        options = engine_options(settings)
+        self.engine = create_async_engine(database_url, **options)
+        if settings.metrics_enabled:
+            instrument_engine(self.engine)
         self.metadata = Base.metadata
-        self.session_maker = sessionmaker(autoflush=False, bind=self.engine)
-        self.__create_tables()
+        self.session_maker = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=self.engine)
+
+        # Reads that may lag behind the primary go to the replica, everything else to the primary
+        self.read_engine = self.engine
+        self.read_session_maker = self.session_maker
+        if read_database_url:
+            self.read_engine = create_async_engine(read_database_url, **options)
+            if settings.metrics_enabled:
+                instrument_engine(self.read_engine, pool_gauges=False)
+            self.read_session_maker = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=self.read_engine)
+
+    @property
+    def pool_size(self) -> int:
+        return pool_stats(self.engine).get("size", 0)
+
+    async def connect(self, warm_connections: int = 1):
+        """Check the databases and open warm_connections pool connections of every engine concurrently."""
+        started_at = time.perf_counter()
+        # Without a pool (size 0) there is nothing to keep, one connection only checks the database
+        warm_connections = max(warm_connections, 1)
+        engines = [self.engine] if self.read_engine is self.engine else [self.engine, self.read_engine]
+        await self.check_schema()
+        async with asyncio.TaskGroup() as group:
+            for engine in engines:
+                # Every connection is held until all are open, otherwise the pool would hand out the same one again
+                barrier = asyncio.Barrier(warm_connections)
+                for _ in range(warm_connections):
+                    group.create_task(self._open_connection(engine, barrier))
+        logger.info("Opened %d database connections in %.3fs", warm_connections * len(engines), time.perf_counter() - started_at)
+
+    async def check_schema(self):
+        """Refuse to start on a database that is behind the migrations of this code.
+
+        Otherwise the first query of a missing column or table fails at request time. A database ahead of
+        this code (migrated for a newer release during a rolling deploy) is accepted.
+        """
+        scripts = ScriptDirectory.from_config(Config(str(ALEMBIC_INI)))
+        async with self.engine.connect() as conn:
+            try:
+                revisions = set((await conn.execute(text("SELECT version_num FROM alembic_version"))).scalars())
+            except ProgrammingError:
+                revisions = set()
+        heads = set(scripts.get_heads())
+        known = {script.revision for script in scripts.walk_revisions()}
+        if not revisions or (revisions <= known and revisions != heads):
+            raise RuntimeError(
+                f"Database schema is at revision {', '.join(sorted(revisions)) or 'none'}, this code needs "
+                f"{', '.join(sorted(heads))}: run `alembic upgrade head` first."
+            )
+
+    async def _open_connection(self, engine: AsyncEngine, barrier: asyncio.Barrier):
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            await barrier.wait()
 
     def get_unit_of_work(self):
         return UnitOfWork(self.session_maker)
 
-    def __create_tables(self):
-        # self.metadata.drop_all(self.engine)
-        self.metadata.create_all(self.engine)
+    def get_read_unit_of_work(self):
+        """Unit of work on the read replica (the primary if there is none). Only for reads that tolerate replication lag."""
+        return UnitOfWork(self.read_session_maker)
+
+    def pool_stats(self) -> dict:
+        stats = {"primary": pool_stats(self.engine)}
+        if self.read_engine is not self.engine:
+            stats["replica"] = pool_stats(self.read_engine)
+        return stats
 
-    def test_connection(self):
-        with self.session_maker() as session:
-            res = session.execute(text("SELECT VERSION()"))
+    async def test_connection(self):
+        async with self.session_maker() as session:
+            res = await session.execute(text("SELECT VERSION()"))
             print("Database version:", res.scalar())
 
-        
-    def dispose(self):
-        self.engine.dispose()
+
+    async def dispose(self):
+        await self.engine.dispose()
+        if self.read_engine is not self.engine:
+            await self.read_engine.dispose()
@@ -1,7 +1,7 @@
 import datetime
-from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import Float, String, ForeignKey
+from sqlalchemy import BigInteger, DateTime, Float, String, ForeignKey, Identity, Index, Sequence, func, text
+from sqlalchemy.dialects.postgresql import JSONB
 import uuid
 
 from typing import Annotated
@@ -11,18 +11,31 @@ uuidpk = Annotated[uuid.UUID, mapped_column(primary_key=True)]
 class Base(DeclarativeBase):
     pass
 
+# Source of collision-free slugs for the sequence and block slug strategies
+slug_sequence = Sequence("todo_list_slug_seq", start=0, minvalue=0, metadata=Base.metadata)
+
 class TodoListOrm(Base):
     __tablename__ = "todo_lists"
     id: Mapped[uuidpk]
     name: Mapped[str] = mapped_column(String(100))
-    slug: Mapped[str] = mapped_column(String(16), unique=True)
+    # NULL for deleted lists: the slug goes to a new free list at once, the deleted row waits for the purger
+    slug: Mapped[str | None] = mapped_column(String(16), unique=True)
     is_free: Mapped[bool] = mapped_column(default=True)
+    version: Mapped[int] = mapped_column(default=1)
+    deleted_at: Mapped[datetime.datetime | None] = mapped_column(DateTime(timezone=True))
 
     tasks: Mapped[list["TodoTaskOrm"]] = relationship(
         back_populates="todo_list",
-        order_by="TodoTaskOrm.weight",
+        order_by="[TodoTaskOrm.weight, TodoTaskOrm.id]",
         cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Claiming a free list scans only the (small) pool of free rows
+        Index("ix_todo_lists_free", "id", postgresql_where=text("is_free")),
+        # The purger finds deleted lists without scanning live ones
+        Index("ix_todo_lists_deleted", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
+
 class TodoTaskOrm(Base):
     __tablename__ = "todo_tasks"
 
@@ -33,3 +46,30 @@ class TodoTaskOrm(Base):
     weight: Mapped[float] = mapped_column(Float, default=0.0)
 
     todo_list: Mapped["TodoListOrm"] = relationship(back_populates="tasks")
+
+    __table_args__ = (
+        # Loading a list in order and looking up move neighbours by (weight, id)
+        Index("ix_todo_tasks_list_weight", "todo_list_id", "weight", "id"),
+    )
+
+# Append-only log of task and list changes for delta sync, one or more rows per list version
+class TodoListChangeOrm(Base):
+    __tablename__ = "todo_list_changes"
+
+    id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    todo_list_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("todo_lists.id", ondelete="CASCADE"))
+    version: Mapped[int]
+    op: Mapped[str] = mapped_column(String(16))
+    task_id: Mapped[uuid.UUID | None]
+    # Only the fields the change set: task, is_done, weight for tasks, name for the list
+    data: Mapped[dict | None] = mapped_column(JSONB)
+    # Time of the INSERT, not of the transaction start: rows are appended under the list row lock,
+    # so for every list created_at grows with version and trimming by age only removes a prefix
+    created_at: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True), server_default=func.clock_timestamp())
+
+    __table_args__ = (
+        # Changes of a list after a version, and its oldest retained version
+        Index("ix_todo_list_changes_list_version", "todo_list_id", "version"),
+        # Trimming by age
+        Index("ix_todo_list_changes_created", "created_at"),
+    )
@@ -0,0 +1,73 @@
+"""Connection pool sizing and engine options derived from settings."""
+import uuid
+from dataclasses import dataclass
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import NullPool
+
+from app.core import Settings
+from app.metrics import InstrumentedQueuePool
+
+
+@dataclass
+class PoolLimits:
+    pool_size: int
+    max_overflow: int
+
+
+def pool_limits(settings: Settings) -> PoolLimits:
+    """Pool size of one worker.
+
+    Without a connection budget (db_max_connections 0) db_pool_size and db_max_overflow are used as is.
+    With one, the budget is shared by web_concurrency workers, less the LISTEN connection of each worker
+    with the postgres events backend, and every worker gets at most db_pool_size steady connections.
+    """
+    if settings.db_max_connections <= 0:
+        return PoolLimits(settings.db_pool_size, settings.db_max_overflow)
+    per_worker = settings.db_max_connections // max(settings.web_concurrency, 1)
+    if settings.events_backend == "postgres":
+        per_worker -= 1
+    per_worker = max(per_worker, 1)
+    pool_size = min(settings.db_pool_size, per_worker)
+    return PoolLimits(pool_size, per_worker - pool_size)
+
+
+def engine_options(settings: Settings) -> dict:
+    """Keyword arguments of create_async_engine for the primary and the replica engines."""
+    options = {"echo": settings.db_echo, "pool_pre_ping": settings.db_pool_pre_ping}
+    if settings.db_pool_mode == "null":
+        # Every session opens its own connection, pooling is left to PgBouncer or a similar proxy
+        options["poolclass"] = NullPool
+    else:
+        limits = pool_limits(settings)
+        options.update(
+            pool_size=limits.pool_size,
+            max_overflow=limits.max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+        )
+        if settings.metrics_enabled:
+            options["poolclass"] = InstrumentedQueuePool
+    if settings.db_pgbouncer:
+        # A transaction-mode pooler hands every transaction a different server connection: prepared
+        # statements can't be cached per connection and their names must not collide across clients
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        }
+    return options
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.sync_engine.pool
+    stats = {"pool": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            timeout=pool.timeout(),
+        )
+    return stats
@@ -1,5 +1,6 @@
 """Repository exports."""
+from app.db.repositories.todo_list_change_repository import TodoListChangeRepository
 from app.db.repositories.todo_list_repository import TodoListRepository
 from app.db.repositories.todo_task_repository import TodoTaskRepository
 
-__all__ = ["TodoListRepository", "TodoTaskRepository"]
+__all__ = ["TodoListChangeRepository", "TodoListRepository", "TodoTaskRepository"]
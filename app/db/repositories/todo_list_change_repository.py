@@ -0,0 +1,115 @@
+"""Repository for the change log of todo lists."""
+import datetime
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.models import TodoListChangeOrm, TodoListOrm
+import uuid
+
+
+class TodoListChangeRepository:
+    """Repository for appending, reading and trimming todo list changes."""
+
+    async def append(self, session: AsyncSession, list_id: uuid.UUID, version: int, changes: list[dict]) -> None:
+        """Append changes of one list version with one INSERT statement. Changes contain op, task_id and data."""
+        await self.bulk_create(session, [{"todo_list_id": list_id, "version": version, **change} for change in changes])
+
+    async def bulk_create(self, session: AsyncSession, rows: list[dict]) -> None:
+        """Insert many changes with one INSERT statement. Rows contain column values."""
+        if rows:
+            await session.execute(insert(TodoListChangeOrm), rows)
+
+    async def get_min_version(self, session: AsyncSession, list_id: uuid.UUID) -> int | None:
+        """Oldest version of the list still in the log."""
+        stmt = select(func.min(TodoListChangeOrm.version)).where(TodoListChangeOrm.todo_list_id == list_id)
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def get_since(self, session: AsyncSession, list_id: uuid.UUID, since: int, until: int, limit: int) -> list[TodoListChangeOrm]:
+        """Get up to limit changes of the list with since < version <= until, in the order they were made."""
+        stmt = (
+            select(TodoListChangeOrm)
+            .where(
+                TodoListChangeOrm.todo_list_id == list_id,
+                TodoListChangeOrm.version > since,
+                TodoListChangeOrm.version <= until,
+            )
+            .order_by(TodoListChangeOrm.version, TodoListChangeOrm.id)
+            .limit(limit)
+        )
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def get_latest_versions(self, session: AsyncSession, list_id: uuid.UUID, task_ids: list[uuid.UUID], since: int,
+                                  list_ops: list[str], exclude_versions: list[int]) -> dict[uuid.UUID | None, int]:
+        """Latest version after since that changed each of the tasks, not counting exclude_versions.
+
+        Changes with an op in list_ops may have changed any task, their latest version is under None.
+        """
+        stmt = (
+            select(TodoListChangeOrm.task_id, func.max(TodoListChangeOrm.version))
+            .where(
+                TodoListChangeOrm.todo_list_id == list_id,
+                TodoListChangeOrm.version > since,
+                or_(TodoListChangeOrm.task_id.in_(task_ids), TodoListChangeOrm.op.in_(list_ops)),
+            )
+            .group_by(TodoListChangeOrm.task_id)
+        )
+        if exclude_versions:
+            stmt = stmt.where(TodoListChangeOrm.version.not_in(exclude_versions))
+        return {task_id: version for task_id, version in (await session.execute(stmt)).all()}
+
+    async def get_by_list_id(self, session: AsyncSession, list_id: uuid.UUID) -> list[TodoListChangeOrm]:
+        """Get all changes of the list in the order they were made."""
+        stmt = (
+            select(TodoListChangeOrm)
+            .where(TodoListChangeOrm.todo_list_id == list_id)
+            .order_by(TodoListChangeOrm.version, TodoListChangeOrm.id)
+        )
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def get_list_ids_after(self, session: AsyncSession, after_id: int, limit: int) -> list[tuple[int, uuid.UUID]]:
+        """(id, list ID) of the next limit changes with IDs above after_id, in ID order."""
+        stmt = (
+            select(TodoListChangeOrm.id, TodoListChangeOrm.todo_list_id)
+            .where(TodoListChangeOrm.id > after_id)
+            .order_by(TodoListChangeOrm.id)
+            .limit(limit)
+        )
+        return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+    async def get_list_ids_over(self, session: AsyncSession, list_ids: list[uuid.UUID], threshold: int) -> list[uuid.UUID]:
+        """IDs of the given lists that have more than threshold changes in the log."""
+        if not list_ids:
+            return []
+        stmt = (
+            select(TodoListChangeOrm.todo_list_id)
+            .where(TodoListChangeOrm.todo_list_id.in_(list_ids))
+            .group_by(TodoListChangeOrm.todo_list_id)
+            .having(func.count() > threshold)
+        )
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def delete_by_ids(self, session: AsyncSession, change_ids: list[int]) -> None:
+        """Delete changes by IDs with one DELETE statement."""
+        if change_ids:
+            stmt = delete(TodoListChangeOrm).where(TodoListChangeOrm.id.in_(change_ids))
+            await session.execute(stmt.execution_options(synchronize_session=False))
+
+    async def delete_older_than(self, session: AsyncSession, age: float, limit: int) -> int:
+        """Delete up to limit changes made more than age seconds ago. Returns number of deleted changes."""
+        batch = (
+            select(TodoListChangeOrm.id)
+            .where(TodoListChangeOrm.created_at < func.now() - datetime.timedelta(seconds=age))
+            .limit(limit)
+        )
+        stmt = delete(TodoListChangeOrm).where(TodoListChangeOrm.id.in_(batch)).execution_options(synchronize_session=False)
+        return (await session.execute(stmt)).rowcount
+
+    async def delete_behind(self, session: AsyncSession, list_id: uuid.UUID, versions: int, limit: int) -> int:
+        """Delete up to limit changes of the list more than versions versions behind it. Returns number of deleted changes."""
+        list_version = select(TodoListOrm.version).where(TodoListOrm.id == list_id).scalar_subquery()
+        batch = (
+            select(TodoListChangeOrm.id)
+            .where(TodoListChangeOrm.todo_list_id == list_id, TodoListChangeOrm.version <= list_version - versions)
+            .limit(limit)
+        )
+        stmt = delete(TodoListChangeOrm).where(TodoListChangeOrm.id.in_(batch)).execution_options(synchronize_session=False)
+        return (await session.execute(stmt)).rowcount
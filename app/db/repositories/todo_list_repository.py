@@ -1,54 +1,102 @@
 """Repository for TodoList entity operations."""
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from app.db.models import TodoListOrm
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.db.models import TodoListOrm, slug_sequence
 import uuid
 
 
 class TodoListRepository:
     """Repository for managing TodoList entities."""
     
-    def create(self, session: Session, name: str, slug: str, is_free: bool = True) -> TodoListOrm:
+    async def create(self, session: AsyncSession, name: str, slug: str, is_free: bool = True, version: int = 1) -> TodoListOrm:
         """Create a new todo list."""
         todo_list = TodoListOrm(
             id=uuid.uuid4(),
             name=name,
             slug=slug,
-            is_free=is_free
+            is_free=is_free,
+            version=version
         )
         session.add(todo_list)
-        # session.flush()
+        await session.flush()
         return todo_list
     
-    def get_one_free(self, session: Session) -> TodoListOrm | None:
-        """Get one free todo list."""
-        stmt = select(TodoListOrm).where(TodoListOrm.is_free == True).limit(1).with_for_update(skip_locked=True)
-        result = session.execute(stmt).scalar_one_or_none()
-        return result
+    async def create_free_many(self, session: AsyncSession, slugs: list[str]) -> int:
+        """Create free todo lists with the given slugs, skipping slugs that are taken. Returns number of created lists."""
+        if not slugs:
+            return 0
+        stmt = (
+            insert(TodoListOrm)
+            .values([{"id": uuid.uuid4(), "name": "", "slug": slug, "is_free": True, "version": 1} for slug in slugs])
+            .on_conflict_do_nothing(index_elements=[TodoListOrm.slug])
+        )
+        result = await session.execute(stmt)
+        return result.rowcount
+
+    async def claim_free(self, session: AsyncSession, name: str) -> TodoListOrm | None:
+        """Take one free todo list and give it a name with a single UPDATE ... RETURNING statement."""
+        free_id = (
+            select(TodoListOrm.id)
+            .where(TodoListOrm.is_free == True)
+            # Ordering by the key of ix_todo_lists_free makes the planner walk the partial index instead
+            # of scanning the heap until it meets a free row
+            .order_by(TodoListOrm.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        stmt = (
+            update(TodoListOrm)
+            .where(TodoListOrm.id == free_id)
+            .values(name=name, is_free=False, version=TodoListOrm.version + 1)
+            .returning(TodoListOrm)
+        )
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def count_free(self, session: AsyncSession) -> int:
+        """Count free todo lists."""
+        stmt = select(func.count()).select_from(TodoListOrm).where(TodoListOrm.is_free == True)
+        return (await session.execute(stmt)).scalar_one()
     
-    def get_by_slug(self, session: Session, slug: str, with_tasks: bool = False, with_block: bool = False) -> TodoListOrm | None:
+    async def count(self, session: AsyncSession) -> int:
+        """Count todo lists holding a slug (taken and free, not deleted)."""
+        return await session.scalar(select(func.count(TodoListOrm.slug)))
+
+    async def next_slug_numbers(self, session: AsyncSession, count: int) -> list[int]:
+        """Reserve count values of the slug sequence in one round trip."""
+        stmt = select(slug_sequence.next_value()).select_from(func.generate_series(1, count))
+        return list((await session.scalars(stmt)).all())
+
+    async def get_by_slug(self, session: AsyncSession, slug: str, with_tasks: bool = False, with_block: bool = False) -> TodoListOrm | None:
         """Get todo list by slug."""
         if with_block:
             stmt = select(TodoListOrm).where(TodoListOrm.slug == slug).with_for_update()
         else:
             stmt = select(TodoListOrm).where(TodoListOrm.slug == slug)
-        result = session.execute(stmt).scalar_one_or_none()
-        if result and with_tasks:
-            result.tasks
+        if with_tasks:
+            stmt = stmt.options(selectinload(TodoListOrm.tasks))
+        result = (await session.execute(stmt)).scalar_one_or_none()
         return result
     
-    def get_by_id(self, session: Session, list_id: uuid.UUID, with_tasks: bool = False, with_block: bool = False) -> TodoListOrm | None:
+    async def get_version_by_slug(self, session: AsyncSession, slug: str) -> int | None:
+        """Get version of a taken todo list by slug without loading the list itself."""
+        stmt = select(TodoListOrm.version).where(TodoListOrm.slug == slug, TodoListOrm.is_free == False)
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def get_by_id(self, session: AsyncSession, list_id: uuid.UUID, with_tasks: bool = False, with_block: bool = False) -> TodoListOrm | None:
         """Get todo list by ID."""
         if with_block:
             stmt = select(TodoListOrm).where(TodoListOrm.id == list_id).with_for_update()
         else:
             stmt = select(TodoListOrm).where(TodoListOrm.id == list_id)
-        result = session.execute(stmt).scalar_one_or_none()
-        if result and with_tasks:
-            result.tasks
+        if with_tasks:
+            stmt = stmt.options(selectinload(TodoListOrm.tasks))
+        result = (await session.execute(stmt)).scalar_one_or_none()
         return result
     
-    def update(self, session: Session, todo_list: TodoListOrm, name: str = None, is_free: bool = None) -> TodoListOrm:
+    async def update(self, session: AsyncSession, todo_list: TodoListOrm, name: str = None, is_free: bool = None) -> TodoListOrm:
         """Update todo list."""
         if name is not None:
             todo_list.name = name
@@ -57,25 +105,71 @@ class TodoListRepository:
 
         return todo_list
     
-    def free(self, session: Session, todo_list: TodoListOrm) -> None:
+    async def bump_version(self, session: AsyncSession, todo_list: TodoListOrm) -> None:
+        """Increment todo list version. The list row is expected to be locked by the caller."""
+        todo_list.version += 1
+
+    async def increment_version(self, session: AsyncSession, list_id: uuid.UUID) -> int | None:
+        """Increment version of a taken todo list with one UPDATE and return the new version (None if it is free or deleted).
+
+        The UPDATE locks the list row until the end of the transaction.
+        """
+        stmt = (
+            update(TodoListOrm)
+            .where(TodoListOrm.id == list_id, TodoListOrm.is_free == False, TodoListOrm.deleted_at.is_(None))
+            .values(version=TodoListOrm.version + 1)
+            .returning(TodoListOrm.version)
+            .execution_options(synchronize_session=False, takes_lock=True)
+        )
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def free(self, session: AsyncSession, todo_list: TodoListOrm) -> None:
         """Mark todo list as free."""
         todo_list.is_free = True
-        session.flush()
+        await session.flush()
+
+    async def tombstone(self, session: AsyncSession, todo_list: TodoListOrm) -> None:
+        """Mark todo list as deleted and release its slug. Its tasks stay until purged."""
+        todo_list.slug = None
+        todo_list.is_free = False
+        todo_list.deleted_at = func.now()
+        await session.flush()
+
+    async def lock_next_deleted(self, session: AsyncSession) -> uuid.UUID | None:
+        """Lock the oldest deleted todo list that no other transaction has locked and return its ID."""
+        stmt = (
+            select(TodoListOrm.id)
+            .where(TodoListOrm.deleted_at.is_not(None))
+            .order_by(TodoListOrm.deleted_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def count_deleted(self, session: AsyncSession) -> int:
+        """Count deleted todo lists waiting to be purged."""
+        stmt = select(func.count()).select_from(TodoListOrm).where(TodoListOrm.deleted_at.is_not(None))
+        return (await session.execute(stmt)).scalar_one()
+
+    async def delete_deleted(self, session: AsyncSession, list_id: uuid.UUID) -> None:
+        """Remove the row of a deleted todo list. Its tasks have to be purged first."""
+        stmt = delete(TodoListOrm).where(TodoListOrm.id == list_id, TodoListOrm.deleted_at.is_not(None))
+        await session.execute(stmt)
 
-    def take_up(self, session: Session, todo_list: TodoListOrm) -> None:
+    async def take_up(self, session: AsyncSession, todo_list: TodoListOrm) -> None:
         """Mark todo list as taken."""
         todo_list.is_free = False
-        session.flush()
+        await session.flush()
     
-    def delete(self, session: Session, todo_list: TodoListOrm) -> None:
+    async def delete(self, session: AsyncSession, todo_list: TodoListOrm) -> None:
         """Delete todo list."""
-        session.delete(todo_list)
-        session.flush()
+        await session.delete(todo_list)
+        await session.flush()
     
-    def delete_by_slug(self, session: Session, slug: str) -> bool:
+    async def delete_by_slug(self, session: AsyncSession, slug: str) -> bool:
         """Delete todo list by slug. Returns True if deleted, False if not found."""
-        todo_list = self.get_by_slug(session, slug)
-        if todo_list:
-            self.delete(session, todo_list)
+        todo_list = await self.get_by_slug(session, slug)
+        if todo_list and not todo_list.is_free:
+            await self.delete(session, todo_list)
             return True
         return False
@@ -1,6 +1,8 @@
 """Repository for TodoTask entity operations."""
-from sqlalchemy import delete, select
-from sqlalchemy.orm import Session
+from typing import AsyncIterator
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.models import TodoTaskOrm
 import uuid
 
@@ -8,9 +10,9 @@ import uuid
 class TodoTaskRepository:
     """Repository for managing TodoTask entities."""
     
-    def create(
+    async def create(
         self,
-        session: Session,
+        session: AsyncSession,
         task: str,
         todo_list_id: uuid.UUID,
         is_done: bool = False,
@@ -25,27 +27,173 @@ class TodoTaskRepository:
             weight=weight
         )
         session.add(todo_task)
-        session.flush()
+        await session.flush()
         return todo_task
     
-    def get_by_id(self, session: Session, task_id: uuid.UUID, with_block: bool = False) -> TodoTaskOrm | None:
-        """Get todo task by ID."""
+    async def get_by_id(self, session: AsyncSession, task_id: uuid.UUID, with_block: bool = False, list_id: uuid.UUID | None = None) -> TodoTaskOrm | None:
+        """Get todo task by ID, optionally only if it belongs to the given list."""
         stmt = select(TodoTaskOrm).where(TodoTaskOrm.id == task_id)
+        if list_id is not None:
+            stmt = stmt.where(TodoTaskOrm.todo_list_id == list_id)
         if with_block:
             stmt = stmt.with_for_update()
-        return session.execute(stmt).scalar_one_or_none()
+        return (await session.execute(stmt)).scalar_one_or_none()
     
-    def get_by_list_id(self, session: Session, list_id: uuid.UUID, with_block: bool = False) -> list[TodoTaskOrm]:
+    async def get_weight(self, session: AsyncSession, list_id: uuid.UUID, task_id: uuid.UUID) -> float | None:
+        """Get current weight of a task of the list."""
+        stmt = select(TodoTaskOrm.weight).where(TodoTaskOrm.id == task_id, TodoTaskOrm.todo_list_id == list_id)
+        return (await session.execute(stmt)).scalar_one_or_none()
+
+    async def get_boundary_weight(self, session: AsyncSession, list_id: uuid.UUID, last: bool, exclude_id: uuid.UUID | None = None) -> float | None:
+        """Get the smallest (or the largest if last) task weight of the list."""
+        stmt = select(TodoTaskOrm.weight).where(TodoTaskOrm.todo_list_id == list_id)
+        if exclude_id is not None:
+            stmt = stmt.where(TodoTaskOrm.id != exclude_id)
+        if last:
+            stmt = stmt.order_by(TodoTaskOrm.weight.desc(), TodoTaskOrm.id.desc())
+        else:
+            stmt = stmt.order_by(TodoTaskOrm.weight, TodoTaskOrm.id)
+        return (await session.execute(stmt.limit(1))).scalar_one_or_none()
+
+    async def get_adjacent_weight(
+        self,
+        session: AsyncSession,
+        list_id: uuid.UUID,
+        task_id: uuid.UUID,
+        weight: float,
+        after: bool,
+        exclude_id: uuid.UUID | None = None
+    ) -> float | None:
+        """Get weight of the task right before (or right after if after) the given one in (weight, id) order."""
+        key = tuple_(TodoTaskOrm.weight, TodoTaskOrm.id)
+        stmt = select(TodoTaskOrm.weight).where(TodoTaskOrm.todo_list_id == list_id)
+        if exclude_id is not None:
+            stmt = stmt.where(TodoTaskOrm.id != exclude_id)
+        if after:
+            stmt = stmt.where(key > tuple_(weight, task_id)).order_by(TodoTaskOrm.weight, TodoTaskOrm.id)
+        else:
+            stmt = stmt.where(key < tuple_(weight, task_id)).order_by(TodoTaskOrm.weight.desc(), TodoTaskOrm.id.desc())
+        return (await session.execute(stmt.limit(1))).scalar_one_or_none()
+
+    async def get_by_ids(self, session: AsyncSession, task_ids: list[uuid.UUID]) -> list[TodoTaskOrm]:
+        """Get todo tasks by IDs."""
+        stmt = select(TodoTaskOrm).where(TodoTaskOrm.id.in_(task_ids))
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def lock_by_ids(self, session: AsyncSession, list_id: uuid.UUID, task_ids: list[uuid.UUID]) -> list[uuid.UUID]:
+        """Lock tasks of the list by IDs in ID order, so concurrent lockers of overlapping sets can't deadlock.
+
+        Returns IDs of the tasks that exist.
+        """
+        if not task_ids:
+            return []
+        stmt = (
+            select(TodoTaskOrm.id)
+            .where(TodoTaskOrm.todo_list_id == list_id, TodoTaskOrm.id.in_(task_ids))
+            .order_by(TodoTaskOrm.id)
+            .with_for_update()
+        )
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def lock_where(self, session: AsyncSession, list_id: uuid.UUID, *conditions) -> list[uuid.UUID]:
+        """Lock tasks of the list matching conditions (all of them without) in ID order, like lock_by_ids.
+
+        Set-based statements lock rows in scan order, so they are preceded by this. Returns IDs of the locked tasks.
+        """
+        stmt = (
+            select(TodoTaskOrm.id)
+            .where(TodoTaskOrm.todo_list_id == list_id, *conditions)
+            .order_by(TodoTaskOrm.id)
+            .with_for_update()
+        )
+        return list((await session.execute(stmt)).scalars().all())
+
+    async def get_weight_keys(self, session: AsyncSession, list_id: uuid.UUID) -> list[tuple[float, uuid.UUID]]:
+        """Get (weight, id) of all tasks of the list ordered by weight, without loading task objects."""
+        stmt = (
+            select(TodoTaskOrm.weight, TodoTaskOrm.id)
+            .where(TodoTaskOrm.todo_list_id == list_id)
+            .order_by(TodoTaskOrm.weight, TodoTaskOrm.id)
+        )
+        return [tuple(row) for row in (await session.execute(stmt)).all()]
+
+    def _page_stmt(self, list_id: uuid.UUID, after: tuple[float, uuid.UUID] | None):
+        stmt = (
+            select(TodoTaskOrm.id, TodoTaskOrm.task, TodoTaskOrm.is_done, TodoTaskOrm.weight)
+            .where(TodoTaskOrm.todo_list_id == list_id)
+            .order_by(TodoTaskOrm.weight, TodoTaskOrm.id)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(TodoTaskOrm.weight, TodoTaskOrm.id) > tuple_(*after))
+        return stmt
+
+    async def get_page(
+        self,
+        session: AsyncSession,
+        list_id: uuid.UUID,
+        after: tuple[float, uuid.UUID] | None,
+        limit: int
+    ) -> list[Row]:
+        """Get up to limit task rows (id, task, is_done, weight) following the (weight, id) key after."""
+        return list((await session.execute(self._page_stmt(list_id, after).limit(limit))).all())
+
+    async def get_rows_by_list_id(self, session: AsyncSession, list_id: uuid.UUID) -> list[Row]:
+        """Get all task rows (id, task, is_done, weight) of the list in (weight, id) order, without loading task objects."""
+        return list((await session.execute(self._page_stmt(list_id, None))).all())
+
+    async def stream_by_list_id(
+        self,
+        session: AsyncSession,
+        list_id: uuid.UUID,
+        after: tuple[float, uuid.UUID] | None,
+        chunk_size: int
+    ) -> AsyncIterator[list[Row]]:
+        """Read task rows of the list in (weight, id) order through a server-side cursor, chunk_size rows at a time."""
+        result = await session.stream(self._page_stmt(list_id, after).execution_options(yield_per=chunk_size))
+        async for rows in result.partitions():
+            yield rows
+
+    async def bulk_create(self, session: AsyncSession, rows: list[dict]) -> None:
+        """Insert many tasks with one INSERT statement. Rows contain column values including id."""
+        if rows:
+            await session.execute(insert(TodoTaskOrm), rows)
+
+    async def copy_rows(self, session: AsyncSession, rows: list[tuple]) -> None:
+        """Insert many tasks with PostgreSQL COPY in the session's transaction.
+
+        Rows are (id, task, is_done, todo_list_id, weight) tuples.
+        """
+        if not rows:
+            return
+        connection = await (await session.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(
+            TodoTaskOrm.__tablename__,
+            records=rows,
+            columns=["id", "task", "is_done", "todo_list_id", "weight"],
+        )
+
+    async def bulk_update(self, session: AsyncSession, rows: list[dict]) -> None:
+        """Update many tasks by primary key. Each row contains id, todo_list_id and the columns to change."""
+        if rows:
+            await session.execute(update(TodoTaskOrm), rows)
+
+    async def delete_by_ids(self, session: AsyncSession, list_id: uuid.UUID, task_ids: list[uuid.UUID]) -> None:
+        """Delete tasks of the list by IDs with one DELETE statement."""
+        if task_ids:
+            stmt = delete(TodoTaskOrm).where(TodoTaskOrm.todo_list_id == list_id, TodoTaskOrm.id.in_(task_ids))
+            await session.execute(stmt.execution_options(synchronize_session=False))
+
+    async def get_by_list_id(self, session: AsyncSession, list_id: uuid.UUID, with_block: bool = False) -> list[TodoTaskOrm]:
         """Get all tasks for a todo list."""
         stmt = select(TodoTaskOrm).where(TodoTaskOrm.todo_list_id == list_id).order_by(TodoTaskOrm.weight)
         if with_block:
             stmt = stmt.with_for_update()
 
-        return list(session.execute(stmt).scalars().all())
+        return list((await session.execute(stmt)).scalars().all())
     
-    def update(
+    async def update(
         self,
-        session: Session,
+        session: AsyncSession,
         todo_task: TodoTaskOrm,
         task: str = None,
         is_done: bool = None,
@@ -58,24 +206,76 @@ class TodoTaskRepository:
             todo_task.is_done = is_done
         if weight is not None:
             todo_task.weight = weight
-        session.flush()
+        await session.flush()
         return todo_task
     
-    def delete(self, session: Session, todo_task: TodoTaskOrm) -> None:
+    async def delete(self, session: AsyncSession, todo_task: TodoTaskOrm) -> None:
         """Delete todo task."""
-        session.delete(todo_task)
-        session.flush()
+        await session.delete(todo_task)
+        await session.flush()
     
-    def delete_by_id(self, session: Session, task_id: uuid.UUID) -> bool:
+    async def delete_by_id(self, session: AsyncSession, task_id: uuid.UUID) -> bool:
         """Delete todo task by ID. Returns True if deleted, False if not found."""
-        todo_task = self.get_by_id(session, task_id)
+        todo_task = await self.get_by_id(session, task_id)
         if todo_task:
-            self.delete(session, todo_task)
+            await self.delete(session, todo_task)
             return True
         return False
     
-    def delete_by_list_id(self, session: Session, list_id: uuid.UUID) -> None:
+    async def delete_by_list_id(self, session: AsyncSession, list_id: uuid.UUID) -> None:
         """Delete all todo tasks by list ID."""
         stmt = delete(TodoTaskOrm).where(TodoTaskOrm.todo_list_id == list_id)
-        session.execute(stmt)
-        session.flush()
\ No newline at end of file
+        await session.execute(stmt)
+        await session.flush()
+
+    async def delete_where(self, session: AsyncSession, list_id: uuid.UUID, is_done: bool | None = None) -> int:
+        """Delete tasks of the list, only those with the given is_done if it is set, with one DELETE statement.
+
+        The tasks are locked in ID order first. Returns number of deleted tasks.
+        """
+        conditions = [TodoTaskOrm.is_done == is_done] if is_done is not None else []
+        await self.lock_where(session, list_id, *conditions)
+        stmt = delete(TodoTaskOrm).where(TodoTaskOrm.todo_list_id == list_id, *conditions)
+        return (await session.execute(stmt.execution_options(synchronize_session=False))).rowcount
+
+    async def set_is_done_where(self, session: AsyncSession, list_id: uuid.UUID, value: bool, is_done: bool | None = None) -> int:
+        """Set is_done of tasks of the list, only those with the given is_done if it is set, with one UPDATE statement.
+
+        Tasks that already have the value are not written. The tasks are locked in ID order first.
+        Returns number of changed tasks.
+        """
+        conditions = [TodoTaskOrm.is_done != value]
+        if is_done is not None:
+            conditions.append(TodoTaskOrm.is_done == is_done)
+        await self.lock_where(session, list_id, *conditions)
+        stmt = update(TodoTaskOrm).where(TodoTaskOrm.todo_list_id == list_id, *conditions).values(is_done=value)
+        return (await session.execute(stmt.execution_options(synchronize_session=False))).rowcount
+
+    async def delete_batch_by_list_id(self, session: AsyncSession, list_id: uuid.UUID, limit: int) -> int:
+        """Delete up to limit tasks of the list. Returns number of deleted tasks."""
+        batch = select(TodoTaskOrm.id, TodoTaskOrm.todo_list_id).where(TodoTaskOrm.todo_list_id == list_id).limit(limit)
+        stmt = (
+            delete(TodoTaskOrm)
+            .where(tuple_(TodoTaskOrm.id, TodoTaskOrm.todo_list_id).in_(batch))
+            .execution_options(synchronize_session=False)
+        )
+        return (await session.execute(stmt)).rowcount
+
+    async def rebalance(self, session: AsyncSession, list_id: uuid.UUID, step: float) -> None:
+        """Renumber task weights of a list evenly (step, 2 * step, ...) in one UPDATE, keeping their order.
+
+        The tasks are locked in ID order first.
+        """
+        await self.lock_where(session, list_id)
+        ranked = (
+            select(TodoTaskOrm.id, func.row_number().over(order_by=(TodoTaskOrm.weight, TodoTaskOrm.id)).label("position"))
+            .where(TodoTaskOrm.todo_list_id == list_id)
+            .subquery()
+        )
+        stmt = (
+            update(TodoTaskOrm)
+            .where(TodoTaskOrm.id == ranked.c.id)
+            .values(weight=ranked.c.position * step)
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
@@ -1,29 +1,30 @@
 """Unit of Work pattern implementation for transaction management."""
-from sqlalchemy.orm import Session, sessionmaker
-from app.db.repositories import TodoListRepository, TodoTaskRepository
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app.db.repositories import TodoListChangeRepository, TodoListRepository, TodoTaskRepository
 
 
 class UnitOfWork:
     """Unit of Work manages database transactions and provides access to repositories."""
-    
-    def __init__(self, session_factory: sessionmaker):
+
+    def __init__(self, session_factory: async_sessionmaker):
         self.session_factory = session_factory
-        self.session: Session | None = None
+        self.session: AsyncSession | None = None
 
         self.todo_lists = TodoListRepository()
         self.todo_tasks = TodoTaskRepository()
+        self.todo_list_changes = TodoListChangeRepository()
 
-    def __enter__(self):
+    async def __aenter__(self):
         self.session = self.session_factory()
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
         if exc_type is not None:
-            self.rollback()
-        self.session.close()
+            await self.rollback()
+        await self.session.close()
 
-    def commit(self):
-        self.session.commit()
+    async def commit(self):
+        await self.session.commit()
 
-    def rollback(self):
-        self.session.rollback()
\ No newline at end of file
+    async def rollback(self):
+        await self.session.rollback()
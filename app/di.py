@@ -1,28 +1,113 @@
-from fastapi import Depends
+from fastapi import Depends, Request
 from functools import lru_cache
 
 from app.core import settings
 
-from app.slug_service import SlugService
+from app.slug_service import SlugService, RandomSlugGenerator, SequenceSlugGenerator, BlockSlugGenerator
+from app.db.repositories.todo_list_repository import TodoListRepository
 from app.weight_service import WeightService
 from app.todo_service import TodoService
 from app.db.unit_of_work import UnitOfWork
 from app.db.database import Database
+from app.event_hub import EventHub, PostgresEventHub
+from app.free_list_pool import FreeListPool
+from app.list_cache import ListCache
+from app.list_purger import ListPurger
+from app.change_log import ChangeLogCompactor
+from app.retry_policy import RetryPolicy
+from app.single_flight import SingleFlight
+from app.write_behind import WriteBehindBuffer
+from app.admission import AdmissionController
+from app.db.pooling import pool_limits
+
+def create_database() -> Database:
+    return Database(settings.database_url, settings.database_read_url or None)
+
+def get_database(request: Request) -> Database:
+    # Built once per worker by the application lifespan
+    return request.app.state.database
+
+@lru_cache()
+def get_list_cache() -> ListCache:
+    return ListCache(settings.list_cache_max_size, settings.list_cache_ttl)
+
+@lru_cache()
+def get_free_list_pool() -> FreeListPool:
+    return FreeListPool(get_slug_service(), settings.free_list_pool_size, settings.free_list_pool_refill_interval)
+
+@lru_cache()
+def get_list_purger() -> ListPurger:
+    return ListPurger(settings.list_purge_interval, settings.list_purge_batch_size, settings.list_purge_max_rows_per_second)
+
+@lru_cache()
+def get_change_log_compactor() -> ChangeLogCompactor:
+    return ChangeLogCompactor(settings.changes_compact_interval, settings.changes_retention, settings.changes_max_entries,
+                              settings.changes_compact_threshold, settings.list_purge_batch_size)
 
 @lru_cache()
-def get_database()-> Database:
-    return Database(settings.database_url)
+def get_single_flight() -> SingleFlight:
+    return SingleFlight(settings.read_coalescing_enabled, settings.read_coalescing_window)
+
+@lru_cache()
+def get_write_behind() -> WriteBehindBuffer:
+    return WriteBehindBuffer(get_list_cache(), get_retry_policy(), settings.write_behind_enabled, settings.write_behind_dir,
+                             settings.write_behind_flush_interval, settings.write_behind_max_pending, settings.write_behind_fsync)
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    max_concurrency = settings.admission_max_concurrency
+    if max_concurrency <= 0:
+        limits = pool_limits(settings)
+        max_concurrency = limits.pool_size + limits.max_overflow
+    return AdmissionController(max_concurrency, settings.admission_max_queue, settings.admission_queue_timeout,
+                               settings.admission_retry_after, settings.admission_client_rate, settings.admission_client_burst)
+
+@lru_cache()
+def get_retry_policy() -> RetryPolicy:
+    return RetryPolicy(settings.db_retry_attempts, settings.db_retry_base_delay)
+
+def create_event_hub() -> EventHub:
+    if settings.events_backend == "postgres":
+        event_hub = PostgresEventHub(settings.events_database_url or settings.database_url, settings.events_queue_size)
+    else:
+        event_hub = EventHub(settings.events_queue_size)
+    # Changes committed by other workers reach this worker's cache through the hub
+    list_cache = get_list_cache()
+    event_hub.add_listener(lambda event: list_cache.invalidate(event.slug, event.version))
+    return event_hub
+
+def get_event_hub(request: Request) -> EventHub:
+    return request.app.state.event_hub
 
 def get_unit_of_work(db = Depends(get_database)) -> UnitOfWork:
     return db.get_unit_of_work()
 
+def get_read_unit_of_work(db = Depends(get_database)) -> UnitOfWork:
+    return db.get_read_unit_of_work()
+
+@lru_cache()
 def get_slug_service() -> SlugService:
-    return SlugService()
+    if settings.slug_strategy == "sequence":
+        generator = SequenceSlugGenerator(TodoListRepository())
+    elif settings.slug_strategy == "block":
+        generator = BlockSlugGenerator(TodoListRepository(), settings.slug_block_size)
+    else:
+        generator = RandomSlugGenerator(settings.slug_batch_size)
+    return SlugService(generator)
 
 def get_weight_service() -> WeightService:
-    return WeightService()
+    return WeightService(min_gap=settings.weight_min_gap)
 
 def get_todo_service(uow: UnitOfWork = Depends(get_unit_of_work),
+                     read_uow: UnitOfWork = Depends(get_read_unit_of_work),
                      slug_service: SlugService = Depends(get_slug_service),
-                     weight_service: WeightService = Depends(get_weight_service)) -> TodoService:
-    return TodoService(uow=uow, slug_service=slug_service, weight_service=weight_service)
\ No newline at end of file
+                     weight_service: WeightService = Depends(get_weight_service),
+                     event_hub: EventHub = Depends(get_event_hub),
+                     list_cache: ListCache = Depends(get_list_cache),
+                     free_list_pool: FreeListPool = Depends(get_free_list_pool),
+                     retry_policy: RetryPolicy = Depends(get_retry_policy),
+                     single_flight: SingleFlight = Depends(get_single_flight),
+                     write_behind: WriteBehindBuffer = Depends(get_write_behind)) -> TodoService:
+    return TodoService(uow=uow, slug_service=slug_service, weight_service=weight_service, event_hub=event_hub,
+                       list_cache=list_cache, free_list_pool=free_list_pool, retry_policy=retry_policy,
+                       single_flight=single_flight, write_behind=write_behind, read_uow=read_uow)
\ No newline at end of file
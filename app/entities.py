@@ -16,8 +16,35 @@ class TodoList(BaseModel):
     id: uuid.UUID = Field(description="Уникальный идентификатор списка")
     name: str = Field(description="Название списка")
     slug: str = Field(description="Уникальный слаг списка для доступа")
+    version: int = Field(description="Версия списка, увеличивается при каждом изменении списка или его задач")
     tasks: list[TodoTask] = Field(description="Список задач")
 
+class TodoTaskPage(BaseModel):
+    version: int = Field(description="Версия списка на момент чтения страницы")
+    tasks: list[TodoTask] = Field(description="Задачи страницы в порядке веса")
+    next_cursor: str | None = Field(description="Курсор для следующей страницы (параметр after), None - это последняя страница")
+
+class TodoTaskTransferFormat(str, Enum):
+    """Формат импорта и экспорта задач"""
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+class TodoTaskImport(BaseModel):
+    task: str = Field(default="", max_length=255, description="Текст задачи")
+    is_done: bool = Field(default=False, description="Статус выполнения задачи")
+
+class TodoListImportResult(BaseModel):
+    imported: int = Field(description="Количество импортированных задач")
+    version: int = Field(description="Версия списка после импорта")
+
+class TodoTaskBulkUpdate(BaseModel):
+    is_done: bool = Field(description="Статус выполнения, который получат задачи")
+
+class TodoTaskBulkResult(BaseModel):
+    affected: int = Field(description="Количество удаленных или измененных задач")
+    version: int = Field(description="Версия списка после изменения")
+
 class TodoListCreate(BaseModel):
     name: str = Field(description="Название списка")
 
@@ -35,7 +62,7 @@ class MovePosition(str, Enum):
     LAST= "last"
 
 class TodoTaskCreate(BaseModel):
-    task: str = Field(default= "", description="Текст задачи")   
+    task: str = Field(default= "", max_length=255, description="Текст задачи")   
     is_done: bool | None = Field(default=None, description="Статус выполнения задачи")
     target_task: uuid.UUID | None = Field(default=None, description="Идентификатор задачи для позиционирования")
     move_position: MovePosition | None = Field(default=None, description="Позиция перемещения задачи в списке")
@@ -54,7 +81,7 @@ class TodoTaskCreate(BaseModel):
 
 
 class TodoTaskUpdate(BaseModel):
-    task: str | None = Field(default=None, description="Текст задачи")
+    task: str | None = Field(default=None, max_length=255, description="Текст задачи")
     is_done: bool | None = Field(default=None, description="Статус выполнения задачи")
     target_task: uuid.UUID | None = Field(default=None, description="Идентификатор задачи для позиционирования")
     move_position: MovePosition | None = Field(default=None, description="Позиция перемещения задачи в списке")
@@ -79,10 +106,82 @@ class TodoTaskUpdate(BaseModel):
         
         return self
 
+class TodoTaskBatchOperationType(str, Enum):
+    """Тип операции в пакетном изменении задач"""
+
+    CREATE = "create"
+    UPDATE = "update"
+    DELETE = "delete"
+
+class TodoTaskBatchOperation(BaseModel):
+    op: TodoTaskBatchOperationType = Field(description="Тип операции. Перемещение задачи - это update с move_position")
+    task_id: uuid.UUID | None = Field(default=None, description="Идентификатор задачи для update и delete")
+    task: str | None = Field(default=None, max_length=255, description="Текст задачи (обязателен для create)")
+    is_done: bool | None = Field(default=None, description="Статус выполнения задачи")
+    target_task: uuid.UUID | None = Field(default=None, description="Идентификатор задачи для позиционирования")
+    move_position: MovePosition | None = Field(default=None, description="Позиция перемещения задачи в списке")
+
+    @model_validator(mode='after')
+    def validate_operation(self):
+        if self.op == TodoTaskBatchOperationType.CREATE and self.task_id is not None:
+            raise ValueError('task_id must be None for create operation')
+
+        if self.op == TodoTaskBatchOperationType.CREATE and self.task is None:
+            raise ValueError('task is required for create operation')
+
+        if self.op != TodoTaskBatchOperationType.CREATE and self.task_id is None:
+            raise ValueError('task_id is required for update and delete operations')
+
+        if self.op == TodoTaskBatchOperationType.UPDATE and all(
+            getattr(self, field) is None for field in ['task', 'is_done', 'move_position']
+        ):
+            raise ValueError('At least one field must be provided for update')
+
+        if self.move_position and self.move_position in [MovePosition.FIRST, MovePosition.LAST] and self.target_task is not None:
+            raise ValueError('target_task must be None when move_position is FIRST or LAST')
+
+        if self.move_position is None and self.target_task is not None:
+            raise ValueError('target_task must be None when move_position is None')
+
+        return self
+
+class TodoTaskBatch(BaseModel):
+    operations: list[TodoTaskBatchOperation] = Field(min_length=1, max_length=1000, description="Операции, применяемые по порядку в одной транзакции")
+
 class TodoListUpdate(BaseModel):
     name: str | None = Field(default=None, description="Название списка")
 
     model_config = {"from_attributes": True}
 
 
-
+class TodoListEventType(str, Enum):
+    """Тип события изменения списка"""
+
+    TASK_CREATED = "task_created"
+    TASK_UPDATED = "task_updated"
+    TASK_DELETED = "task_deleted"
+    LIST_UPDATED = "list_updated"
+    LIST_DELETED = "list_deleted"
+    LIST_RELOADED = "list_reloaded"  # изменилось много задач сразу, список нужно загрузить заново
+
+class TodoListEvent(BaseModel):
+    type: TodoListEventType = Field(description="Тип события")
+    slug: str = Field(description="Слаг списка, к которому относится событие")
+    version: int = Field(description="Версия списка после изменения")
+    task: TodoTask | None = Field(default=None, description="Задача после изменения (для созданных и обновленных задач)")
+    task_id: uuid.UUID | None = Field(default=None, description="Идентификатор удаленной задачи")
+    name: str | None = Field(default=None, description="Новое название списка")
+
+class TodoListChange(BaseModel):
+    op: TodoListEventType = Field(description="Тип изменения")
+    version: int = Field(description="Версия списка, в которой сделано изменение")
+    task_id: uuid.UUID | None = Field(default=None, description="Идентификатор задачи (для изменений задач)")
+    task: str | None = Field(default=None, description="Новый текст задачи")
+    is_done: bool | None = Field(default=None, description="Новый статус выполнения задачи")
+    weight: float | None = Field(default=None, description="Новый вес задачи")
+    name: str | None = Field(default=None, description="Новое название списка")
+
+class TodoListChanges(BaseModel):
+    version: int = Field(description="Текущая версия списка")
+    changes: list[TodoListChange] | None = Field(default=None, description="Изменения после версии since по порядку. Отсутствует, если вернулся снимок списка")
+    snapshot: TodoList | None = Field(default=None, description="Список целиком, если изменения после since уже не хранятся или их слишком много")
@@ -0,0 +1,118 @@
+"""Pub/sub hub that fans todo list change events out to subscribers."""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from app.entities import TodoListEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EventHub:
+    """In-process hub: events are delivered to subscribers of the same worker only."""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._listeners: list[Callable[[TodoListEvent], None]] = []
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def subscribe(self, slug: str) -> asyncio.Queue:
+        """Register a subscriber queue for a list.
+
+        A None item in the queue means the subscriber fell behind and has to resync.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[slug].add(queue)
+        return queue
+
+    def unsubscribe(self, slug: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(slug)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[slug]
+
+    def add_listener(self, listener: Callable[[TodoListEvent], None]) -> None:
+        """Register a callback invoked for every event of every list."""
+        self._listeners.append(listener)
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    async def publish(self, event: TodoListEvent) -> None:
+        self._dispatch(event)
+
+    def _dispatch(self, event: TodoListEvent) -> None:
+        for listener in self._listeners:
+            listener(event)
+        for queue in list(self._subscribers.get(event.slug, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow subscriber: drop its backlog and ask it to reload the list
+                self._request_resync(queue)
+
+    def _request_resync(self, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+
+class PostgresEventHub(EventHub):
+    """Hub backed by PostgreSQL LISTEN/NOTIFY, so events reach subscribers of every worker."""
+
+    CHANNEL = "todo_list_events"
+
+    def __init__(self, database_url: str, queue_size: int = 100):
+        super().__init__(queue_size)
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection: asyncpg.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    async def start(self) -> None:
+        async with self._lock:
+            await self._connect()
+
+    async def stop(self) -> None:
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                self._connection.remove_termination_listener(self._on_termination)
+                await self._connection.close()
+            self._connection = None
+
+    async def publish(self, event: TodoListEvent) -> None:
+        # Delivered back to this worker through the listener, like to any other worker
+        try:
+            async with self._lock:
+                if self._connection is None or self._connection.is_closed():
+                    await self._connect()
+                await self._connection.execute("SELECT pg_notify($1, $2)", self.CHANNEL, event.model_dump_json())
+        except (OSError, asyncpg.PostgresError):
+            logger.exception("Failed to publish %s event for list %s", event.type.value, event.slug)
+
+    async def _connect(self) -> None:
+        self._connection = await asyncpg.connect(self.dsn)
+        self._connection.add_termination_listener(self._on_termination)
+        await self._connection.add_listener(self.CHANNEL, self._on_notification)
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        self._dispatch(TodoListEvent.model_validate_json(payload))
+
+    def _on_termination(self, connection) -> None:
+        # Notifications sent while we were disconnected are lost for good
+        logger.warning("Event listener connection lost, subscribers will resync")
+        for subscribers in self._subscribers.values():
+            for queue in subscribers:
+                self._request_resync(queue)
@@ -8,4 +8,20 @@ class TodoListNotFoundException(BaseAppException):
 
 class TodoTaskNotFoundException(BaseAppException):
     """Exception raised when a todo task is not found."""
-    pass
\ No newline at end of file
+    pass
+
+class InvalidCursorException(BaseAppException):
+    """Exception raised when a pagination cursor cannot be decoded."""
+    pass
+
+class InvalidImportException(BaseAppException):
+    """Exception raised when imported data cannot be parsed or validated."""
+    pass
+
+class WeightRebalanceRequiredException(BaseAppException):
+    """Exception raised when there is no room left between neighbouring task weights."""
+    pass
+
+class ConcurrentUpdateException(BaseAppException):
+    """Exception raised when a transaction keeps conflicting with concurrent changes of the same list."""
+    pass
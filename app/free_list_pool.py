@@ -0,0 +1,101 @@
+"""Background maintainer of pre-created free todo lists."""
+import asyncio
+import logging
+
+from sqlalchemy import func, select
+
+from app.db.database import Database
+from app.metrics import FREE_LIST_CLAIM_DURATION, FREE_LIST_POOL_DEPTH
+from app.slug_service import SlugService
+
+logger = logging.getLogger(__name__)
+
+# Only one worker at a time refills the pool
+_REFILL_LOCK_KEY = 0x746F646F
+
+
+class FreeListPool:
+    """Keeps a stock of free lists with unique slugs so that creating a list is a single claim."""
+
+    def __init__(self, slug_service: SlugService, target_size: int = 20, refill_interval: float = 5.0):
+        self.slug_service = slug_service
+        self.target_size = target_size
+        self.refill_interval = refill_interval
+
+        self._database: Database | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+
+        self.depth = 0
+        self.claims = 0
+        self.misses = 0
+        self.claim_latency_total = 0.0
+        self.claim_latency_max = 0.0
+
+    async def start(self, database: Database) -> None:
+        self._database = database
+        self._wakeup = asyncio.Event()
+        if self.target_size > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record_claim(self, latency: float, from_pool: bool) -> None:
+        """Account one list creation; from_pool is False when the pool was empty."""
+        self.claims += 1
+        if not from_pool:
+            self.misses += 1
+        self.claim_latency_total += latency
+        self.claim_latency_max = max(self.claim_latency_max, latency)
+        FREE_LIST_CLAIM_DURATION.labels("pool" if from_pool else "inline").observe(latency)
+        self.depth = max(self.depth - 1, 0)
+        FREE_LIST_POOL_DEPTH.set(self.depth)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def refill(self) -> int:
+        """Top the pool up to target_size. Returns number of created lists."""
+        async with self._database.get_unit_of_work() as uow:
+            locked = await uow.session.scalar(select(func.pg_try_advisory_xact_lock(_REFILL_LOCK_KEY)))
+            if not locked:
+                return 0
+            self.depth = await uow.todo_lists.count_free(uow.session)
+            FREE_LIST_POOL_DEPTH.set(self.depth)
+            missing = self.target_size - self.depth
+            if missing <= 0:
+                return 0
+            slugs = await self.slug_service.generate_slugs(uow.session, missing)
+            created = await uow.todo_lists.create_free_many(uow.session, slugs)
+            await uow.commit()
+        self.depth += created
+        FREE_LIST_POOL_DEPTH.set(self.depth)
+        return created
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "target_size": self.target_size,
+            "claims": self.claims,
+            "misses": self.misses,
+            "claim_latency_avg": self.claim_latency_total / self.claims if self.claims else 0.0,
+            "claim_latency_max": self.claim_latency_max,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Failed to refill free list pool")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,84 @@
+"""In-process cache of serialized todo lists."""
+import time
+from collections import OrderedDict
+
+_MIN_VERSIONS_SIZE = 10000
+
+
+class ListCache:
+    """Bounded LRU cache with TTL that maps a list slug to its version and ready-to-send JSON."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, int, bytes]] = OrderedDict()
+        self._generation = 0
+        # Latest version of recently changed lists, reads that return an older one are stale
+        self._min_versions: OrderedDict[str, int] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        """Invalidation counter. Capture it before loading a list and pass it to set()."""
+        return self._generation
+
+    def get(self, slug: str) -> tuple[int, bytes] | None:
+        entry = self._entries.get(slug)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, version, payload = entry
+        if expires_at <= time.monotonic():
+            del self._entries[slug]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(slug)
+        self.hits += 1
+        return version, payload
+
+    def peek(self, slug: str) -> int | None:
+        """Version of a cached list, without counting a hit or a miss."""
+        entry = self._entries.get(slug)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, slug: str, version: int, payload: bytes, generation: int) -> None:
+        """Store a serialized list unless something was invalidated after the list was loaded,
+        or the list is older than a change of it already seen."""
+        if self.max_size <= 0 or generation != self._generation or version < self._min_versions.get(slug, 0):
+            return
+        self._entries[slug] = (time.monotonic() + self.ttl, version, payload)
+        self._entries.move_to_end(slug)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, slug: str, version: int | None = None) -> None:
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(slug, None)
+        if version is not None:
+            self._min_versions[slug] = max(version, self._min_versions.get(slug, 0))
+            self._min_versions.move_to_end(slug)
+            while len(self._min_versions) > max(self.max_size, _MIN_VERSIONS_SIZE):
+                self._min_versions.popitem(last=False)
+
+    def min_version(self, slug: str) -> int:
+        """Version of the latest change of the list seen by this process (0 if unknown)."""
+        return self._min_versions.get(slug, 0)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
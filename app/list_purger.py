@@ -0,0 +1,91 @@
+"""Background removal of the tasks of deleted todo lists."""
+import asyncio
+import logging
+import time
+
+from app.db.database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ListPurger:
+    """Deletes tasks of deleted lists in small batches, each in its own short transaction, then the list rows.
+
+    Every batch locks the list it works on with SKIP LOCKED, so purgers of several workers share the
+    work instead of waiting for each other. Batches are paced to at most max_rows_per_second deleted
+    tasks, so purging a huge list neither holds locks for long nor produces a burst of WAL.
+    """
+
+    def __init__(self, interval: float = 5.0, batch_size: int = 1000, max_rows_per_second: float = 20000.0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+
+        self._database: Database | None = None
+        self._task: asyncio.Task | None = None
+
+        self.pending = 0
+        self.purged_lists = 0
+        self.purged_tasks = 0
+        self.batches = 0
+
+    async def start(self, database: Database) -> None:
+        self._database = database
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def purge(self) -> int:
+        """Purge deleted lists until none are left. Returns number of deleted tasks."""
+        purged_tasks = 0
+        while True:
+            started_at = time.monotonic()
+            async with self._database.get_unit_of_work() as uow:
+                list_id = await uow.todo_lists.lock_next_deleted(uow.session)
+                if list_id is None:
+                    self.pending = 0
+                    return purged_tasks
+                deleted = await uow.todo_tasks.delete_batch_by_list_id(uow.session, list_id, self.batch_size)
+                finished = deleted < self.batch_size
+                if finished:
+                    await uow.todo_lists.delete_deleted(uow.session, list_id)
+                await uow.commit()
+            self.batches += 1
+            self.purged_lists += finished
+            self.purged_tasks += deleted
+            purged_tasks += deleted
+            # Rate limit: the next batch starts no sooner than this one's share of a second
+            delay = deleted / self.max_rows_per_second - (time.monotonic() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def count_pending(self) -> int:
+        async with self._database.get_unit_of_work() as uow:
+            self.pending = await uow.todo_lists.count_deleted(uow.session)
+        return self.pending
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "purged_lists": self.purged_lists,
+            "purged_tasks": self.purged_tasks,
+            "batches": self.batches,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.count_pending()
+                if self.pending:
+                    await self.purge()
+            except Exception:
+                logger.exception("Failed to purge deleted lists")
+            await asyncio.sleep(self.interval)
@@ -1,15 +1,51 @@
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from fastapi.openapi.docs import get_swagger_ui_html
 
 from app.core import settings
-from app.exceptions import TodoListNotFoundException, TodoTaskNotFoundException
+from app.di import create_database, create_event_hub, get_free_list_pool, get_list_purger, get_change_log_compactor, get_admission_controller, get_list_cache, get_write_behind
+from app.admission import AdmissionControlMiddleware
+from app.metrics import MetricsMiddleware, render_metrics
+from app.exceptions import (TodoListNotFoundException, TodoTaskNotFoundException, InvalidCursorException, InvalidImportException,
+                            ConcurrentUpdateException)
 from app.router import router
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything that needs a connection is set up here, so no user request pays for it
+    database = create_database()
+    await database.connect(warm_connections=database.pool_size)
+    event_hub = create_event_hub()
+    await event_hub.start()
+    free_list_pool = get_free_list_pool()
+    await free_list_pool.start(database)
+    list_purger = get_list_purger()
+    await list_purger.start(database)
+    change_log_compactor = get_change_log_compactor()
+    await change_log_compactor.start(database)
+    # Edits left in the logs of workers that died are written before this one takes requests
+    write_behind = get_write_behind()
+    await write_behind.start(database, event_hub)
+
+    app.state.database = database
+    app.state.event_hub = event_hub
+    try:
+        yield
+    finally:
+        await write_behind.stop()
+        await change_log_compactor.stop()
+        await list_purger.stop()
+        await free_list_pool.stop()
+        await event_hub.stop()
+        await database.dispose()
+
+
 app = FastAPI(
     title=settings.api_title,
     description=settings.api_description,
@@ -18,6 +54,7 @@ app = FastAPI(
     # openapi_url="openapi.json",
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
 )
 
 
@@ -25,6 +62,23 @@ app = FastAPI(
 
 
 
+# Inside the metrics middleware, so rejected requests are measured too
+if settings.admission_enabled:
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        controller=get_admission_controller(),
+        list_cache=get_list_cache(),
+        client_header=settings.admission_client_header,
+        api_prefix=settings.api_prefix,
+    )
+
+if settings.metrics_enabled:
+    app.add_middleware(
+        MetricsMiddleware,
+        slow_request_threshold=settings.slow_request_threshold,
+        profile_sample_rate=settings.profile_sample_rate,
+    )
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -56,11 +110,50 @@ async def todo_task_not_found_exception_handler(request: Request, exc: TodoTaskN
         }
     )
 
+@app.exception_handler(InvalidCursorException)
+async def invalid_cursor_exception_handler(request: Request, exc: InvalidCursorException):
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": True,
+            "message": "invalid cursor",
+            "details": str(exc)
+        }
+    )
+
+@app.exception_handler(InvalidImportException)
+async def invalid_import_exception_handler(request: Request, exc: InvalidImportException):
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": True,
+            "message": "invalid import data",
+            "details": str(exc)
+        }
+    )
+
+@app.exception_handler(ConcurrentUpdateException)
+async def concurrent_update_exception_handler(request: Request, exc: ConcurrentUpdateException):
+    return JSONResponse(
+        status_code=409,
+        content={
+            "error": True,
+            "message": "concurrent update",
+            "details": str(exc)
+        }
+    )
+
 app.include_router(router, prefix=settings.api_prefix)
 
 
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui():
     return get_swagger_ui_html(
@@ -0,0 +1,189 @@
+"""Prometheus metrics and per-request performance instrumentation."""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # the sampling profiler is optional
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = Histogram(
+    "todo_http_request_duration_seconds", "HTTP request latency, until the last body byte is sent",
+    ["method", "route", "status"],
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "todo_http_request_sql_statements", "Number of SQL statements executed by one request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100, 1000),
+)
+REQUEST_SQL_DURATION = Histogram(
+    "todo_http_request_sql_duration_seconds", "Total time one request spent in SQL statements", ["route"],
+)
+SQL_STATEMENT_DURATION = Histogram("todo_sql_statement_duration_seconds", "SQL statement execution time")
+LOCK_WAIT = Histogram(
+    "todo_sql_lock_duration_seconds",
+    "Execution time of statements that take row locks (SELECT ... FOR UPDATE, or marked with the takes_lock "
+    "execution option), dominated by lock waits",
+    ["route"],
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "todo_db_pool_checkout_wait_seconds", "Time to get a connection from the pool, including opening a new one",
+)
+POOL_CHECKOUT_TIMEOUTS = Counter("todo_db_pool_checkout_timeouts_total", "Pool checkouts that timed out")
+POOL_CHECKED_OUT = Gauge("todo_db_pool_checked_out_connections", "Connections currently checked out of the pool")
+POOL_OVERFLOW = Gauge("todo_db_pool_overflow_connections", "Connections open above pool_size (negative while the pool is not full)")
+SECTION_DURATION = Histogram(
+    "todo_section_duration_seconds", "Time spent in instrumented code sections (weight calculation, serialization)",
+    ["section"],
+)
+TRANSACTION_RETRIES = Counter(
+    "todo_transaction_retries_total", "Transactions aborted by a serialization failure or deadlock and retried", ["sqlstate"],
+)
+ADMISSION_IN_FLIGHT = Gauge("todo_admission_in_flight_requests", "Requests admitted to work with the database")
+ADMISSION_QUEUE_DEPTH = Gauge("todo_admission_queue_depth", "Requests waiting for admission", ["priority"])
+ADMISSION_QUEUE_WAIT = Histogram("todo_admission_queue_wait_seconds", "Time admitted requests waited in the admission queue")
+ADMISSION_SHED = Counter(
+    "todo_admission_shed_total", "Requests rejected by admission control (queue_full, queue_timeout, client_rate)", ["reason"],
+)
+ADMISSION_BYPASSED = Counter("todo_admission_bypassed_total", "Requests served from the list cache without taking a slot")
+FREE_LIST_POOL_DEPTH = Gauge("todo_free_list_pool_depth", "Free lists ready to be claimed, as last counted by this worker")
+FREE_LIST_CLAIM_DURATION = Histogram(
+    "todo_free_list_claim_duration_seconds", "Time to create a list, claimed from the free list pool or created inline",
+    ["source"],
+)
+SLOW_REQUESTS = Counter("todo_http_slow_requests_total", "Requests slower than the slow request threshold", ["route"])
+
+
+@dataclass
+class RequestStats:
+    scope: dict
+    sql_statements: int = 0
+    sql_duration: float = 0.0
+
+    @property
+    def route(self) -> str:
+        # Templated path (set by the router once the request is matched) keeps label cardinality bounded
+        route = self.scope.get("route")
+        return route.path if route is not None else "unmatched"
+
+
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def measure(section: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        SECTION_DURATION.labels(section).observe(time.perf_counter() - started_at)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started_at)
+
+
+def instrument_engine(engine: AsyncEngine, pool_gauges: bool = True) -> None:
+    """Time every SQL statement and attribute it to the request being served, and export pool gauges if pool_gauges."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["query_started_at"].pop()
+        SQL_STATEMENT_DURATION.observe(duration)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.sql_statements += 1
+            stats.sql_duration += duration
+        # Statements locking rows without FOR UPDATE (UPDATE ... RETURNING of the list version) say so explicitly
+        if context.execution_options.get("takes_lock") or "FOR UPDATE" in statement:
+            LOCK_WAIT.labels(stats.route if stats is not None else "background").observe(duration)
+
+    pool = sync_engine.pool
+    if pool_gauges and hasattr(pool, "checkedout"):
+        POOL_CHECKED_OUT.set_function(pool.checkedout)
+        POOL_OVERFLOW.set_function(pool.overflow)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage per route, logging slow requests and sampling profiles."""
+
+    def __init__(self, app, slow_request_threshold: float = 0.0, profile_sample_rate: float = 0.0):
+        self.app = app
+        self.slow_request_threshold = slow_request_threshold
+        self.profile_sample_rate = profile_sample_rate
+        if profile_sample_rate > 0 and Profiler is None:
+            logger.warning("pyinstrument is not installed, request profiling is disabled")
+            self.profile_sample_rate = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        status = 500
+        streaming = False
+        started_at = time.perf_counter()
+        profiler = None
+        if self.profile_sample_rate > 0 and random.random() < self.profile_sample_rate:
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+
+        async def send_wrapper(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", ())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started_at
+            _request_stats.reset(token)
+            REQUEST_DURATION.labels(scope["method"], stats.route, str(status)).observe(duration)
+            REQUEST_SQL_STATEMENTS.labels(stats.route).observe(stats.sql_statements)
+            REQUEST_SQL_DURATION.labels(stats.route).observe(stats.sql_duration)
+            # Event streams stay open by design, their duration says nothing about performance
+            if self.slow_request_threshold > 0 and duration >= self.slow_request_threshold and not streaming:
+                SLOW_REQUESTS.labels(stats.route).inc()
+                logger.warning(
+                    "Slow request %s %s: %.3fs, %d SQL statements in %.3fs",
+                    scope["method"], scope["path"], duration, stats.sql_statements, stats.sql_duration,
+                )
+            if profiler is not None:
+                profiler.stop()
+                logger.info("Profile of %s %s:\n%s", scope["method"], scope["path"], profiler.output_text())
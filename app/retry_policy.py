@@ -0,0 +1,60 @@
+"""Bounded retry of transactions aborted by serialization failures and deadlocks."""
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, TypeVar
+
+from sqlalchemy.exc import DBAPIError
+
+from app.exceptions import ConcurrentUpdateException
+from app.metrics import TRANSACTION_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# serialization_failure, deadlock_detected: the transaction was rolled back and can simply run again
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+
+# data_exception, integrity_constraint_violation: the statement fails the same way however often it runs
+REJECTED_SQLSTATE_CLASSES = {"22", "23"}
+
+
+def retryable_sqlstate(error: BaseException) -> str | None:
+    if isinstance(error, DBAPIError):
+        sqlstate = getattr(error.orig, "sqlstate", None)
+        if sqlstate in RETRYABLE_SQLSTATES:
+            return sqlstate
+    return None
+
+
+def rejected_sqlstate(error: BaseException) -> str | None:
+    """SQLSTATE of an error caused by the data itself, which running the transaction again can't fix."""
+    if isinstance(error, DBAPIError):
+        sqlstate = getattr(error.orig, "sqlstate", None)
+        if sqlstate is not None and sqlstate[:2] in REJECTED_SQLSTATE_CLASSES:
+            return sqlstate
+    return None
+
+
+class RetryPolicy:
+    """Runs a transaction again, with jittered exponential backoff, when PostgreSQL aborts it because of a conflict."""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.01):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+
+    async def run(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Await operation() until it succeeds. operation has to open its own unit of work, so every attempt starts clean."""
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return await operation()
+            except DBAPIError as exc:
+                sqlstate = retryable_sqlstate(exc)
+                if sqlstate is None:
+                    raise
+                TRANSACTION_RETRIES.labels(sqlstate).inc()
+                if attempt == self.attempts:
+                    logger.warning("Transaction aborted by %s %d times, giving up", sqlstate, attempt)
+                    raise ConcurrentUpdateException("The todo list is being changed concurrently, try again.") from exc
+                await asyncio.sleep(random.uniform(0, self.base_delay * 2 ** (attempt - 1)))
@@ -1,28 +1,184 @@
+import asyncio
+import json
 import uuid
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
-from app.entities import TodoList, TodoTask, TodoListCreate, TodoTaskCreate, TodoTaskUpdate, TodoListUpdate
+from app.core import settings
+from app.entities import TodoList, TodoListChanges, TodoTask, TodoTaskPage, TodoTaskTransferFormat, TodoListImportResult, TodoListCreate, TodoTaskCreate, TodoTaskUpdate, TodoListUpdate, TodoListEventType, TodoTaskBatch, TodoTaskBulkUpdate, TodoTaskBulkResult
+from app.event_hub import EventHub
+from app.exceptions import TodoListNotFoundException
 from app.todo_service import TodoService
 
-from app.di import get_todo_service
+from app.di import get_todo_service, get_event_hub, get_list_cache, get_free_list_pool, get_list_purger, get_change_log_compactor, get_single_flight, get_admission_controller, get_write_behind, get_database
+from app.db.database import Database
+from app.free_list_pool import FreeListPool
+from app.list_cache import ListCache
+from app.list_purger import ListPurger
+from app.single_flight import SingleFlight
+from app.write_behind import WriteBehindBuffer
+from app.admission import AdmissionController
+from app.change_log import ChangeLogCompactor
+from app.serialization import JSONBytesResponse, task_dict
 
 router = APIRouter()
 
-@router.post("/lists/")
-async def create_list(list: TodoListCreate, todo_service: TodoService= Depends(get_todo_service)) -> TodoList:
+
+def _make_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def _model_response(model: BaseModel, exclude_none: bool = False):
+    # A returned Response is sent as is: the model is encoded once instead of being validated against
+    # response_model again and then passed through jsonable_encoder
+    if settings.fast_json_responses:
+        return JSONBytesResponse(model.model_dump_json(exclude_none=exclude_none).encode())
+    return model
+
+
+def _sse_message(event: str, data: str, event_id: int | None = None) -> str:
+    message = f"event: {event}\ndata: {data}\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message + "\n"
+
+
+async def _list_event_stream(slug: str, todo_service: TodoService, event_hub: EventHub):
+    queue = event_hub.subscribe(slug)
+    try:
+        # Версия после подписки: клиент сравнивает ее со своей и перезагружает список, если что-то пропустил
+        try:
+            version = await todo_service.get_todo_list_version(slug)
+        except TodoListNotFoundException:
+            yield _sse_message(TodoListEventType.LIST_DELETED.value, json.dumps({"slug": slug}))
+            return
+        yield _sse_message("ready", json.dumps({"slug": slug, "version": version}), version)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=settings.events_keepalive_interval)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                yield _sse_message("resync", json.dumps({"slug": slug}))
+                continue
+            yield _sse_message(event.type.value, event.model_dump_json(), event.version)
+            if event.type == TodoListEventType.LIST_DELETED:
+                return
+    finally:
+        event_hub.unsubscribe(slug, queue)
+
+
+@router.post("/lists/", response_model=TodoList)
+async def create_list(list: TodoListCreate, todo_service: TodoService= Depends(get_todo_service)):
     """
     Создать пустой список.
     Возвращает созданный список
     """
-    return todo_service.create_todo_list(list)
+    return _model_response(await todo_service.create_todo_list(list))
 
 @router.get("/lists/{slug}")
-async def get_list_by_slug(slug: str, todo_service: TodoService = Depends(get_todo_service)) -> TodoList:
+async def get_list_by_slug(slug: str,
+                           if_none_match: str | None = Header(default=None),
+                           todo_service: TodoService = Depends(get_todo_service)) -> TodoList:
     """
     Получить список по slug.
     Возвращает найденный список или ошибку, если список не найден.
+    Поддерживает условный запрос: если If-None-Match совпадает с текущим ETag, возвращает 304 без тела.
+    """
+    if if_none_match:
+        etag = _make_etag(await todo_service.get_todo_list_version(slug))
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    version, payload = await todo_service.get_todo_list_json_by_slug(slug)
+    return JSONBytesResponse(payload, headers={"ETag": _make_etag(version)})
+
+@router.get("/lists/{slug}/tasks", response_model=TodoTaskPage)
+async def get_list_tasks(slug: str,
+                         after: str | None = Query(default=None, description="Курсор next_cursor предыдущей страницы"),
+                         limit: int = Query(default=settings.tasks_page_size, ge=1, le=settings.tasks_page_max_size),
+                         accept: str | None = Header(default=None),
+                         todo_service: TodoService = Depends(get_todo_service)):
+    """
+    Получить задачи списка по slug постранично, в порядке веса.
+    Возвращает страницу задач и курсор следующей страницы.
+    С заголовком Accept: application/x-ndjson возвращает все задачи после курсора потоком,
+    по одной задаче в строке, не собирая список целиком в памяти (limit при этом не учитывается).
     """
-    return todo_service.get_todo_list_by_slug(slug)
+    if accept and "application/x-ndjson" in accept:
+        stream = await todo_service.stream_todo_tasks(slug, after, settings.tasks_stream_chunk_size)
+        return StreamingResponse(stream, media_type="application/x-ndjson")
+    if settings.fast_json_responses:
+        return JSONBytesResponse(await todo_service.get_todo_tasks_page_json(slug, after, limit))
+    return await todo_service.get_todo_tasks_page(slug, after, limit)
+
+@router.get("/lists/{slug}/changes", response_model=TodoListChanges, response_model_exclude_none=True)
+async def get_list_changes(slug: str,
+                           since: int = Query(ge=0, description="Версия списка, которая уже есть у клиента"),
+                           todo_service: TodoService = Depends(get_todo_service)):
+    """
+    Получить изменения списка по slug после версии since.
+    Возвращает текущую версию и изменения по порядку: у каждого только измененные поля.
+    task_created и task_updated применяются как вставка или обновление задачи, удаление неизвестной задачи игнорируется.
+    Если изменения после since уже удалены из журнала, их слишком много или среди них есть list_reloaded,
+    вместо них возвращается снимок списка целиком (snapshot).
+    """
+    changes = await todo_service.get_todo_list_changes(slug, since, settings.changes_max_entries)
+    return _model_response(changes, exclude_none=True)
+
+@router.post("/lists/{slug}/import")
+async def import_list_tasks(slug: str,
+                            request: Request,
+                            format: TodoTaskTransferFormat = Query(default=TodoTaskTransferFormat.NDJSON),
+                            replace: bool = Query(default=False, description="Удалить существующие задачи перед импортом"),
+                            todo_service: TodoService = Depends(get_todo_service)) -> TodoListImportResult:
+    """
+    Импортировать задачи в список по slug из тела запроса.
+    NDJSON - по объекту {"task": ..., "is_done": ...} в строке, CSV - с заголовком и колонками task и is_done.
+    Задачи добавляются в конец списка в порядке следования, все или ни одной.
+    Возвращает количество импортированных задач и новую версию списка.
+    """
+    return await todo_service.import_todo_tasks(slug, request.stream(), format, replace, settings.tasks_import_chunk_size)
+
+@router.get("/lists/{slug}/export")
+async def export_list_tasks(slug: str,
+                            format: TodoTaskTransferFormat = Query(default=TodoTaskTransferFormat.NDJSON),
+                            todo_service: TodoService = Depends(get_todo_service)) -> StreamingResponse:
+    """
+    Выгрузить все задачи списка по slug потоком в формате NDJSON или CSV, в порядке веса.
+    Выгрузку можно загрузить обратно через import.
+    """
+    stream = await todo_service.stream_todo_tasks(slug, None, settings.tasks_stream_chunk_size, format)
+    media_type = "text/csv" if format == TodoTaskTransferFormat.CSV else "application/x-ndjson"
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{slug}.{format.value}"'},
+    )
+
+@router.get("/lists/{slug}/events")
+async def stream_list_events(slug: str,
+                             todo_service: TodoService = Depends(get_todo_service),
+                             event_hub: EventHub = Depends(get_event_hub)) -> StreamingResponse:
+    """
+    Подписаться на изменения списка по slug (Server-Sent Events).
+    Первым приходит событие ready с текущей версией списка, затем события
+    task_created, task_updated, task_deleted, list_updated, list_deleted по мере фиксации изменений.
+    Событие resync означает, что часть событий потеряна и список нужно перезагрузить.
+    """
+    await todo_service.get_todo_list_version(slug)
+    return StreamingResponse(
+        _list_event_stream(slug, todo_service, event_hub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.delete("/lists/{slug}")
 async def delete_list(slug: str, todo_service: TodoService = Depends(get_todo_service)) -> dict:
@@ -30,24 +186,58 @@ async def delete_list(slug: str, todo_service: TodoService = Depends(get_todo_se
     Удалить список по slug.
     Возвращает результат удаления в виде {"success": true/false}. либо ошибку, если список не найден.
     """
-    result = todo_service.delete_todo_list(slug)
+    result = await todo_service.delete_todo_list(slug)
     return {"success": result}
 
-@router.put("/lists/{slug}")
-async def update_list(slug: str, list: TodoListUpdate, todo_service: TodoService = Depends(get_todo_service)) -> TodoList:
+@router.put("/lists/{slug}", response_model=TodoList)
+async def update_list(slug: str, list: TodoListUpdate, todo_service: TodoService = Depends(get_todo_service)):
     """
     Обновить список по slug.
     Возвращает обновленный список или ошибку, если список не найден.
     """
-    return todo_service.update_todo_list(slug, list)
+    return _model_response(await todo_service.update_todo_list(slug, list))
     
-@router.post("/lists/{slug}/tasks")
-async def add_task_to_list(slug: str, task: TodoTaskCreate, todo_service: TodoService = Depends(get_todo_service)) -> TodoTask:
+@router.post("/lists/{slug}/tasks", response_model=TodoTask)
+async def add_task_to_list(slug: str, task: TodoTaskCreate, todo_service: TodoService = Depends(get_todo_service)):
     """
     Добавить задачу в список по slug.
     Возвращает созданную задачу или ошибку, если список не найден.
     """
-    return todo_service.create_todo_task(slug, task)
+    return _model_response(await todo_service.create_todo_task(slug, task))
+
+@router.post("/lists/{slug}/tasks:batch", response_model=list[TodoTask])
+async def apply_task_batch(slug: str, batch: TodoTaskBatch, todo_service: TodoService = Depends(get_todo_service)):
+    """
+    Применить пакет операций create/update/delete к задачам списка по slug.
+    Операции выполняются по порядку в одной транзакции: либо применяются все, либо ни одна.
+    Возвращает созданные и измененные задачи в порядке их первого упоминания в пакете.
+    """
+    todo_tasks = await todo_service.apply_todo_task_batch(slug, batch)
+    if settings.fast_json_responses:
+        return JSONBytesResponse([task_dict(todo_task) for todo_task in todo_tasks])
+    return todo_tasks
+
+@router.delete("/lists/{slug}/tasks")
+async def delete_list_tasks(slug: str,
+                            is_done: bool | None = Query(default=None, description="Удалить только задачи с этим статусом (по умолчанию все)"),
+                            todo_service: TodoService = Depends(get_todo_service)) -> TodoTaskBulkResult:
+    """
+    Удалить задачи списка по slug одним запросом, например выполненные: ?is_done=true.
+    Возвращает количество удаленных задач и версию списка. Если что-то удалено, подписчики получают list_reloaded.
+    """
+    return await todo_service.delete_todo_tasks(slug, is_done)
+
+@router.patch("/lists/{slug}/tasks")
+async def update_list_tasks(slug: str,
+                            update: TodoTaskBulkUpdate,
+                            is_done: bool | None = Query(default=None, description="Изменить только задачи с этим статусом (по умолчанию все)"),
+                            todo_service: TodoService = Depends(get_todo_service)) -> TodoTaskBulkResult:
+    """
+    Установить статус выполнения всем задачам списка по slug одним запросом.
+    Возвращает количество задач, у которых статус изменился, и версию списка.
+    Если что-то изменилось, подписчики получают list_reloaded.
+    """
+    return await todo_service.update_todo_tasks(slug, is_done, update)
 
 @router.delete("/lists/{slug}/tasks/{task_id}")
 async def delete_task_from_list(slug: str, task_id: uuid.UUID, todo_service: TodoService = Depends(get_todo_service)) -> dict:
@@ -55,12 +245,37 @@ async def delete_task_from_list(slug: str, task_id: uuid.UUID, todo_service: Tod
     Удалить задачу из списка по slug и task_id.
     Возвращает результат удаления в виде {"success": true/false}. либо ошибку, если список или задача не найдены.
     """
-    return {"success": todo_service.delete_todo_task(slug, task_id)}
+    return {"success": await todo_service.delete_todo_task(slug, task_id)}
 
-@router.put("/lists/{slug}/tasks/{task_id}")
-async def update_task_in_list(slug: str, task_id: uuid.UUID, task: TodoTaskUpdate, todo_service: TodoService = Depends(get_todo_service)) -> TodoTask:
+@router.put("/lists/{slug}/tasks/{task_id}", response_model=TodoTask)
+async def update_task_in_list(slug: str, task_id: uuid.UUID, task: TodoTaskUpdate, todo_service: TodoService = Depends(get_todo_service)):
     """
     Обновить задачу в списке по slug и task_id.
     Возвращает обновленную задачу или ошибку, если список или задача не найдены.
     """
-    return todo_service.update_todo_task(slug, task_id, task) 
\ No newline at end of file
+    return _model_response(await todo_service.update_todo_task(slug, task_id, task))
+
+@router.get("/stats", include_in_schema=False)
+async def get_stats(list_cache: ListCache = Depends(get_list_cache),
+                    free_list_pool: FreeListPool = Depends(get_free_list_pool),
+                    list_purger: ListPurger = Depends(get_list_purger),
+                    change_log_compactor: ChangeLogCompactor = Depends(get_change_log_compactor),
+                    single_flight: SingleFlight = Depends(get_single_flight),
+                    admission_controller: AdmissionController = Depends(get_admission_controller),
+                    write_behind: WriteBehindBuffer = Depends(get_write_behind),
+                    database: Database = Depends(get_database),
+                    todo_service: TodoService = Depends(get_todo_service)) -> dict:
+    """
+    Счетчики внутренних компонентов текущего процесса.
+    """
+    return {
+        "database": database.pool_stats(),
+        "admission": admission_controller.stats(),
+        "list_cache": list_cache.stats(),
+        "read_coalescing": single_flight.stats(),
+        "write_behind": write_behind.stats(),
+        "free_list_pool": free_list_pool.stats(),
+        "list_purger": list_purger.stats(),
+        "change_log": change_log_compactor.stats(),
+        "slugs": await todo_service.get_slug_stats(),
+    }
@@ -0,0 +1,62 @@
+"""JSON encoding of hot responses straight from database rows."""
+import json
+import uuid
+from typing import Any, Iterable
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder gives the same documents
+    orjson = None
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Compact UTF-8 JSON. UUIDs are encoded as strings."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def task_dict(row) -> dict:
+    """TodoTask document from a task row or ORM object with id, task, is_done and weight."""
+    # asyncpg returns its own UUID subclass, which orjson doesn't encode natively
+    return {"id": str(row.id), "task": row.task, "is_done": row.is_done, "weight": row.weight}
+
+
+def encode_todo_list(todo_list, task_rows: Iterable) -> bytes:
+    """TodoList document from a list row and its task rows in weight order, without building Pydantic models."""
+    return dumps({
+        "id": str(todo_list.id),
+        "name": todo_list.name,
+        "slug": todo_list.slug,
+        "version": todo_list.version,
+        "tasks": [task_dict(row) for row in task_rows],
+    })
+
+
+def encode_task_page(version: int, task_rows: Iterable, next_cursor: str | None) -> bytes:
+    """TodoTaskPage document from task rows."""
+    return dumps({"version": version, "tasks": [task_dict(row) for row in task_rows], "next_cursor": next_cursor})
+
+
+def encode_ndjson(rows: Iterable) -> bytes:
+    """TodoTask documents from task rows, one per line."""
+    return b"".join(dumps(task_dict(row)) + b"\n" for row in rows)
+
+
+class JSONBytesResponse(Response):
+    """JSON response for content that is already encoded, or is encoded with dumps() instead of FastAPI's encoder."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
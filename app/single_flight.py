@@ -0,0 +1,74 @@
+"""Coalescing of concurrent identical reads within one process."""
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs one call per key at a time and hands its result to every caller that asks for the key meanwhile.
+
+    A finished call's result is also handed out for window more seconds. The call runs in its own task,
+    so a caller that gives up (a disconnected client) doesn't cancel it for the others. Callers check
+    themselves whether a shared result is recent enough for them.
+    """
+
+    def __init__(self, enabled: bool = True, window: float = 0.0):
+        self.enabled = enabled
+        self.window = window
+        self._flights: dict[Hashable, asyncio.Future] = {}
+        self._recent: dict[Hashable, tuple[float, object]] = {}
+
+        self.calls = 0
+        self.shared = 0
+        self.window_hits = 0
+        self.stale = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Result of call for key, and whether it was shared with another caller."""
+        if not self.enabled:
+            return await call(), False
+        recent = self._recent.get(key)
+        if recent is not None:
+            expires_at, result = recent
+            if expires_at > time.monotonic():
+                self.window_hits += 1
+                return result, True
+            del self._recent[key]
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            return await asyncio.shield(flight), True
+        self.calls += 1
+        flight = asyncio.ensure_future(call())
+        self._flights[key] = flight
+        flight.add_done_callback(lambda done: self._land(key, done))
+        return await asyncio.shield(flight), False
+
+    def forget(self, key: Hashable) -> None:
+        """Stop handing out the finished result of key, after its caller found it too old."""
+        self.stale += 1
+        self._recent.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "shared": self.shared,
+            "window_hits": self.window_hits,
+            "stale": self.stale,
+        }
+
+    def _land(self, key: Hashable, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if self.window > 0 and not flight.cancelled() and flight.exception() is None:
+            self._recent[key] = (time.monotonic() + self.window, flight.result())
+            asyncio.get_running_loop().call_later(self.window, self._expire, key)
+
+    def _expire(self, key: Hashable) -> None:
+        recent = self._recent.get(key)
+        if recent is not None and recent[0] <= time.monotonic():
+            del self._recent[key]
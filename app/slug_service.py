@@ -1,9 +1,126 @@
-import random
+"""Generation of public todo list slugs."""
+import asyncio
+import math
+import secrets
 import string
+from abc import ABC, abstractmethod
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.repositories.todo_list_repository import TodoListRepository
+
+SLUG_ALPHABET = string.ascii_uppercase + string.digits
+SLUG_LENGTH = 8
+SLUG_SPACE = len(SLUG_ALPHABET) ** SLUG_LENGTH
+
+# x -> (x * A + B) mod 36^8 is a bijection when A is coprime with 36,
+# so distinct sequence numbers always give distinct (and non-consecutive looking) slugs
+_SCRAMBLE_MULTIPLIER = 1_853_024_483_987
+_SCRAMBLE_OFFSET = 1_122_154_715_669
+
+
+def encode_slug(number: int) -> str:
+    """Encode a number in [0, 36^8) as a fixed-length slug."""
+    chars = []
+    for _ in range(SLUG_LENGTH):
+        number, digit = divmod(number, len(SLUG_ALPHABET))
+        chars.append(SLUG_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def scramble(number: int) -> int:
+    return (number * _SCRAMBLE_MULTIPLIER + _SCRAMBLE_OFFSET) % SLUG_SPACE
+
+
+class SlugGenerator(ABC):
+    name: str
+
+    @abstractmethod
+    async def generate(self, session: AsyncSession, count: int) -> list[str]:
+        ...
+
+    @abstractmethod
+    def collision_probability(self, existing: int) -> float:
+        """Probability that a freshly generated slug is already taken when the table holds `existing` lists."""
+
+
+class RandomSlugGenerator(SlugGenerator):
+    """CSPRNG slugs, pre-computed in batches. Uniqueness is left to the unique index on todo_lists.slug."""
+
+    name = "random"
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self._buffer: list[str] = []
+
+    async def generate(self, session: AsyncSession, count: int) -> list[str]:
+        while len(self._buffer) < count:
+            self._buffer.extend(encode_slug(secrets.randbelow(SLUG_SPACE)) for _ in range(max(self.batch_size, count)))
+        slugs = self._buffer[-count:]
+        del self._buffer[-count:]
+        return slugs
+
+    def collision_probability(self, existing: int) -> float:
+        return existing / SLUG_SPACE
+
+
+class SequenceSlugGenerator(SlugGenerator):
+    """Scrambled values of the todo_list_slug_seq sequence: one round trip per call, never collides with itself."""
+
+    name = "sequence"
+
+    def __init__(self, todo_lists: TodoListRepository):
+        self.todo_lists = todo_lists
+
+    async def generate(self, session: AsyncSession, count: int) -> list[str]:
+        numbers = await self.todo_lists.next_slug_numbers(session, count)
+        return [encode_slug(scramble(number)) for number in numbers]
+
+    def collision_probability(self, existing: int) -> float:
+        return 0.0
+
+
+class BlockSlugGenerator(SequenceSlugGenerator):
+    """Reserves block_size sequence values at once and hands them out locally, without a round trip per slug."""
+
+    name = "block"
+
+    def __init__(self, todo_lists: TodoListRepository, block_size: int = 1000):
+        super().__init__(todo_lists)
+        self.block_size = block_size
+        self._reserved: list[int] = []
+        self._lock = asyncio.Lock()
+
+    async def generate(self, session: AsyncSession, count: int) -> list[str]:
+        async with self._lock:
+            if len(self._reserved) < count:
+                # Values left over after a restart are simply never used
+                self._reserved.extend(await self.todo_lists.next_slug_numbers(session, max(self.block_size, count)))
+            numbers = self._reserved[:count]
+            del self._reserved[:count]
+        return [encode_slug(scramble(number)) for number in numbers]
+
 
 class SlugService:
-    def generate_slug(self, length: int = 8) -> str:
-        letters_and_digits = string.ascii_uppercase + string.digits
+    def __init__(self, generator: SlugGenerator | None = None):
+        self.generator = generator or RandomSlugGenerator()
+        self.generated = 0
+
+    async def generate_slug(self, session: AsyncSession) -> str:
+        return (await self.generate_slugs(session, 1))[0]
 
+    async def generate_slugs(self, session: AsyncSession, count: int) -> list[str]:
+        slugs = await self.generator.generate(session, count)
+        self.generated += len(slugs)
+        return slugs
 
-        return ''.join(random.choice(letters_and_digits) for _ in range(length))
\ No newline at end of file
+    def stats(self, existing: int) -> dict:
+        return {
+            "strategy": self.generator.name,
+            "generated": self.generated,
+            "space": SLUG_SPACE,
+            "lists": existing,
+            "collision_probability": self.generator.collision_probability(existing),
+            # Chance that at least one pair among the existing lists would collide with purely random slugs
+            "random_birthday_probability": abs(math.expm1(-existing * (existing - 1) / (2 * SLUG_SPACE))),
+        }
@@ -0,0 +1,97 @@
+"""Parsing and formatting of todo tasks for bulk import and export."""
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Iterable
+
+from app.entities import TodoTaskTransferFormat
+from app.exceptions import InvalidImportException
+from app.serialization import encode_ndjson
+
+EXPORT_COLUMNS = ("id", "task", "is_done", "weight")
+
+
+def format_header(format: TodoTaskTransferFormat) -> bytes:
+    if format == TodoTaskTransferFormat.CSV:
+        return (",".join(EXPORT_COLUMNS) + "\n").encode()
+    return b""
+
+
+def format_rows(rows: Iterable, format: TodoTaskTransferFormat) -> bytes:
+    """Serialize task rows (id, task, is_done, weight) as NDJSON lines or CSV records."""
+    if format == TodoTaskTransferFormat.CSV:
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerows((str(row.id), row.task, "true" if row.is_done else "false", repr(row.weight)) for row in rows)
+        return output.getvalue().encode()
+    return encode_ndjson(rows)
+
+
+async def read_records(chunks: AsyncIterator[bytes], format: TodoTaskTransferFormat) -> AsyncIterator[tuple[int, dict]]:
+    """Parse an NDJSON or CSV (with a header row) byte stream into (record number, record) pairs as it arrives."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    number = 0
+    header: list[str] | None = None
+    final = False
+    chunks = aiter(chunks)
+    while not final:
+        try:
+            pending += decoder.decode(await anext(chunks))
+        except StopAsyncIteration:
+            pending += decoder.decode(b"", final=True)
+            final = True
+        except UnicodeDecodeError:
+            raise InvalidImportException("Import data is not valid UTF-8.")
+
+        if final:
+            complete, pending = pending, ""
+        else:
+            complete, pending = _split_complete(pending, format)
+        if not complete:
+            continue
+
+        if format == TodoTaskTransferFormat.CSV:
+            for row in csv.reader(io.StringIO(complete)):
+                if header is None:
+                    header = [column.strip() for column in row]
+                    continue
+                number += 1
+                if row:
+                    # An empty CSV cell means the column is not set
+                    yield number, {column: value for column, value in zip(header, row) if value != ""}
+        else:
+            lines = complete.split("\n")
+            if not lines[-1]:
+                # What follows the final newline is not a record
+                lines.pop()
+            for line in lines:
+                number += 1
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise InvalidImportException(f"Record {number}: invalid JSON.")
+                if not isinstance(record, dict):
+                    raise InvalidImportException(f"Record {number}: expected a JSON object.")
+                yield number, record
+
+
+def _split_complete(text: str, format: TodoTaskTransferFormat) -> tuple[str, str]:
+    """Split text into whole records and an unfinished tail."""
+    if format != TodoTaskTransferFormat.CSV:
+        end = text.rfind("\n") + 1
+        return text[:end], text[end:]
+    # A CSV record may contain newlines inside quotes: only a newline after an even number of quotes ends a record
+    parity = 0
+    position = 0
+    end = 0
+    lines = text.split("\n")
+    for line in lines[:-1]:
+        parity ^= line.count('"') & 1
+        position += len(line) + 1
+        if not parity:
+            end = position
+    return text[:end], text[end:]
@@ -1,123 +1,677 @@
+import base64
+import binascii
+import json
+import tempfile
+import time
 import uuid
+from typing import IO, AsyncIterator, Awaitable, Callable, TypeVar
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
 from app.db.database import Database
 from app.db.models import TodoTaskOrm, TodoListOrm
 from app.db.unit_of_work import UnitOfWork
-from app.entities import TodoList, TodoTask, TodoListCreate, TodoListUpdate, TodoTaskCreate, TodoTaskUpdate
-from app.weight_service import WeightService
+from app.change_log import make_change
+from app.entities import (TodoList, TodoListChange, TodoListChanges, TodoTask, TodoTaskPage, TodoTaskImport, TodoTaskTransferFormat, TodoListImportResult, TodoListCreate, TodoListUpdate, TodoTaskCreate, TodoTaskUpdate, TodoListEvent,
+                          TodoListEventType, MovePosition, TodoTaskBatch, TodoTaskBatchOperationType, TodoTaskBulkUpdate, TodoTaskBulkResult)
+from app.event_hub import EventHub
+from app.free_list_pool import FreeListPool
+from app.list_cache import ListCache
+from app.metrics import measure
+from app.retry_policy import RetryPolicy
+from app.serialization import dumps, encode_task_page, encode_todo_list
+from app.single_flight import SingleFlight
+from app.weight_service import WeightIndex, WeightService
+from app.write_behind import WriteBehindBuffer
 from app.slug_service import SlugService
 
-from app.exceptions import TodoListNotFoundException, TodoTaskNotFoundException
+from app.exceptions import (TodoListNotFoundException, TodoTaskNotFoundException, InvalidCursorException, InvalidImportException,
+                            WeightRebalanceRequiredException)
+from app.task_transfer import format_header, format_rows, read_records
+
+
+T = TypeVar("T")
+
+_IMPORT_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def encode_task_cursor(weight: float, task_id: uuid.UUID) -> str:
+    """Opaque pagination cursor for the (weight, id) key of the last task of a page."""
+    raw = json.dumps([weight, str(task_id)]).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_task_cursor(cursor: str | None) -> tuple[float, uuid.UUID] | None:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        weight, task_id = json.loads(raw)
+        return float(weight), uuid.UUID(task_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorException(f"Invalid cursor '{cursor}'.")
 
 
 class TodoService:
     def __init__(self, 
                  uow: UnitOfWork,
                  slug_service: SlugService,
-                 weight_service: WeightService):
+                 weight_service: WeightService,
+                 event_hub: EventHub,
+                 list_cache: ListCache,
+                 free_list_pool: FreeListPool,
+                 retry_policy: RetryPolicy,
+                 single_flight: SingleFlight,
+                 write_behind: WriteBehindBuffer,
+                 read_uow: UnitOfWork | None = None):
         self.uow = uow
         self.slug_service = slug_service
         self.weight_service = weight_service
+        self.event_hub = event_hub
+        self.list_cache = list_cache
+        self.free_list_pool = free_list_pool
+        self.retry_policy = retry_policy
+        self.single_flight = single_flight
+        self.write_behind = write_behind
+        self.read_uow = read_uow or uow
 
+    async def _publish(self, event: TodoListEvent) -> None:
+        self.list_cache.invalidate(event.slug, event.version)
+        await self.event_hub.publish(event)
 
-    def create_todo_list(self, todo_list_create: TodoListCreate) -> TodoList:
-        with self.uow as uow:
-            todo_list_orm: TodoListOrm = uow.todo_lists.get_one_free(uow.session)
+    async def _calculate_weight(self, uow: UnitOfWork, list_id: uuid.UUID, position, target_task_id, moving_task_id=None) -> tuple[float, bool]:
+        """Returns the weight and whether the list had to be rebalanced to make room for it."""
+        with measure("weight_calculation"):
+            try:
+                return await self._calculate_weight_from_neighbours(uow, list_id, position, target_task_id, moving_task_id), False
+            except WeightRebalanceRequiredException:
+                # Renumber the whole list in the same transaction and place the task again
+                await uow.todo_tasks.rebalance(uow.session, list_id, self.weight_service.normal_step)
+                return await self._calculate_weight_from_neighbours(uow, list_id, position, target_task_id, moving_task_id), True
+
+    def _calculate_weight_in_index(self, index: WeightIndex, position, target_task_id, moving_task_id=None) -> tuple[float, bool]:
+        with measure("weight_calculation"):
+            try:
+                return self.weight_service.calculate_weight(index, position, target_task_id, moving_task_id=moving_task_id), False
+            except WeightRebalanceRequiredException:
+                index.rebalance(self.weight_service.normal_step)
+                return self.weight_service.calculate_weight(index, position, target_task_id, moving_task_id=moving_task_id), True
+
+    async def _calculate_weight_from_neighbours(self, uow: UnitOfWork, list_id: uuid.UUID, position, target_task_id, moving_task_id) -> float:
+        # Only the target and at most one neighbour are read, however long the list is
+        if position in (MovePosition.BEFORE, MovePosition.AFTER) and target_task_id is not None:
+            target_weight = await uow.todo_tasks.get_weight(uow.session, list_id, target_task_id)
+            if target_weight is not None:
+                if target_task_id == moving_task_id:
+                    return target_weight
+                neighbour_weight = await uow.todo_tasks.get_adjacent_weight(
+                    uow.session, list_id, target_task_id, target_weight,
+                    after=position == MovePosition.AFTER, exclude_id=moving_task_id)
+                if position == MovePosition.AFTER:
+                    return self.weight_service.weight_between(target_weight, neighbour_weight)
+                return self.weight_service.weight_between(neighbour_weight, target_weight)
+
+        if position == MovePosition.FIRST:
+            first_weight = await uow.todo_tasks.get_boundary_weight(uow.session, list_id, last=False, exclude_id=moving_task_id)
+            return self.weight_service.weight_between(None, first_weight)
+
+        last_weight = await uow.todo_tasks.get_boundary_weight(uow.session, list_id, last=True, exclude_id=moving_task_id)
+        return self.weight_service.weight_between(last_weight, None)
+
+    async def create_todo_list(self, todo_list_create: TodoListCreate) -> TodoList:
+        started_at = time.perf_counter()
+        async with self.uow as uow:
+            todo_list_orm: TodoListOrm = await uow.todo_lists.claim_free(uow.session, name=todo_list_create.name)
+            from_pool = todo_list_orm is not None
             if todo_list_orm is None:
+                # The pool is empty: create the list inline, a slug conflict only rolls back its savepoint
                 attempts = 5
                 for _ in range(attempts):
-                    slug = self.slug_service.generate_slug()
+                    slug = await self.slug_service.generate_slug(uow.session)
                     try:
-                        todo_list_orm = uow.todo_lists.create(uow.session, slug=slug, name=todo_list_create.name, is_free=False)
+                        async with uow.session.begin_nested():
+                            todo_list_orm = await uow.todo_lists.create(uow.session, slug=slug, name=todo_list_create.name, is_free=False)
                         break
-                    except Exception:
+                    except IntegrityError:
                         continue
                 else:
                     raise Exception("Failed to create a unique slug for the todo list after multiple attempts.")
-            else:
-                uow.todo_lists.update(uow.session, todo_list_orm, name=todo_list_create.name, is_free=False)
-            todo_list = TodoList.model_validate(todo_list_orm)
-            uow.commit()
+            # A claimed or just created list never has tasks
+            todo_list = TodoList(
+                id=todo_list_orm.id,
+                name=todo_list_orm.name,
+                slug=todo_list_orm.slug,
+                version=todo_list_orm.version,
+                tasks=[],
+            )
+            await uow.commit()
+        self.free_list_pool.record_claim(time.perf_counter() - started_at, from_pool)
         return todo_list
     
 
-    def get_todo_list_by_slug(self, slug: str) -> TodoList:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, slug, with_tasks=True)
+    async def _read_todo_list(self, slug: str, read: Callable[[UnitOfWork, str], Awaitable[tuple[int, T]]]) -> tuple[int, T]:
+        # Lists are read from the replica if there is one. A list the replica doesn't have yet, or has in a version
+        # older than a change this worker already knows of, is read again from the primary
+        if self.read_uow.session_factory is not self.uow.session_factory:
+            try:
+                version, result = await read(self.read_uow, slug)
+                if version >= self.list_cache.min_version(slug):
+                    return version, result
+            except TodoListNotFoundException:
+                pass
+        return await read(self.uow, slug)
+
+    async def _coalesce(self, key: tuple, slug: str, fetch: Callable[[], Awaitable[tuple[int, T]]]) -> tuple[int, T]:
+        # Concurrent reads of one list share a single fetch. A shared result that is older than a change
+        # this worker already knows of was read before that change committed, and is read again
+        (version, result), shared = await self.single_flight.do(key, fetch)
+        if shared and version < self.list_cache.min_version(slug):
+            self.single_flight.forget(key)
+            version, result = await fetch()
+        return version, result
+
+    async def get_todo_list_by_slug(self, slug: str) -> TodoList:
+        await self.write_behind.flush(slug)
+        _, todo_list = await self._coalesce(
+            ("model", slug), slug, lambda: self._read_todo_list(slug, self._load_todo_list))
+        return todo_list
+
+    async def _load_todo_list(self, uow: UnitOfWork, slug: str) -> tuple[int, TodoList]:
+        async with uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug, with_tasks=True)
             if todo_list_orm is None or todo_list_orm.is_free:
                 raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
-            todo_list = TodoList.model_validate(todo_list_orm)
+            with measure("serialization"):
+                todo_list = TodoList.model_validate(todo_list_orm)
+        return todo_list.version, todo_list
+
+    async def get_todo_list_json_by_slug(self, slug: str) -> tuple[int, bytes]:
+        # Edits this worker acknowledged are read back: pending ones are written first, which invalidates the cache
+        await self.write_behind.flush(slug)
+        cached = self.list_cache.get(slug)
+        if cached is not None:
+            return cached
+        return await self._coalesce(("json", slug), slug, lambda: self._fetch_todo_list_json(slug))
+
+    async def _fetch_todo_list_json(self, slug: str) -> tuple[int, bytes]:
+        generation = self.list_cache.generation
+        version, payload = await self._read_todo_list(slug, self._load_todo_list_json)
+        self.list_cache.set(slug, version, payload, generation)
+        return version, payload
+
+    async def _load_todo_list_json(self, uow: UnitOfWork, slug: str) -> tuple[int, bytes]:
+        async with uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug)
+            if todo_list_orm is None or todo_list_orm.is_free:
+                raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
+            rows = await uow.todo_tasks.get_rows_by_list_id(uow.session, todo_list_orm.id)
+        # Encoded straight from the rows: no task ORM objects and no Pydantic models on the hottest read
+        with measure("serialization"):
+            payload = encode_todo_list(todo_list_orm, rows)
+        return todo_list_orm.version, payload
+
+    async def _get_todo_tasks_page_rows(self, slug: str, after: str | None, limit: int) -> tuple[int, list, str | None]:
+        after_key = decode_task_cursor(after)
+        await self.write_behind.flush(slug)
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug)
+            if todo_list_orm is None or todo_list_orm.is_free:
+                raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
+            # One extra row tells whether there is a next page
+            rows = await uow.todo_tasks.get_page(uow.session, todo_list_orm.id, after_key, limit + 1)
+        next_cursor = encode_task_cursor(rows[limit - 1].weight, rows[limit - 1].id) if len(rows) > limit else None
+        return todo_list_orm.version, rows[:limit], next_cursor
+
+    async def get_todo_tasks_page(self, slug: str, after: str | None, limit: int) -> TodoTaskPage:
+        version, rows, next_cursor = await self._get_todo_tasks_page_rows(slug, after, limit)
+        return TodoTaskPage(
+            version=version,
+            tasks=[TodoTask.model_validate(row) for row in rows],
+            next_cursor=next_cursor,
+        )
+
+    async def get_todo_tasks_page_json(self, slug: str, after: str | None, limit: int) -> bytes:
+        version, rows, next_cursor = await self._get_todo_tasks_page_rows(slug, after, limit)
+        with measure("serialization"):
+            return encode_task_page(version, rows, next_cursor)
+
+    async def stream_todo_tasks(
+        self,
+        slug: str,
+        after: str | None,
+        chunk_size: int,
+        format: TodoTaskTransferFormat = TodoTaskTransferFormat.NDJSON
+    ) -> AsyncIterator[bytes]:
+        # Cursor and list are checked before the response starts, errors can't be reported in the middle of a stream
+        after_key = decode_task_cursor(after)
+        await self.get_todo_list_version(slug)
+        return self._stream_todo_tasks(slug, after_key, chunk_size, format)
+
+    async def _stream_todo_tasks(
+        self,
+        slug: str,
+        after_key: tuple[float, uuid.UUID] | None,
+        chunk_size: int,
+        format: TodoTaskTransferFormat
+    ) -> AsyncIterator[bytes]:
+        header = format_header(format)
+        if header:
+            yield header
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug)
+            if todo_list_orm is None or todo_list_orm.is_free:
+                return
+            async for rows in uow.todo_tasks.stream_by_list_id(uow.session, todo_list_orm.id, after_key, chunk_size):
+                # Rows are written as they are read, so memory depends on chunk_size and not on the list size
+                yield format_rows(rows, format)
+
+    async def import_todo_tasks(
+        self,
+        slug: str,
+        chunks: AsyncIterator[bytes],
+        format: TodoTaskTransferFormat,
+        replace: bool,
+        chunk_size: int
+    ) -> TodoListImportResult:
+        # The body is read and checked before the list is touched: a slow upload holds neither a connection nor
+        # the list lock. Checked tasks wait in memory, or on disk past _IMPORT_SPOOL_SIZE
+        await self.get_todo_list_version(slug)
+        with tempfile.SpooledTemporaryFile(max_size=_IMPORT_SPOOL_SIZE) as staged:
+            async for number, record in read_records(chunks, format):
+                try:
+                    todo_task_import = TodoTaskImport.model_validate(record)
+                except ValidationError as exc:
+                    raise InvalidImportException(f"Record {number}: {exc.errors(include_url=False)}")
+                staged.write(dumps([todo_task_import.task, todo_task_import.is_done]) + b"\n")
+            result = await self.retry_policy.run(lambda: self._import_todo_tasks(slug, staged, replace, chunk_size))
+        await self._publish(TodoListEvent(type=TodoListEventType.LIST_RELOADED, slug=slug, version=result.version))
+        return result
+
+    async def _import_todo_tasks(self, slug: str, staged: IO[bytes], replace: bool, chunk_size: int) -> TodoListImportResult:
+        staged.seek(0)
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug, with_block=True)
+            if todo_list_orm is None or todo_list_orm.is_free:
+                raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
+            if replace:
+                await uow.todo_tasks.delete_by_list_id(uow.session, todo_list_orm.id)
+                weight = 0.0
+            else:
+                weight = await uow.todo_tasks.get_boundary_weight(uow.session, todo_list_orm.id, last=True) or 0.0
+
+            # Imported tasks go after the existing ones, evenly spaced, in the order of the input
+            step = self.weight_service.normal_step
+            imported = 0
+            rows = []
+            for line in staged:
+                task, is_done = json.loads(line)
+                weight += step
+                rows.append((uuid.uuid4(), task, is_done, todo_list_orm.id, weight))
+                if len(rows) >= chunk_size:
+                    await uow.todo_tasks.copy_rows(uow.session, rows)
+                    imported += len(rows)
+                    rows = []
+            await uow.todo_tasks.copy_rows(uow.session, rows)
+            imported += len(rows)
+
+            await uow.todo_lists.bump_version(uow.session, todo_list_orm)
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, todo_list_orm.version, [
+                make_change(TodoListEventType.LIST_RELOADED)])
+            await uow.commit()
+        return TodoListImportResult(imported=imported, version=todo_list_orm.version)
+
+    async def get_slug_stats(self) -> dict:
+        async with self.uow as uow:
+            existing = await uow.todo_lists.count(uow.session)
+        return self.slug_service.stats(existing)
+
+    async def get_todo_list_version(self, slug: str) -> int:
+        await self.write_behind.flush(slug)
+        cached = self.list_cache.get(slug)
+        if cached is not None:
+            return cached[0]
+        async with self.uow as uow:
+            version = await uow.todo_lists.get_version_by_slug(uow.session, slug)
+            if version is None:
+                raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
+        return version
+
+    async def get_todo_list_changes(self, slug: str, since: int, max_changes: int) -> TodoListChanges:
+        # A client that is up to date costs a version lookup, usually from the cache
+        version = await self.get_todo_list_version(slug)
+        if since == version:
+            return TodoListChanges(version=version, changes=[])
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug)
+            if todo_list_orm is None or todo_list_orm.is_free:
+                raise TodoListNotFoundException(f"Todo list with slug '{slug}' not found.")
+            version = todo_list_orm.version
+            if since == version:
+                return TodoListChanges(version=version, changes=[])
+            if since < version:
+                # The log answers only if nothing after since has been trimmed from it yet
+                min_version = await uow.todo_list_changes.get_min_version(uow.session, todo_list_orm.id)
+                if min_version is not None and min_version <= since + 1:
+                    # Changes committed after the version was read are left for the next request
+                    changes = await uow.todo_list_changes.get_since(uow.session, todo_list_orm.id, since, version, max_changes + 1)
+                    if len(changes) <= max_changes and all(change.op != TodoListEventType.LIST_RELOADED.value for change in changes):
+                        return TodoListChanges(version=version, changes=[
+                            TodoListChange(op=change.op, version=change.version, task_id=change.task_id, **(change.data or {}))
+                            for change in changes
+                        ])
+            # Too far behind, across a reload, or ahead of the list
+            rows = await uow.todo_tasks.get_rows_by_list_id(uow.session, todo_list_orm.id)
+            with measure("serialization"):
+                snapshot = TodoList(
+                    id=todo_list_orm.id,
+                    name=todo_list_orm.name,
+                    slug=todo_list_orm.slug,
+                    version=version,
+                    tasks=[TodoTask.model_validate(row) for row in rows],
+                )
+        return TodoListChanges(version=version, snapshot=snapshot)
+
+    async def update_todo_list(self, todo_list_slug: str, todo_list_update: TodoListUpdate) -> TodoList:
+        await self.write_behind.flush(todo_list_slug)
+        todo_list = await self.retry_policy.run(lambda: self._update_todo_list(todo_list_slug, todo_list_update))
+        await self._publish(TodoListEvent(
+            type=TodoListEventType.LIST_UPDATED, slug=todo_list.slug, version=todo_list.version, name=todo_list.name))
         return todo_list
-    
-    def update_todo_list(self, todo_list_slug: str, todo_list_update: TodoListUpdate) -> TodoList:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
-            if todo_list_orm is None:
+
+    async def _update_todo_list(self, todo_list_slug: str, todo_list_update: TodoListUpdate) -> TodoList:
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_tasks=True, with_block=True)
+            if todo_list_orm is None or todo_list_orm.is_free:
                 raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
-            uow.todo_lists.update(session = uow.session, todo_list = todo_list_orm, name = todo_list_update.name)
+            await uow.todo_lists.update(session = uow.session, todo_list = todo_list_orm, name = todo_list_update.name)
+            await uow.todo_lists.bump_version(uow.session, todo_list_orm)
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, todo_list_orm.version, [
+                make_change(TodoListEventType.LIST_UPDATED, name=todo_list_orm.name)])
             todo_list = TodoList.model_validate(todo_list_orm)
-            uow.commit()
+            await uow.commit()
         return todo_list
     
-    def delete_todo_list(self, todo_list_slug: str) -> bool:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
-            if todo_list_orm is None:
-                raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
-            uow.todo_lists.free(uow.session, todo_list_orm)
-            result = uow.todo_tasks.delete_by_list_id(uow.session, todo_list_orm.id)
-            uow.commit()
-        return result
-    
-    def create_todo_task(self, todo_list_slug: str, todo_task_create: TodoTaskCreate) -> TodoTask:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
+    async def delete_todo_list(self, todo_list_slug: str) -> bool:
+        await self.write_behind.flush(todo_list_slug)
+        version = await self.retry_policy.run(lambda: self._delete_todo_list(todo_list_slug))
+        await self._publish(TodoListEvent(
+            type=TodoListEventType.LIST_DELETED, slug=todo_list_slug, version=version))
+        return True
+
+    async def _delete_todo_list(self, todo_list_slug: str) -> int:
+        async with self.uow as uow:
+            todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
             if todo_list_orm is None or todo_list_orm.is_free:
                 raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
-            todo_list = TodoList.model_validate(todo_list_orm)
+            # Constant time whatever the list size: the row keeps its tasks and waits for the ListPurger,
+            # the slug moves to a new free list that can be claimed as soon as this commits. The version
+            # carries over, so clients holding the slug still see it grow.
+            version = todo_list_orm.version + 1
+            await uow.todo_lists.tombstone(uow.session, todo_list_orm)
+            await uow.todo_lists.create(uow.session, name="", slug=todo_list_slug, is_free=True, version=version)
+            await uow.commit()
+        return version
+
+    async def _get_taken_list(self, uow: UnitOfWork, todo_list_slug: str, lock: bool = False) -> TodoListOrm:
+        todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=lock)
+        if todo_list_orm is None or todo_list_orm.is_free:
+            raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
+        return todo_list_orm
+
+    async def _increment_version(self, uow: UnitOfWork, todo_list_orm: TodoListOrm) -> int:
+        version = await uow.todo_lists.increment_version(uow.session, todo_list_orm.id)
+        if version is None:
+            # Deleted after it was read
+            raise TodoListNotFoundException(f"Todo list with slug '{todo_list_orm.slug}' not found.")
+        return version
+
+    async def _lock_task(self, uow: UnitOfWork, todo_list_orm: TodoListOrm, todo_task_id: uuid.UUID) -> TodoTaskOrm:
+        todo_task_orm = await uow.todo_tasks.get_by_id(uow.session, todo_task_id, with_block=True, list_id=todo_list_orm.id)
+        if todo_task_orm is None:
+            raise TodoTaskNotFoundException(f"Todo task with id '{todo_task_id}' not found.")
+        return todo_task_orm
+
+    # Locking rules of task mutations: the list row is locked first, when the list is read, then task rows
+    # in ID order (lock_by_ids, and lock_where before set-based statements and rebalances). Every path
+    # takes them in this order, so writers of one list queue on its row instead of deadlocking on tasks.
 
-            weight = self.weight_service.calculate_weight(
-                todo_list,
+    async def create_todo_task(self, todo_list_slug: str, todo_task_create: TodoTaskCreate) -> TodoTask:
+        version, todo_task, rebalanced = await self.retry_policy.run(lambda: self._create_todo_task(todo_list_slug, todo_task_create))
+        # After a rebalance other tasks moved too, so subscribers have to reload the list
+        event_type = TodoListEventType.LIST_RELOADED if rebalanced else TodoListEventType.TASK_CREATED
+        await self._publish(TodoListEvent(type=event_type, slug=todo_list_slug, version=version, task=todo_task))
+        return todo_task
+
+    async def _create_todo_task(self, todo_list_slug: str, todo_task_create: TodoTaskCreate) -> tuple[int, TodoTask, bool]:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            version = await self._increment_version(uow, todo_list_orm)
+            weight, rebalanced = await self._calculate_weight(
+                uow,
+                todo_list_orm.id,
                 todo_task_create.move_position,
                 todo_task_create.target_task
             )
-            todo_task_orm: TodoTaskOrm = uow.todo_tasks.create(uow.session, todo_list_id=todo_list_orm.id, task=todo_task_create.task, weight=weight, is_done=todo_task_create.is_done)
+            todo_task_orm: TodoTaskOrm = await uow.todo_tasks.create(uow.session, todo_list_id=todo_list_orm.id, task=todo_task_create.task, weight=weight, is_done=todo_task_create.is_done)
             todo_task = TodoTask.model_validate(todo_task_orm)
-            uow.commit()
-        return todo_task
+            if rebalanced:
+                change = make_change(TodoListEventType.LIST_RELOADED)
+            else:
+                change = make_change(TodoListEventType.TASK_CREATED, todo_task.id,
+                                     task=todo_task.task, is_done=todo_task.is_done, weight=todo_task.weight)
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, version, [change])
+            await uow.commit()
+        return version, todo_task, rebalanced
     
-    def delete_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID) -> bool:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
-            if todo_list_orm is None or todo_list_orm.is_free:
-                raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
-            todo_task_orm = uow.todo_tasks.get_by_id(uow.session, todo_task_id, with_block=True)
-            if todo_task_orm is None:
-                raise TodoTaskNotFoundException(f"Todo task with id '{todo_task_id}' not found.")
-            result = uow.todo_tasks.delete(uow.session, todo_task_orm)
-            uow.commit()
+    async def delete_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID) -> bool:
+        version, result = await self.retry_policy.run(lambda: self._delete_todo_task(todo_list_slug, todo_task_id))
+        await self._publish(TodoListEvent(
+            type=TodoListEventType.TASK_DELETED, slug=todo_list_slug, version=version, task_id=todo_task_id))
         return result
+
+    async def _delete_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID) -> tuple[int, bool]:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            todo_task_orm = await self._lock_task(uow, todo_list_orm, todo_task_id)
+            result = await uow.todo_tasks.delete(uow.session, todo_task_orm)
+            version = await self._increment_version(uow, todo_list_orm)
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, version, [
+                make_change(TodoListEventType.TASK_DELETED, todo_task_id)])
+            await uow.commit()
+        return version, result
     
-    def update_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID, todo_task_update: TodoTaskUpdate) -> TodoTask:
-        with self.uow as uow:
-            todo_list_orm = uow.todo_lists.get_by_slug(uow.session, todo_list_slug, with_block=True)
-            if todo_list_orm is None or todo_list_orm.is_free:
-                raise TodoListNotFoundException(f"Todo list with slug '{todo_list_slug}' not found.")
-            todo_list = TodoList.model_validate(todo_list_orm)
+    async def delete_todo_tasks(self, todo_list_slug: str, is_done: bool | None) -> TodoTaskBulkResult:
+        # The filter has to see the is_done edits acknowledged before it
+        await self.write_behind.flush(todo_list_slug)
+        result = await self.retry_policy.run(lambda: self._delete_todo_tasks(todo_list_slug, is_done))
+        await self._publish_bulk(todo_list_slug, result)
+        return result
+
+    async def _delete_todo_tasks(self, todo_list_slug: str, is_done: bool | None) -> TodoTaskBulkResult:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            affected = await uow.todo_tasks.delete_where(uow.session, todo_list_orm.id, is_done)
+            return await self._finish_bulk(uow, todo_list_orm, affected)
+
+    async def update_todo_tasks(self, todo_list_slug: str, is_done: bool | None, todo_task_update: TodoTaskBulkUpdate) -> TodoTaskBulkResult:
+        await self.write_behind.flush(todo_list_slug)
+        result = await self.retry_policy.run(lambda: self._update_todo_tasks(todo_list_slug, is_done, todo_task_update))
+        await self._publish_bulk(todo_list_slug, result)
+        return result
+
+    async def _update_todo_tasks(self, todo_list_slug: str, is_done: bool | None, todo_task_update: TodoTaskBulkUpdate) -> TodoTaskBulkResult:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            affected = await uow.todo_tasks.set_is_done_where(uow.session, todo_list_orm.id, todo_task_update.is_done, is_done)
+            return await self._finish_bulk(uow, todo_list_orm, affected)
+
+    async def _finish_bulk(self, uow: UnitOfWork, todo_list_orm: TodoListOrm, affected: int) -> TodoTaskBulkResult:
+        if not affected:
+            return TodoTaskBulkResult(affected=0, version=todo_list_orm.version)
+        version = await self._increment_version(uow, todo_list_orm)
+        # Any number of tasks may have changed: clients reload the list instead of getting a change per task
+        await uow.todo_list_changes.append(uow.session, todo_list_orm.id, version, [make_change(TodoListEventType.LIST_RELOADED)])
+        await uow.commit()
+        return TodoTaskBulkResult(affected=affected, version=version)
 
-            todo_task_orm = uow.todo_tasks.get_by_id(uow.session, todo_task_id, with_block=True)
+    async def _publish_bulk(self, todo_list_slug: str, result: TodoTaskBulkResult) -> None:
+        if result.affected:
+            await self._publish(TodoListEvent(type=TodoListEventType.LIST_RELOADED, slug=todo_list_slug, version=result.version))
+
+    async def update_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID, todo_task_update: TodoTaskUpdate) -> TodoTask:
+        if self.write_behind.enabled and todo_task_update.move_position is None:
+            return await self._record_todo_task_update(todo_list_slug, todo_task_id, todo_task_update)
+        # Moves stay synchronous, after the edits acknowledged before them
+        await self.write_behind.flush(todo_list_slug)
+        version, todo_task, rebalanced = await self.retry_policy.run(
+            lambda: self._update_todo_task(todo_list_slug, todo_task_id, todo_task_update))
+        event_type = TodoListEventType.LIST_RELOADED if rebalanced else TodoListEventType.TASK_UPDATED
+        await self._publish(TodoListEvent(type=event_type, slug=todo_list_slug, version=version, task=todo_task))
+        return todo_task
+
+    async def _record_todo_task_update(self, todo_list_slug: str, todo_task_id: uuid.UUID, todo_task_update: TodoTaskUpdate) -> TodoTask:
+        # No lock and no transaction: the task is only checked, the edit goes to the write-behind log and the version
+        # and the event come with the flush. Edits acknowledged earlier may not be in the row that is read
+        fields = self.write_behind.pending_fields(todo_list_slug, todo_task_id)
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug)
+            todo_task_orm = await uow.todo_tasks.get_by_id(uow.session, todo_task_id, list_id=todo_list_orm.id)
             if todo_task_orm is None:
                 raise TodoTaskNotFoundException(f"Todo task with id '{todo_task_id}' not found.")
+        fields |= await self.write_behind.record(
+            todo_list_slug, todo_list_orm.id, todo_task_id, todo_list_orm.version, task=todo_task_update.task, is_done=todo_task_update.is_done)
+        return TodoTask(
+            id=todo_task_orm.id,
+            task=fields.get("task", todo_task_orm.task),
+            is_done=fields.get("is_done", todo_task_orm.is_done),
+            weight=todo_task_orm.weight,
+        )
+
+    async def _update_todo_task(self, todo_list_slug: str, todo_task_id: uuid.UUID, todo_task_update: TodoTaskUpdate) -> tuple[int, TodoTask, bool]:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            todo_task_orm = await self._lock_task(uow, todo_list_orm, todo_task_id)
+            weight, rebalanced, version = None, False, None
             if todo_task_update.move_position is not None:
-                weight = self.weight_service.calculate_weight(
-                    todo_list,
+                version = await self._increment_version(uow, todo_list_orm)
+                weight, rebalanced = await self._calculate_weight(
+                    uow,
+                    todo_list_orm.id,
                     todo_task_update.move_position,
                     todo_task_update.target_task,
                     moving_task_id=todo_task_id
                 )
+            todo_task_orm: TodoTaskOrm = await uow.todo_tasks.update(uow.session, todo_task_orm, task=todo_task_update.task, is_done=todo_task_update.is_done, weight=weight)
+            if version is None:
+                version = await self._increment_version(uow, todo_list_orm)
+            if rebalanced:
+                change = make_change(TodoListEventType.LIST_RELOADED)
             else:
-                weight = None
-            todo_task_orm: TodoTaskOrm = uow.todo_tasks.update(uow.session, todo_task_orm, task=todo_task_update.task, is_done=todo_task_update.is_done, weight=weight)
+                change = make_change(TodoListEventType.TASK_UPDATED, todo_task_id,
+                                     task=todo_task_update.task, is_done=todo_task_update.is_done, weight=weight)
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, version, [change])
             todo_task = TodoTask.model_validate(todo_task_orm)
-            uow.commit()
-        return todo_task
+            await uow.commit()
+        return version, todo_task, rebalanced
+
+    async def apply_todo_task_batch(self, todo_list_slug: str, todo_task_batch: TodoTaskBatch) -> list[TodoTask]:
+        await self.write_behind.flush(todo_list_slug)
+        version, todo_tasks, created, deleted, rebalanced = await self.retry_policy.run(
+            lambda: self._apply_todo_task_batch(todo_list_slug, todo_task_batch))
+
+        slug = todo_list_slug
+        if rebalanced:
+            await self._publish(TodoListEvent(type=TodoListEventType.LIST_RELOADED, slug=slug, version=version))
+        else:
+            for task_id in deleted:
+                await self._publish(TodoListEvent(type=TodoListEventType.TASK_DELETED, slug=slug, version=version, task_id=task_id))
+            for todo_task in todo_tasks:
+                event_type = TodoListEventType.TASK_CREATED if todo_task.id in created else TodoListEventType.TASK_UPDATED
+                await self._publish(TodoListEvent(type=event_type, slug=slug, version=version, task=todo_task))
+        return todo_tasks
+
+    async def _apply_todo_task_batch(
+        self,
+        todo_list_slug: str,
+        todo_task_batch: TodoTaskBatch
+    ) -> tuple[int, list[TodoTask], set[uuid.UUID], list[uuid.UUID], bool]:
+        async with self.uow as uow:
+            todo_list_orm = await self._get_taken_list(uow, todo_list_slug, lock=True)
+            await uow.todo_tasks.lock_by_ids(uow.session, todo_list_orm.id, [
+                operation.task_id for operation in todo_task_batch.operations if operation.task_id is not None])
+            version = await self._increment_version(uow, todo_list_orm)
+
+            # Operations are applied to an in-memory index first and written with a few bulk statements
+            index = WeightIndex(await uow.todo_tasks.get_weight_keys(uow.session, todo_list_orm.id))
+            created: dict[uuid.UUID, dict] = {}
+            updated: dict[uuid.UUID, dict] = {}
+            deleted: list[uuid.UUID] = []
+            touched: dict[uuid.UUID, None] = {}
+            rebalanced = False
+
+            for operation in todo_task_batch.operations:
+                if operation.op == TodoTaskBatchOperationType.CREATE:
+                    task_id = uuid.uuid4()
+                    weight, was_rebalanced = self._calculate_weight_in_index(index, operation.move_position, operation.target_task)
+                    rebalanced |= was_rebalanced
+                    index.insert(task_id, weight)
+                    created[task_id] = {
+                        "id": task_id,
+                        "todo_list_id": todo_list_orm.id,
+                        "task": operation.task,
+                        "is_done": bool(operation.is_done),
+                        "weight": weight,
+                    }
+                    touched[task_id] = None
+                    continue
+
+                task_id = operation.task_id
+                if task_id not in index:
+                    raise TodoTaskNotFoundException(f"Todo task with id '{task_id}' not found.")
+
+                if operation.op == TodoTaskBatchOperationType.DELETE:
+                    index.remove(task_id)
+                    if created.pop(task_id, None) is None:
+                        deleted.append(task_id)
+                    updated.pop(task_id, None)
+                    touched.pop(task_id, None)
+                    continue
+
+                values = created.get(task_id) or updated.setdefault(task_id, {"id": task_id, "todo_list_id": todo_list_orm.id})
+                if operation.task is not None:
+                    values["task"] = operation.task
+                if operation.is_done is not None:
+                    values["is_done"] = operation.is_done
+                if operation.move_position is not None:
+                    weight, was_rebalanced = self._calculate_weight_in_index(
+                        index, operation.move_position, operation.target_task, moving_task_id=task_id)
+                    rebalanced |= was_rebalanced
+                    index.remove(task_id)
+                    index.insert(task_id, weight)
+                    values["weight"] = weight
+                touched[task_id] = None
+
+            if rebalanced:
+                # Every remaining task of the list got a new weight
+                await uow.todo_tasks.lock_where(uow.session, todo_list_orm.id)
+                for weight, task_id in index.items():
+                    (created.get(task_id) or updated.setdefault(task_id, {"id": task_id, "todo_list_id": todo_list_orm.id}))["weight"] = weight
+
+            await uow.todo_tasks.delete_by_ids(uow.session, todo_list_orm.id, deleted)
+            await uow.todo_tasks.bulk_create(uow.session, list(created.values()))
+            await uow.todo_tasks.bulk_update(uow.session, list(updated.values()))
+
+            if rebalanced:
+                changes = [make_change(TodoListEventType.LIST_RELOADED)]
+            else:
+                changes = [make_change(TodoListEventType.TASK_DELETED, task_id) for task_id in deleted]
+                changes += [make_change(TodoListEventType.TASK_CREATED, task_id, task=values["task"], is_done=values["is_done"], weight=values["weight"])
+                            for task_id, values in created.items()]
+                changes += [make_change(TodoListEventType.TASK_UPDATED, task_id, task=values.get("task"), is_done=values.get("is_done"), weight=values.get("weight"))
+                            for task_id, values in updated.items()]
+            await uow.todo_list_changes.append(uow.session, todo_list_orm.id, version, changes)
+
+            tasks_by_id = {task.id: task for task in await uow.todo_tasks.get_by_ids(uow.session, list(touched))}
+            todo_tasks = [TodoTask.model_validate(tasks_by_id[task_id]) for task_id in touched]
+            await uow.commit()
+        return version, todo_tasks, set(created), deleted, rebalanced
     
\ No newline at end of file
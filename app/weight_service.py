@@ -1,95 +1,133 @@
-from asyncio import tasks
-from app.entities import TodoList, MovePosition, TodoTask
+from bisect import bisect_left
+from app.entities import MovePosition
+from app.exceptions import WeightRebalanceRequiredException
 import uuid
-from typing import Optional
+from typing import Iterable, Optional
+
+
+class WeightIndex:
+    """Отсортированный индекс (вес, id) задач списка для поиска соседей бинарным поиском"""
+
+    def __init__(self, keys: list[tuple[float, uuid.UUID]]):
+        # keys должны быть отсортированы по (вес, id)
+        self._keys = keys
+        self._weights = {task_id: weight for weight, task_id in keys}
+
+    @classmethod
+    def from_tasks(cls, tasks: Iterable) -> "WeightIndex":
+        """Построить индекс по задачам, уже упорядоченным по (вес, id), например по связи TodoListOrm.tasks"""
+        return cls([(task.weight, task.id) for task in tasks])
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, task_id: uuid.UUID) -> bool:
+        return task_id in self._weights
+
+    def weight_of(self, task_id: uuid.UUID) -> float | None:
+        return self._weights.get(task_id)
+
+    def first(self, exclude: uuid.UUID | None = None) -> float | None:
+        for weight, task_id in self._keys[:2]:
+            if task_id != exclude:
+                return weight
+        return None
+
+    def last(self, exclude: uuid.UUID | None = None) -> float | None:
+        for weight, task_id in reversed(self._keys[-2:]):
+            if task_id != exclude:
+                return weight
+        return None
+
+    def previous(self, task_id: uuid.UUID, exclude: uuid.UUID | None = None) -> float | None:
+        """Вес ближайшей задачи перед task_id (без учета exclude)"""
+        position = self._position(task_id) - 1
+        if position >= 0 and self._keys[position][1] == exclude:
+            position -= 1
+        return self._keys[position][0] if position >= 0 else None
+
+    def next(self, task_id: uuid.UUID, exclude: uuid.UUID | None = None) -> float | None:
+        """Вес ближайшей задачи после task_id (без учета exclude)"""
+        position = self._position(task_id) + 1
+        if position < len(self._keys) and self._keys[position][1] == exclude:
+            position += 1
+        return self._keys[position][0] if position < len(self._keys) else None
+
+    def insert(self, task_id: uuid.UUID, weight: float) -> None:
+        key = (weight, task_id)
+        self._keys.insert(bisect_left(self._keys, key), key)
+        self._weights[task_id] = weight
+
+    def remove(self, task_id: uuid.UUID) -> None:
+        del self._keys[self._position(task_id)]
+        del self._weights[task_id]
+
+    def rebalance(self, step: float) -> None:
+        """Равномерно перенумеровать веса (step, 2 * step, ...) с сохранением порядка, как TodoTaskRepository.rebalance"""
+        self._keys = [((position + 1) * step, task_id) for position, (_, task_id) in enumerate(self._keys)]
+        self._weights = {task_id: weight for weight, task_id in self._keys}
+
+    def items(self) -> list[tuple[float, uuid.UUID]]:
+        return list(self._keys)
+
+    def _position(self, task_id: uuid.UUID) -> int:
+        return bisect_left(self._keys, (self._weights[task_id], task_id))
+
 
 class WeightService:
-    
+    normal_step = 100.0
+
+    def __init__(self, min_gap: float = 1e-6):
+        # Минимальный зазор между соседними весами относительно их величины, при котором еще можно
+        # вставить задачу между ними: абсолютный зазор при больших весах меньше точности float
+        self.min_gap = min_gap
+
     def calculate_weight(
-        self, 
-        todo_list: TodoList, 
-        position: MovePosition, 
+        self,
+        index: WeightIndex,
+        position: MovePosition,
         target_task_id: Optional[uuid.UUID] = None,
         moving_task_id: Optional[uuid.UUID] = None
     ) -> float:
-        tasks = todo_list.tasks
-        normal_step = 100.0
-
-        # Если список пустой или будет содержать одну задачу после перемещения
-        if len(tasks) == 0 or (len(tasks) == 1 and moving_task_id is not None):
-            return normal_step
-        
         if moving_task_id is not None and target_task_id is not None and moving_task_id == target_task_id:
-            return next((task.weight for task in tasks if task.id == moving_task_id), normal_step)
-        
-        # Фильтруем задачи, исключая перемещаемую задачу (если она уже в списке)
-        existing_tasks = [task for task in tasks if task.id != moving_task_id]
-        
-        if not existing_tasks:
-            return normal_step
+            weight = index.weight_of(moving_task_id)
+            return weight if weight is not None else self.normal_step
+
+        if position in (MovePosition.BEFORE, MovePosition.AFTER) and index.weight_of(target_task_id) is None:
+            # Целевой задачи нет в списке: ставим в конец
+            position = MovePosition.LAST
 
         if position == MovePosition.FIRST:
-            min_weight = min(task.weight for task in existing_tasks)
-            return min_weight - normal_step
+            return self.weight_between(None, index.first(exclude=moving_task_id))
 
-        elif position == MovePosition.LAST:
-            max_weight = max(task.weight for task in existing_tasks)
-            return max_weight + normal_step
+        elif position == MovePosition.BEFORE:
+            return self.weight_between(index.previous(target_task_id, exclude=moving_task_id), index.weight_of(target_task_id))
 
-        elif position == MovePosition.BEFORE and target_task_id:
-            return self._calculate_before_weight(existing_tasks, target_task_id, normal_step)
+        elif position == MovePosition.AFTER:
+            return self.weight_between(index.weight_of(target_task_id), index.next(target_task_id, exclude=moving_task_id))
 
-        elif position == MovePosition.AFTER and target_task_id:
-            return self._calculate_after_weight(existing_tasks, target_task_id, normal_step)
+        return self.weight_between(index.last(exclude=moving_task_id), None)
 
-        max_weight = max(task.weight for task in existing_tasks)
-        return max_weight + normal_step
+    def weight_between(self, lower: float | None, upper: float | None) -> float:
+        """Вес для задачи между соседями с весами lower и upper (None - соседа с этой стороны нет)"""
+        # Список пуст или будет содержать одну задачу после перемещения
+        if lower is None and upper is None:
+            return self.normal_step
 
-    def _calculate_before_weight(
-        self, 
-        tasks: list[TodoTask], 
-        target_task_id: uuid.UUID, 
-        normal_step: float
-    ) -> float:
-        # Находим целевую задачу
-        target_task = next((task for task in tasks if task.id == target_task_id), None)
-        if not target_task:
-            return max(task.weight for task in tasks) + normal_step
-
-        # Находим задачу, которая идет перед целевой
-        previous_tasks = [task for task in tasks if task.weight < target_task.weight]
-        
-        if not previous_tasks:
-            # Если перед целевой нет задач, ставим в самое начало
-            return target_task.weight - normal_step
-        
-        # Находим ближайшую задачу перед целевой
-        closest_previous = max(previous_tasks, key=lambda t: t.weight)
-        
-        # Вычисляем средний вес между предыдущей и целевой задачами
-        return (closest_previous.weight + target_task.weight) / 2
-
-    def _calculate_after_weight(
-        self, 
-        tasks: list, 
-        target_task_id: uuid.UUID, 
-        normal_step: float
-    ) -> float:
-        """Рассчитать вес для позиции ПОСЛЕ целевой задачи"""
-        # Находим целевую задачу
-        target_task = next((task for task in tasks if task.id == target_task_id), None)
-        if not target_task:
-            return max(task.weight for task in tasks) + normal_step
-
-        # Находим задачу, которая идет после целевой
-        next_tasks = [task for task in tasks if task.weight > target_task.weight]
-        
-        if not next_tasks:
-            # Если после целевой нет задач, ставим в самый конец
-            return target_task.weight + normal_step
-        
-        # Находим ближайшую задачу после целевой
-        closest_next = min(next_tasks, key=lambda t: t.weight)
-        
-        # Вычисляем средний вес между целевой и следующей задачами
-        return (target_task.weight + closest_next.weight) / 2
\ No newline at end of file
+        # Если перед задачей никого нет, ставим в самое начало
+        if lower is None:
+            return upper - self.normal_step
+
+        # Если после задачи никого нет, ставим в самый конец
+        if upper is None:
+            return lower + self.normal_step
+
+        # Вычисляем средний вес между соседями
+        return self._midpoint(lower, upper)
+
+    def _midpoint(self, lower: float, upper: float) -> float:
+        middle = (lower + upper) / 2
+        # Промежуток исчерпан: дальнейшие деления дадут одинаковые веса и порядок сломается
+        if upper - lower < self.min_gap * max(abs(lower), abs(upper), 1.0) or not lower < middle < upper:
+            raise WeightRebalanceRequiredException(f"No room left between weights {lower} and {upper}.")
+        return middle
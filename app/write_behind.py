@@ -0,0 +1,426 @@
+"""Write-behind of task text and is_done edits: a durable per-worker log, merged edits and batched flushes."""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy.exc import DBAPIError
+
+from app.change_log import make_change
+from app.db.database import Database
+from app.entities import TodoListEvent, TodoListEventType, TodoTask
+from app.event_hub import EventHub
+from app.list_cache import ListCache
+from app.retry_policy import RetryPolicy, rejected_sqlstate
+from app.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+_LOG_GLOB = "writes-*.log"
+
+
+@dataclass
+class _Edit:
+    list_id: uuid.UUID
+    seq: int
+    fields: dict
+
+
+class WriteBehindBuffer:
+    """Acknowledges edits of task text and is_done before they reach the database.
+
+    An edit is appended to this worker's log in directory and fsynced, edits arriving meanwhile share
+    the fsync. It then joins the pending edits, where a later edit of a task overrides the fields of
+    earlier ones. Pending edits are written every flush_interval seconds, as soon as max_pending tasks
+    have some, and before anything in this worker reads or restructures their list: per list one
+    transaction with one UPDATE statement and one version increment. An edit the database rejects
+    is dropped, the other edits of its list are written without it. Logs of workers that died are
+    written to the database by the next worker that starts.
+    """
+
+    def __init__(self, list_cache: ListCache, retry_policy: RetryPolicy, enabled: bool = False,
+                 directory: str = "data/write-behind", flush_interval: float = 0.2, max_pending: int = 1000,
+                 fsync: bool = True):
+        self.list_cache = list_cache
+        self.retry_policy = retry_policy
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+
+        self._database: Database | None = None
+        self._event_hub: EventHub | None = None
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+        self._pending: dict[str, dict[uuid.UUID, _Edit]] = {}
+        self._pending_tasks = 0
+        self._flushing: dict[str, asyncio.Future] = {}
+        self._flushing_edits: dict[str, dict[uuid.UUID, _Edit]] = {}
+        self._seq = 0
+        # Edits whose log write is queued or running, they are pending only once it finished
+        self._recording = 0
+
+        self._path: Path | None = None
+        self._fd: int | None = None
+        self._log_lines: list[bytes] = []
+        self._log_group: asyncio.Future | None = None
+        self._log_writer: asyncio.Task | None = None
+        self._log_lock = asyncio.Lock()
+        self._log_size = 0
+
+        self.recorded = 0
+        self.merged = 0
+        self.flushes = 0
+        self.flushed_tasks = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failures = 0
+        self.log_writes = 0
+        self.truncations = 0
+        self.recovered = 0
+        self.overwritten = 0
+
+    async def start(self, database: Database, event_hub: EventHub) -> None:
+        self._database = database
+        self._event_hub = event_hub
+        if not self.enabled:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # A log nobody holds the lock of was left by a worker that is gone
+        for path in sorted(self.directory.glob(_LOG_GLOB)):
+            try:
+                await self._recover(path)
+            except Exception:
+                # The log stays where it is for the next worker that starts, this one starts without it
+                self._pending.clear()
+                self._pending_tasks = 0
+                self.failures += 1
+                logger.exception("Failed to write the edits left in %s", path)
+
+        # The log is locked before it gets its name, so no other worker can take it for an abandoned one
+        temporary = self.directory / f"writes-{os.getpid()}.tmp"
+        self._fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._path = self.directory / f"writes-{os.getpid()}.log"
+        os.replace(temporary, self._path)
+        self._log_group = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._fd is None:
+            return
+        await self.flush_all()
+        if self._is_idle():
+            # Everything is in the database, there is nothing to recover
+            self._path.unlink(missing_ok=True)
+        else:
+            logger.warning("%d tasks with edits left in %s for the next start", self._pending_tasks, self._path)
+        os.close(self._fd)
+        self._fd = None
+
+    def pending_fields(self, slug: str, task_id: uuid.UUID) -> dict:
+        """Fields of edits of a task that may not be in the database yet."""
+        fields = {}
+        for edits in (self._flushing_edits.get(slug), self._pending.get(slug)):
+            edit = edits.get(task_id) if edits else None
+            if edit is not None:
+                fields.update(edit.fields)
+        return fields
+
+    async def record(self, slug: str, list_id: uuid.UUID, task_id: uuid.UUID, version: int,
+                     task: str | None = None, is_done: bool | None = None) -> dict:
+        """Make an edit durable and queue it. Returns the pending fields of the task, those of this edit included.
+
+        version is the list version the task was read at, a replay skips the edit if the task changed after it.
+        """
+        fields = {name: value for name, value in (("task", task), ("is_done", is_done)) if value is not None}
+        self._seq += 1
+        # A client that goes away doesn't take back an edit that may be in the log already
+        edit = await asyncio.shield(asyncio.ensure_future(
+            self._record(slug, list_id, task_id, version, self._seq, fields)))
+        return dict(edit.fields)
+
+    async def flush(self, slug: str) -> None:
+        """Write the pending edits of a list, after a flush of it that is running already."""
+        flushing = self._flushing.get(slug)
+        if flushing is not None:
+            await asyncio.shield(flushing)
+            # Another waiter may have started the flush of the edits that were pending meanwhile
+            flushing = self._flushing.get(slug)
+            if flushing is not None:
+                await asyncio.shield(flushing)
+                return
+        if slug in self._pending:
+            edits = self._pending.pop(slug)
+            self._pending_tasks -= len(edits)
+            self._flushing[slug] = asyncio.get_running_loop().create_future()
+            self._flushing_edits[slug] = edits
+            # A reader that goes away doesn't interrupt a transaction other readers may wait for
+            await asyncio.shield(asyncio.ensure_future(self._flush_slug(slug, edits)))
+
+    async def flush_all(self) -> None:
+        for slug in list(self._pending):
+            try:
+                await self.flush(slug)
+            except Exception:
+                self.failures += 1
+                logger.exception("Failed to write the pending edits of list %s", slug)
+        await self._truncate_log()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending_lists": len(self._pending),
+            "pending_tasks": self._pending_tasks,
+            "recorded": self.recorded,
+            "merged": self.merged,
+            "flushes": self.flushes,
+            "flushed_tasks": self.flushed_tasks,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "failures": self.failures,
+            "log_writes": self.log_writes,
+            "log_bytes": self._log_size,
+            "truncations": self.truncations,
+            "recovered": self.recovered,
+            "overwritten": self.overwritten,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_all()
+
+    async def _record(self, slug: str, list_id: uuid.UUID, task_id: uuid.UUID, version: int, seq: int, fields: dict) -> _Edit:
+        self._recording += 1
+        try:
+            await self._append({"seq": seq, "slug": slug, "list_id": list_id, "task_id": task_id, "version": version, **fields})
+            edit = self._merge(slug, list_id, task_id, seq, fields)
+        finally:
+            self._recording -= 1
+        self.recorded += 1
+        if self._pending_tasks >= self.max_pending:
+            self._wakeup.set()
+        return edit
+
+    def _merge(self, slug: str, list_id: uuid.UUID, task_id: uuid.UUID, seq: int, fields: dict) -> _Edit:
+        edits = self._pending.setdefault(slug, {})
+        edit = edits.get(task_id)
+        if edit is None:
+            edit = edits[task_id] = _Edit(list_id, seq, dict(fields))
+            self._pending_tasks += 1
+        else:
+            # Last write wins, field by field
+            edit.seq = seq
+            edit.fields.update(fields)
+            self.merged += 1
+        return edit
+
+    def _requeue(self, slug: str, edits: dict[uuid.UUID, _Edit]) -> None:
+        # Edits made while the flush ran are newer and win over the ones it failed to write
+        pending = self._pending.setdefault(slug, {})
+        for task_id, edit in edits.items():
+            newer = pending.get(task_id)
+            if newer is None:
+                pending[task_id] = edit
+                self._pending_tasks += 1
+            else:
+                newer.fields = {**edit.fields, **newer.fields}
+
+    async def _flush_slug(self, slug: str, edits: dict[uuid.UUID, _Edit]) -> None:
+        # A slug taken by a new list after its old one was deleted can have edits of both
+        by_list: dict[uuid.UUID, dict[uuid.UUID, _Edit]] = {}
+        for task_id, edit in edits.items():
+            by_list.setdefault(edit.list_id, {})[task_id] = edit
+        try:
+            for list_id, list_edits in list(by_list.items()):
+                await self._flush_list(slug, list_id, list_edits)
+                del by_list[list_id]
+        except BaseException:
+            for list_edits in by_list.values():
+                self._requeue(slug, list_edits)
+            raise
+        finally:
+            del self._flushing_edits[slug]
+            done = self._flushing.pop(slug)
+            # Waiters look at the pending edits again, a failure is reported by their own attempt
+            done.set_result(None)
+
+    async def _flush_list(self, slug: str, list_id: uuid.UUID, edits: dict[uuid.UUID, _Edit]) -> None:
+        version = None
+        try:
+            written = await self.retry_policy.run(lambda: self._write_list(list_id, edits))
+        except DBAPIError as exc:
+            if rejected_sqlstate(exc) is None:
+                raise
+            if len(edits) > 1:
+                # One edit the database refuses must not hold back the others: each is written on its own.
+                # Those done are taken out, so a failure further on requeues only the rest
+                for task_id, edit in list(edits.items()):
+                    await self._flush_list(slug, list_id, {task_id: edit})
+                    del edits[task_id]
+                return
+            # Running it again fails the same way, it is logged as flushed and never replayed
+            self.rejected += 1
+            logger.error("Dropped the edit of task %s of list %s rejected by the database: %s", next(iter(edits)), slug, exc.orig)
+        else:
+            self.flushes += 1
+            if written is None:
+                self.dropped += len(edits)
+            else:
+                version, todo_tasks = written
+                self.flushed_tasks += len(todo_tasks)
+                self.dropped += len(edits) - len(todo_tasks)
+                self.list_cache.invalidate(slug, version)
+                for todo_task in todo_tasks:
+                    await self._event_hub.publish(TodoListEvent(
+                        type=TodoListEventType.TASK_UPDATED, slug=slug, version=version, task=todo_task))
+        if self._fd is not None:
+            # Replaying the log after a crash skips these, and doesn't take the version for a change by someone else
+            try:
+                await self._append({"flushed": [[slug, task_id, edit.seq] for task_id, edit in edits.items()],
+                                    "list_id": list_id, "version": version})
+            except Exception:
+                logger.exception("Failed to log a flush of list %s", slug)
+
+    async def _write_list(self, list_id: uuid.UUID, edits: dict[uuid.UUID, _Edit]) -> tuple[int, list[TodoTask]] | None:
+        async with self._database.get_unit_of_work() as uow:
+            # Same lock order as the synchronous edits: the list, then the tasks. Edits of tasks deleted
+            # in the meantime are dropped, and all of them if the list was deleted
+            version = await uow.todo_lists.increment_version(uow.session, list_id)
+            if version is None:
+                return None
+            task_ids = await uow.todo_tasks.lock_by_ids(uow.session, list_id, list(edits))
+            if not task_ids:
+                return None
+            await uow.todo_tasks.bulk_update(uow.session, [
+                {"id": task_id, "todo_list_id": list_id, **edits[task_id].fields} for task_id in task_ids])
+            await uow.todo_list_changes.append(uow.session, list_id, version, [
+                make_change(TodoListEventType.TASK_UPDATED, task_id, **edits[task_id].fields) for task_id in task_ids])
+            todo_tasks = [TodoTask.model_validate(task) for task in await uow.todo_tasks.get_by_ids(uow.session, task_ids)]
+            await uow.commit()
+        return version, todo_tasks
+
+    async def _recover(self, path: Path) -> None:
+        with open(path, "rb") as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            if os.fstat(file.fileno()).st_nlink == 0:
+                # Recovered by another worker while this one waited for it
+                return
+            edits, own_versions = self._read_log(file.read().splitlines())
+            for record in await self._drop_overwritten(edits, own_versions):
+                fields = {name: record[name] for name in ("task", "is_done") if name in record}
+                self._merge(record["slug"], uuid.UUID(record["list_id"]), uuid.UUID(record["task_id"]), record["seq"], fields)
+            recovered = self._pending_tasks
+            for slug in list(self._pending):
+                await self.flush(slug)
+            os.unlink(path)
+        self.recovered += recovered
+        if recovered:
+            logger.warning("Wrote %d tasks with edits left in %s", recovered, path)
+
+    def _read_log(self, lines: list[bytes]) -> tuple[list[dict], dict[str, list[int]]]:
+        """Edits of a log that were not flushed, in log order, and the list versions its flushes made."""
+        edits: list[dict] = []
+        flushed: dict[tuple[str, str], int] = {}
+        own_versions: dict[str, list[int]] = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of a worker that died while writing it, it was never acknowledged
+                continue
+            if "flushed" in record:
+                for slug, task_id, seq in record["flushed"]:
+                    flushed[slug, task_id] = max(seq, flushed.get((slug, task_id), 0))
+                if record["version"] is not None:
+                    own_versions.setdefault(record["list_id"], []).append(record["version"])
+            else:
+                edits.append(record)
+        return [edit for edit in edits if edit["seq"] > flushed.get((edit["slug"], edit["task_id"]), 0)], own_versions
+
+    async def _drop_overwritten(self, edits: list[dict], own_versions: dict[str, list[int]]) -> list[dict]:
+        # Other workers may have changed a task after the edit was acknowledged. Their changes are in the change
+        # log with a version above the one the edit was read at, and last write wins: the edit is skipped.
+        # Bulk changes, imports and rebalances reload the list, they count for every task
+        by_list: dict[str, list[dict]] = {}
+        for edit in edits:
+            by_list.setdefault(edit["list_id"], []).append(edit)
+        kept = []
+        async with self._database.get_unit_of_work() as uow:
+            for list_id, list_edits in by_list.items():
+                latest = await uow.todo_list_changes.get_latest_versions(
+                    uow.session, uuid.UUID(list_id), list({uuid.UUID(edit["task_id"]) for edit in list_edits}),
+                    min(edit["version"] for edit in list_edits), [TodoListEventType.LIST_RELOADED.value],
+                    own_versions.get(list_id, []))
+                for edit in list_edits:
+                    if max(latest.get(uuid.UUID(edit["task_id"]), 0), latest.get(None, 0)) > edit["version"]:
+                        self.overwritten += 1
+                    else:
+                        kept.append(edit)
+        return sorted(kept, key=lambda edit: edit["seq"])
+
+    async def _append(self, record: dict) -> None:
+        self._log_lines.append(dumps(record) + b"\n")
+        group = self._log_group
+        if self._log_writer is None:
+            self._log_writer = asyncio.create_task(self._write_log())
+        await asyncio.shield(group)
+
+    async def _write_log(self) -> None:
+        # Group commit: everything queued while a write and fsync run goes out with the next one
+        try:
+            async with self._log_lock:
+                while self._log_lines:
+                    data, self._log_lines = b"".join(self._log_lines), []
+                    group, self._log_group = self._log_group, asyncio.get_running_loop().create_future()
+                    try:
+                        await asyncio.to_thread(self._write_file, data)
+                    except Exception as exc:
+                        group.set_exception(exc)
+                    else:
+                        self._log_size += len(data)
+                        self.log_writes += 1
+                        group.set_result(None)
+        finally:
+            self._log_writer = None
+
+    def _write_file(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def _is_idle(self) -> bool:
+        return not self._pending and not self._flushing and not self._recording
+
+    async def _truncate_log(self) -> None:
+        # Only once everything in the log is in the database: nothing is pending, being written or being logged
+        if self._fd is None or not self._log_size or not self._is_idle():
+            return
+        async with self._log_lock:
+            if self._is_idle():
+                await asyncio.to_thread(os.ftruncate, self._fd, 0)
+                self._log_size = 0
+                self.truncations += 1
@@ -0,0 +1,104 @@
+"""Read coalescing: --readers simultaneous GET /lists/{slug} of one list with --tasks tasks, --rounds times.
+
+Every round starts with a cold list cache, as after a change of the list, so every round is a burst of
+misses. Runs in this process through the ASGI app, once with READ_COALESCING_ENABLED and once without,
+and reports the SQL statements executed per round and the request latency.
+
+    python -m benchmarks.coalescing --readers 50 --rounds 20
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+from sqlalchemy import event
+
+from benchmarks.common import database, migrate, print_table, save_results, summarize
+
+
+async def seed(db, tasks: int) -> str:
+    async with db.get_unit_of_work() as uow:
+        slug = uuid.uuid4().hex[:8].upper()
+        todo_list = await uow.todo_lists.create(uow.session, name="coalescing", slug=slug, is_free=False)
+        rows = [(uuid.uuid4(), f"task number {i}", i % 2 == 0, todo_list.id, (i + 1) * 100.0) for i in range(tasks)]
+        await uow.todo_tasks.copy_rows(uow.session, rows)
+        await uow.commit()
+    return slug
+
+
+async def run(database_url: str, readers: int, rounds: int, tasks: int) -> dict:
+    # Settings are read at import time
+    os.environ.update({"DATABASE_URL": database_url, "METRICS_ENABLED": "false", "READ_COALESCING_WINDOW": "0"})
+    import httpx
+
+    from app.di import get_list_cache, get_single_flight
+    from app.main import app
+
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        db = app.state.database
+        slug = await seed(db, tasks)
+        event.listen(db.engine.sync_engine, "before_cursor_execute", count)
+        list_cache, single_flight = get_list_cache(), get_single_flight()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60) as client:
+            async def read() -> float:
+                started_at = time.perf_counter()
+                response = await client.get(f"/lists/{slug}")
+                response.raise_for_status()
+                return time.perf_counter() - started_at
+
+            for enabled in (False, True):
+                single_flight.enabled = enabled
+                await read()  # warm-up
+                latencies, round_times = [], []
+                statements = 0
+                for _ in range(rounds):
+                    list_cache.invalidate(slug)
+                    started_at = time.perf_counter()
+                    latencies += await asyncio.gather(*(read() for _ in range(readers)))
+                    round_times.append(time.perf_counter() - started_at)
+                results["coalesced" if enabled else "independent"] = {
+                    "statements_per_round": statements / rounds,
+                    "latency": summarize(latencies),
+                    "round": summarize(round_times),
+                }
+        results["single_flight"] = single_flight.stats()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--readers", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=200)
+    args = parser.parse_args()
+
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        results = asyncio.run(run(database_url, args.readers, args.rounds, args.tasks))
+
+    print_table(
+        [
+            {"variant": name, "statements_per_round": stats["statements_per_round"],
+             "p50_ms": stats["latency"]["p50_ms"], "p95_ms": stats["latency"]["p95_ms"],
+             "round_p50_ms": stats["round"]["p50_ms"]}
+            for name, stats in results.items() if name != "single_flight"
+        ],
+        ["variant", "statements_per_round", "p50_ms", "p95_ms", "round_p50_ms"],
+    )
+    print(f"single flight: {results['single_flight']}")
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('coalescing', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
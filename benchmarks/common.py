@@ -0,0 +1,196 @@
+"""Shared helpers of the benchmark harness: database, server process, metrics scraping and results."""
+import contextlib
+import datetime
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Linearly interpolated percentile, q in [0, 100]."""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(latencies: list[float], duration: float | None = None) -> dict:
+    """Latency summary in milliseconds, plus throughput when the run duration is given."""
+    summary = {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else math.nan,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else math.nan,
+    }
+    if duration:
+        summary["throughput_rps"] = len(latencies) / duration
+    return summary
+
+
+@contextlib.contextmanager
+def database(url: str | None):
+    """Yield a SQLAlchemy URL: the given one, or a throwaway local PostgreSQL started with pgserver."""
+    if url:
+        yield url
+        return
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("Pass --database-url of a dedicated database, or `pip install pgserver` for a throwaway one.")
+    with tempfile.TemporaryDirectory(prefix="todo-bench-") as pgdata:
+        server = pgserver.get_server(pgdata, cleanup_mode="stop")
+        server.psql("CREATE DATABASE todo_bench;")
+        try:
+            yield f"postgresql+asyncpg://postgres@/todo_bench?host={pgdata}"
+        finally:
+            server.cleanup()
+
+
+def migrate(database_url: str) -> None:
+    subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        cwd=ROOT, env=os.environ | {"DATABASE_URL": database_url}, check=True, capture_output=True,
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def server(database_url: str, workers: int = 1, env: dict | None = None, ready_timeout: float = 30.0,
+           cwd: Path = ROOT):
+    """Run the app under uvicorn in a subprocess and yield (base_url, process) once it answers.
+
+    cwd is the checkout whose app is run, e.g. a worktree of an older revision.
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=cwd,
+        env=os.environ | {"DATABASE_URL": database_url, "DB_ECHO": "false"} | (env or {}),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(base_url, process, ready_timeout)
+        yield base_url, process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float) -> float:
+    """Poll until the app answers a request that touches the database. Returns the waited time."""
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            # A missing list is answered with 400 after a real query
+            if httpx.get(f"{base_url}/lists/-", timeout=1).status_code < 500:
+                return time.perf_counter() - started_at
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"Server did not answer within {timeout}s")
+
+
+def process_memory(pid: int) -> dict:
+    """Current and peak resident set size of a process in MiB (Linux only)."""
+    memory = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                memory[key] = int(value.split()[0]) / 1024
+    return {"rss_mib": memory.get("VmRSS"), "peak_rss_mib": memory.get("VmHWM")}
+
+
+def scrape_metrics(base_url: str) -> dict[tuple[str, tuple], float]:
+    """Samples of the app's /metrics keyed by (name, sorted labels)."""
+    text = httpx.get(f"{base_url}/metrics", timeout=10).text
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def sql_per_route(before: dict, after: dict) -> dict:
+    """SQL statements and SQL time per request for every route, from two /metrics scrapes."""
+    def delta(name: str, labels: tuple) -> float:
+        return after.get((name, labels), 0.0) - before.get((name, labels), 0.0)
+
+    routes = {}
+    for name, labels in after:
+        if name != "todo_http_request_sql_statements_count":
+            continue
+        requests = delta(name, labels)
+        if requests <= 0:
+            continue
+        route = dict(labels)["route"]
+        routes[route] = {
+            "requests": requests,
+            "statements_per_request": delta("todo_http_request_sql_statements_sum", labels) / requests,
+            "sql_ms_per_request": delta("todo_http_request_sql_duration_seconds_sum", labels) / requests * 1000,
+            "lock_ms_total": delta("todo_sql_lock_duration_seconds_sum", labels) * 1000,
+        }
+    return routes
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{revision}-dirty" if dirty else revision
+
+
+def save_results(name: str, config: dict, results: dict) -> Path:
+    """Write results to benchmarks/results/<name>-<time>-<revision>.json, so runs can be compared across commits."""
+    revision = git_revision()
+    timestamp = datetime.datetime.now(datetime.timezone.utc)
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{name}-{timestamp:%Y%m%dT%H%M%S}-{revision}.json"
+    path.write_text(json.dumps(
+        {"benchmark": name, "revision": revision, "timestamp": timestamp.isoformat(), "config": config, "results": results},
+        indent=2,
+    ))
+    return path
+
+
+def print_table(rows: list[dict], columns: list[str]) -> None:
+    widths = {column: max([len(column)] + [len(_format(row.get(column))) for row in rows]) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print("  ".join(_format(row.get(column)).ljust(widths[column]) for column in columns))
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return "" if value is None else str(value)
@@ -0,0 +1,157 @@
+"""SSE fan-out: idle subscriber capacity and write-to-event latency of GET /lists/{slug}/events.
+
+Opens --subscribers EventSource clients (in steps, e.g. 100 1000 5000) spread over --lists lists against
+the API running under uvicorn. At every step reports how long the new streams took to get their ready
+event and the server's memory per open stream. Then --writes task edits are made one after another,
+and for every subscriber the time from sending the PUT to receiving its task_updated event is recorded:
+the p50/p99 over all deliveries, and the time until the last subscriber of the list had the event.
+
+    python -m benchmarks.events --subscribers 100 1000 --writes 50
+
+Each stream is a connection, raise the open files limit (ulimit -n) for large counts.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import database, migrate, print_table, process_memory, save_results, server, summarize
+
+
+class Subscribers:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.tasks: list[asyncio.Task] = []
+        self.ready: asyncio.Queue = asyncio.Queue()
+        # Receive times of every edit text, one per subscriber that got it
+        self.received: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+        self.resyncs = 0
+
+    def open(self, slug: str) -> None:
+        self.tasks.append(asyncio.create_task(self._subscribe(slug)))
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _subscribe(self, slug: str) -> None:
+        started_at = time.perf_counter()
+        event = None
+        try:
+            async with self.client.stream("GET", f"/lists/{slug}/events", timeout=None) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                        if event == "ready":
+                            self.ready.put_nowait(time.perf_counter() - started_at)
+                        elif event == "resync":
+                            self.resyncs += 1
+                    elif line.startswith("data: ") and event == "task_updated":
+                        self.received[json.loads(line[len("data: "):])["task"]["task"]].append(time.perf_counter())
+        except httpx.HTTPError:
+            self.errors += 1
+            self.ready.put_nowait(None)
+
+
+async def run(args, base_url: str, pid: int) -> dict:
+    limits = httpx.Limits(max_connections=max(args.subscribers) + 10, max_keepalive_connections=0)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as writer, \
+            httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as streams:
+        lists = []
+        for index in range(args.lists):
+            slug = (await writer.post("/lists/", json={"name": f"events {index}"})).json()["slug"]
+            task_id = (await writer.post(f"/lists/{slug}/tasks", json={"task": "watched"})).json()["id"]
+            lists.append((slug, task_id))
+
+        subscribers = Subscribers(streams)
+        baseline = process_memory(pid)["rss_mib"]
+        steps = []
+        opened = 0
+        try:
+            for count in sorted(args.subscribers):
+                started_at = time.perf_counter()
+                for index in range(opened, count):
+                    subscribers.open(lists[index % len(lists)][0])
+                connect_times = [await subscribers.ready.get() for _ in range(count - opened)]
+                connected = [seconds for seconds in connect_times if seconds is not None]
+                open_seconds = time.perf_counter() - started_at
+                opened = count
+                rss = process_memory(pid)["rss_mib"]
+
+                subscribers.received.clear()
+                write_latencies, delivery, fanout = [], [], []
+                for write in range(args.writes):
+                    slug, task_id = lists[write % len(lists)]
+                    text = f"edit {count} {write}"
+                    sent_at = time.perf_counter()
+                    response = await writer.put(f"/lists/{slug}/tasks/{task_id}", json={"task": text})
+                    response.raise_for_status()
+                    write_latencies.append(time.perf_counter() - sent_at)
+                    # Every subscriber of the list gets the event, or the wait gives up
+                    expected = len(range(write % len(lists), count, len(lists)))
+                    deadline = sent_at + args.timeout
+                    while len(subscribers.received[text]) < expected and time.perf_counter() < deadline:
+                        await asyncio.sleep(0.001)
+                    received = subscribers.received[text]
+                    delivery += [at - sent_at for at in received]
+                    if len(received) == expected:
+                        fanout.append(max(received) - sent_at)
+                    await asyncio.sleep(args.interval)
+
+                steps.append({
+                    "subscribers": count,
+                    "connect_errors": len(connect_times) - len(connected),
+                    "open_s": open_seconds,
+                    "ready": summarize(connected),
+                    "rss_mib": rss,
+                    "kib_per_subscriber": (rss - baseline) * 1024 / count if baseline and rss else None,
+                    "write": summarize(write_latencies),
+                    "delivery": summarize(delivery),
+                    "fanout": summarize(fanout),
+                    "missed_deliveries": sum(len(range(w % len(lists), count, len(lists))) for w in range(args.writes)) - len(delivery),
+                })
+        finally:
+            await subscribers.close()
+    return {"steps": steps, "stream_errors": subscribers.errors, "resyncs": subscribers.resyncs}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 1_000])
+    parser.add_argument("--lists", type=int, default=10, help="lists the subscribers are spread over")
+    parser.add_argument("--writes", type=int, default=50, help="edits per step, round robin over the lists")
+    parser.add_argument("--interval", type=float, default=0.05, help="pause between edits in seconds")
+    parser.add_argument("--timeout", type=float, default=10.0, help="longest wait for the events of one edit")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra app setting, repeatable")
+    args = parser.parse_args()
+
+    # Streams must not be shed or limited like ordinary requests, this measures the event path alone
+    env = {"ADMISSION_ENABLED": "false"} | dict(item.split("=", 1) for item in args.env)
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        with server(database_url, env=env) as (base_url, process):
+            results = asyncio.run(run(args, base_url, process.pid))
+
+    print_table(
+        [{
+            "subscribers": step["subscribers"], "connect_errors": step["connect_errors"], "ready_p99_ms": step["ready"]["p99_ms"],
+            "kib_per_subscriber": step["kib_per_subscriber"], "write_p50_ms": step["write"]["p50_ms"],
+            "delivery_p50_ms": step["delivery"]["p50_ms"], "delivery_p99_ms": step["delivery"]["p99_ms"],
+            "fanout_p99_ms": step["fanout"]["p99_ms"], "missed": step["missed_deliveries"],
+        } for step in results["steps"]],
+        ["subscribers", "connect_errors", "ready_p99_ms", "kib_per_subscriber", "write_p50_ms",
+         "delivery_p50_ms", "delivery_p99_ms", "fanout_p99_ms", "missed"],
+    )
+    print(f"stream errors: {results['stream_errors']}, resyncs: {results['resyncs']}")
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('events', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Replay a realistic traffic mix against the API running under uvicorn.
+
+Roles running concurrently for --duration seconds:
+
+- pollers: GET /lists/{slug} with If-None-Match, like the frontend fallback polling;
+- movers: drag and drop, PUT /lists/{slug}/tasks/{id} with move_position;
+- creators: bursts of concurrent POST /lists/{slug}/tasks;
+- churners: create a list, add a few tasks, delete it (exercises free list recycling);
+- subscribers: SSE streams on GET /lists/{slug}/events, counting delivered events and resyncs;
+- editors and hot movers (contention scenario, off by default): many clients editing text and is_done,
+  or reordering, tasks of one shared list.
+
+Reports throughput and p50/p95/p99 latency per endpoint, and SQL statements per request
+scraped from /metrics (run with one worker for exact server-side numbers).
+
+With --batch-operations, before the mix the same sequence of task creates, edits and moves is applied
+to a fresh list by --batch-clients concurrent clients, once as single-task calls and once as
+POST /lists/{slug}/tasks:batch calls of --batch-size operations, and operations per second are compared.
+
+    python -m benchmarks.load --duration 30 --pollers 100 --movers 10
+    python -m benchmarks.load --pollers 0 --movers 0 --creators 0 --churners 0 --subscribers 5 --editors 50 --hot-movers 5
+With --slug-strategies, before the mix the app is started once per given SLUG_STRATEGY and
+--slug-clients concurrent clients create --slug-lists lists with POST /lists/. The free list pool is
+off for these runs (--slug-pool-size), so every create generates its slug inline.
+
+    python -m benchmarks.load --duration 0 --batch-operations 2000 --batch-size 20
+    python -m benchmarks.load --duration 0 --slug-strategies random sequence block --slug-clients 50
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import database, migrate, print_table, save_results, scrape_metrics, server, sql_per_route, summarize
+
+POSITIONS = ("before", "after", "first", "last")
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, deadline: float):
+        self.client = client
+        self.deadline = deadline
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.lists: dict[str, list[str]] = {}
+        self.events_received = 0
+        self.resyncs = 0
+
+    @property
+    def running(self) -> bool:
+        return time.perf_counter() < self.deadline
+
+    async def call(self, endpoint: str, method: str, url: str, **kwargs) -> httpx.Response | None:
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - started_at)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+        return response
+
+    async def setup(self, lists: int, tasks_per_list: int) -> None:
+        for index in range(lists):
+            slug = (await self.client.post("/lists/", json={"name": f"bench {index}"})).json()["slug"]
+            body = "".join(json.dumps({"task": f"task {i}", "is_done": i % 3 == 0}) + "\n" for i in range(tasks_per_list))
+            response = await self.client.post(f"/lists/{slug}/import", content=body.encode())
+            response.raise_for_status()
+            page = await self.client.get(f"/lists/{slug}")
+            self.lists[slug] = [task["id"] for task in page.json()["tasks"]]
+
+    async def poller(self, interval: float) -> None:
+        slug = random.choice(list(self.lists))
+        etag = None
+        while self.running:
+            headers = {"If-None-Match": etag} if etag else {}
+            response = await self.call("GET /lists/{slug}", "GET", f"/lists/{slug}", headers=headers)
+            if response is not None and response.status_code in (200, 304):
+                etag = response.headers.get("etag", etag)
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+
+    async def mover(self, think_time: float) -> None:
+        while self.running:
+            slug = random.choice(list(self.lists))
+            task_ids = self.lists[slug]
+            if len(task_ids) < 2:
+                await asyncio.sleep(think_time)
+                continue
+            task_id, target_id = random.sample(task_ids, 2)
+            position = random.choice(POSITIONS)
+            body = {"move_position": position}
+            if position in ("before", "after"):
+                body["target_task"] = target_id
+            await self.call("PUT /lists/{slug}/tasks/{task_id}", "PUT", f"/lists/{slug}/tasks/{task_id}", json=body)
+            await asyncio.sleep(think_time)
+
+    async def editor(self, think_time: float) -> None:
+        # Every editor works on the first list, so they all compete for the same list row
+        slug = next(iter(self.lists))
+        while self.running:
+            task_id = random.choice(self.lists[slug])
+            body = {"is_done": random.random() < 0.5} if random.random() < 0.7 else {"task": f"edited {random.randrange(1000)}"}
+            await self.call("PUT /lists/{slug}/tasks/{task_id} (hot edit)", "PUT", f"/lists/{slug}/tasks/{task_id}", json=body)
+            await asyncio.sleep(think_time)
+
+    async def hot_mover(self, think_time: float) -> None:
+        slug = next(iter(self.lists))
+        while self.running:
+            task_id, target_id = random.sample(self.lists[slug], 2)
+            body = {"move_position": "after", "target_task": target_id}
+            await self.call("PUT /lists/{slug}/tasks/{task_id} (hot move)", "PUT", f"/lists/{slug}/tasks/{task_id}", json=body)
+            await asyncio.sleep(think_time)
+
+    async def creator(self, burst_size: int, burst_interval: float) -> None:
+        while self.running:
+            slug = random.choice(list(self.lists))
+            responses = await asyncio.gather(*(
+                self.call("POST /lists/{slug}/tasks", "POST", f"/lists/{slug}/tasks", json={"task": "burst"})
+                for _ in range(burst_size)
+            ))
+            self.lists[slug].extend(r.json()["id"] for r in responses if r is not None and r.status_code == 200)
+            await asyncio.sleep(burst_interval)
+
+    async def churner(self, tasks_per_list: int) -> None:
+        while self.running:
+            response = await self.call("POST /lists/", "POST", "/lists/", json={"name": "churn"})
+            if response is None or response.status_code != 200:
+                continue
+            slug = response.json()["slug"]
+            for index in range(tasks_per_list):
+                await self.call("POST /lists/{slug}/tasks", "POST", f"/lists/{slug}/tasks", json={"task": f"churn {index}"})
+            await self.call("DELETE /lists/{slug}", "DELETE", f"/lists/{slug}")
+
+    async def subscriber(self) -> None:
+        slug = random.choice(list(self.lists))
+        try:
+            async with self.client.stream("GET", f"/lists/{slug}/events", timeout=None) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        if line == "event: resync":
+                            self.resyncs += 1
+                        elif line != "event: ready":
+                            self.events_received += 1
+                    if not self.running:
+                        return
+        except httpx.HTTPError:
+            self.errors["GET /lists/{slug}/events"] += 1
+
+
+def task_operations(count: int, task_ids: list[str], rng: random.Random) -> list[dict]:
+    """Batch operations: creates, text and is_done edits and moves of the given tasks."""
+    operations = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.2:
+            operations.append({"op": "create", "task": f"batch {rng.randrange(1000)}"})
+        elif kind < 0.7:
+            operations.append({"op": "update", "task_id": rng.choice(task_ids), "is_done": rng.random() < 0.5})
+        else:
+            task_id, target_id = rng.sample(task_ids, 2)
+            operations.append({"op": "update", "task_id": task_id, "move_position": "after", "target_task": target_id})
+    return operations
+
+
+async def compare_batch(client: httpx.AsyncClient, operations: int, batch_size: int, clients: int, tasks: int) -> dict:
+    """The same operations as single-task calls and as batches of batch_size, each time on a fresh list."""
+    results = {}
+    for variant in ("single", "batch"):
+        slug = (await client.post("/lists/", json={"name": f"batch compare {variant}"})).json()["slug"]
+        body = "".join(json.dumps({"task": f"task {i}"}) + "\n" for i in range(tasks))
+        (await client.post(f"/lists/{slug}/import", content=body.encode())).raise_for_status()
+        task_ids = [task["id"] for task in (await client.get(f"/lists/{slug}")).json()["tasks"]]
+        # Every client gets its own share of the same operations in both variants
+        shares = [task_operations(operations // clients, task_ids, random.Random(index)) for index in range(clients)]
+        latencies: list[float] = []
+        errors = 0
+
+        async def send(method: str, url: str, json_body: dict) -> None:
+            nonlocal errors
+            started_at = time.perf_counter()
+            response = await client.request(method, url, json=json_body)
+            latencies.append(time.perf_counter() - started_at)
+            errors += response.status_code >= 400
+
+        async def single(share: list[dict]) -> None:
+            for operation in share:
+                if operation["op"] == "create":
+                    await send("POST", f"/lists/{slug}/tasks", {"task": operation["task"]})
+                else:
+                    fields = {key: value for key, value in operation.items() if key not in ("op", "task_id")}
+                    await send("PUT", f"/lists/{slug}/tasks/{operation['task_id']}", fields)
+
+        async def batched(share: list[dict]) -> None:
+            for start in range(0, len(share), batch_size):
+                await send("POST", f"/lists/{slug}/tasks:batch", {"operations": share[start:start + batch_size]})
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*((single if variant == "single" else batched)(share) for share in shares))
+        elapsed = time.perf_counter() - started_at
+        applied = sum(len(share) for share in shares)
+        results[variant] = {"operations": applied, "operations_per_s": applied / elapsed, "errors": errors,
+                            "request": summarize(latencies, elapsed)}
+        await client.delete(f"/lists/{slug}")
+    return results
+
+
+async def create_lists(base_url: str, lists: int, clients: int) -> dict:
+    """lists POST /lists/ calls spread over clients concurrent clients."""
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        metrics_before = scrape_metrics(base_url)
+        latencies: list[float] = []
+        errors = 0
+
+        async def creator(count: int) -> None:
+            nonlocal errors
+            for index in range(count):
+                started_at = time.perf_counter()
+                try:
+                    response = await client.post("/lists/", json={"name": f"slug {index}"})
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+                errors += response.status_code >= 400
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(creator(lists // clients + (index < lists % clients)) for index in range(clients)))
+        elapsed = time.perf_counter() - started_at
+        metrics_after = scrape_metrics(base_url)
+    return {
+        "create": summarize(latencies, elapsed),
+        "errors": errors,
+        "sql": sql_per_route(metrics_before, metrics_after).get("/lists/"),
+        "retries": sum(
+            value - metrics_before.get((name, labels), 0.0)
+            for (name, labels), value in metrics_after.items() if name == "todo_transaction_retries_total"
+        ),
+    }
+
+
+async def run(args, base_url: str) -> dict:
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        batch_comparison = None
+        if args.batch_operations:
+            batch_comparison = await compare_batch(client, args.batch_operations, args.batch_size, args.batch_clients, args.tasks_per_list)
+        load = LoadRun(client, deadline=float("inf"))
+        await load.setup(args.lists, args.tasks_per_list)
+        metrics_before = scrape_metrics(base_url)
+
+        started_at = time.perf_counter()
+        load.deadline = started_at + args.duration
+        roles = (
+            [load.poller(args.poll_interval) for _ in range(args.pollers)]
+            + [load.mover(args.think_time) for _ in range(args.movers)]
+            + [load.creator(args.burst_size, args.burst_interval) for _ in range(args.creators)]
+            + [load.churner(args.churn_tasks) for _ in range(args.churners)]
+            + [load.editor(args.think_time) for _ in range(args.editors)]
+            + [load.hot_mover(args.think_time) for _ in range(args.hot_movers)]
+        )
+        subscribers = [asyncio.create_task(load.subscriber()) for _ in range(args.subscribers)]
+        await asyncio.gather(*roles)
+        for task in subscribers:
+            task.cancel()
+        await asyncio.gather(*subscribers, return_exceptions=True)
+        elapsed = time.perf_counter() - started_at
+
+        metrics_after = scrape_metrics(base_url)
+
+    endpoints = {
+        endpoint: summarize(latencies, elapsed) | {"errors": load.errors.get(endpoint, 0)}
+        for endpoint, latencies in sorted(load.latencies.items())
+    }
+    return {
+        "duration_s": elapsed,
+        "endpoints": endpoints,
+        "total_throughput_rps": sum(len(latencies) for latencies in load.latencies.values()) / elapsed,
+        "sql": sql_per_route(metrics_before, metrics_after),
+        "retries": {
+            dict(labels)["sqlstate"]: value - metrics_before.get((name, labels), 0.0)
+            for (name, labels), value in metrics_after.items() if name == "todo_transaction_retries_total"
+        },
+        "shed": {
+            dict(labels)["reason"]: value - metrics_before.get((name, labels), 0.0)
+            for (name, labels), value in metrics_after.items() if name == "todo_admission_shed_total"
+        },
+        "sse": {"subscribers": args.subscribers, "events_received": load.events_received, "resyncs": load.resyncs},
+        "batch_comparison": batch_comparison,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--lists", type=int, default=20)
+    parser.add_argument("--tasks-per-list", type=int, default=200)
+    parser.add_argument("--pollers", type=int, default=50)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--movers", type=int, default=10)
+    parser.add_argument("--think-time", type=float, default=0.05)
+    parser.add_argument("--creators", type=int, default=2)
+    parser.add_argument("--burst-size", type=int, default=20)
+    parser.add_argument("--burst-interval", type=float, default=1.0)
+    parser.add_argument("--churners", type=int, default=2)
+    parser.add_argument("--churn-tasks", type=int, default=3)
+    parser.add_argument("--subscribers", type=int, default=20)
+    parser.add_argument("--editors", type=int, default=0, help="clients editing tasks of one shared list")
+    parser.add_argument("--hot-movers", type=int, default=0, help="clients reordering tasks of the same shared list")
+    parser.add_argument("--batch-operations", type=int, default=0, help="compare single calls with batches (0: off)")
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--batch-clients", type=int, default=4)
+    parser.add_argument("--slug-strategies", nargs="*", default=[], choices=["random", "sequence", "block"],
+                        help="compare list creation per slug strategy (default: off)")
+    parser.add_argument("--slug-lists", type=int, default=5_000, help="lists created per strategy")
+    parser.add_argument("--slug-clients", type=int, default=50)
+    parser.add_argument("--slug-pool-size", type=int, default=0, help="FREE_LIST_POOL_SIZE of the comparison runs")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra app setting, repeatable")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        slug_strategies = {}
+        for strategy in args.slug_strategies:
+            strategy_env = env | {"SLUG_STRATEGY": strategy, "FREE_LIST_POOL_SIZE": str(args.slug_pool_size)}
+            with server(database_url, workers=args.workers, env=strategy_env) as (base_url, _):
+                slug_strategies[strategy] = asyncio.run(create_lists(base_url, args.slug_lists, args.slug_clients))
+        with server(database_url, workers=args.workers, env=env) as (base_url, _):
+            results = asyncio.run(run(args, base_url))
+        results["slug_strategies"] = slug_strategies
+
+    print_table(
+        [{"endpoint": endpoint} | summary for endpoint, summary in results["endpoints"].items()],
+        ["endpoint", "count", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms"],
+    )
+    print()
+    print_table(
+        [{"route": route} | stats for route, stats in sorted(results["sql"].items())],
+        ["route", "requests", "statements_per_request", "sql_ms_per_request", "lock_ms_total"],
+    )
+    if results["batch_comparison"]:
+        print()
+        print_table(
+            [{"variant": variant, "operations": stats["operations"], "operations_per_s": stats["operations_per_s"],
+              "requests": stats["request"]["count"], "errors": stats["errors"], "request_p50_ms": stats["request"]["p50_ms"],
+              "request_p99_ms": stats["request"]["p99_ms"]} for variant, stats in results["batch_comparison"].items()],
+            ["variant", "operations", "operations_per_s", "requests", "errors", "request_p50_ms", "request_p99_ms"],
+        )
+    if results["slug_strategies"]:
+        print()
+        print_table(
+            [{"strategy": strategy, "lists_per_s": stats["create"]["throughput_rps"], "p50_ms": stats["create"]["p50_ms"],
+              "p99_ms": stats["create"]["p99_ms"], "max_ms": stats["create"]["max_ms"], "errors": stats["errors"],
+              "retries": stats["retries"], "statements_per_request": (stats["sql"] or {}).get("statements_per_request")}
+             for strategy, stats in results["slug_strategies"].items()],
+            ["strategy", "lists_per_s", "p50_ms", "p99_ms", "max_ms", "errors", "retries", "statements_per_request"],
+        )
+    print(f"\nSSE: {results['sse']}")
+    print(f"Transaction retries by SQLSTATE: {results['retries']}")
+    print(f"Requests shed by admission control: {results['shed']}")
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('load', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Micro-benchmarks of WeightService and SlugService.
+
+WeightService: neighbour lookups and weight calculation through WeightIndex for lists of
+10 / 1k / 100k tasks, inserts into the index, and an in-memory rebalance. Besides random moves,
+an adversarial sequence inserts every new task right after the same task, into the gap the previous
+insert halved, and reports how many inserts it takes until a rebalance and how long rebalances take.
+
+SlugService: slugs per second for every strategy. The sequence and block strategies need a
+database (--database-url, or a throwaway pgserver instance with --with-database).
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --with-database
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from benchmarks.common import database, migrate, print_table, save_results, summarize
+
+from app.entities import MovePosition
+from app.exceptions import WeightRebalanceRequiredException
+from app.slug_service import BlockSlugGenerator, RandomSlugGenerator, SequenceSlugGenerator, SlugService, encode_slug, scramble
+from app.weight_service import WeightIndex, WeightService
+from app.db.repositories.todo_list_repository import TodoListRepository
+
+
+def timed(operations: int, function) -> dict:
+    started_at = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started_at
+    return {"operations": operations, "seconds": elapsed, "ops_per_s": operations / elapsed, "us_per_op": elapsed / operations * 1e6}
+
+
+def weight_benchmarks(sizes: list[int], operations: int) -> dict:
+    results = {}
+    weight_service = WeightService()
+    for size in sizes:
+        task_ids = [uuid.uuid4() for _ in range(size)]
+        keys = sorted((float(position + 1) * weight_service.normal_step, task_id) for position, task_id in enumerate(task_ids))
+
+        index = WeightIndex(list(keys))
+        requests = [(random.choice(list(MovePosition)), random.choice(task_ids), random.choice(task_ids)) for _ in range(operations)]
+
+        def calculate():
+            for position, target_id, moving_id in requests:
+                target = target_id if position in (MovePosition.BEFORE, MovePosition.AFTER) else None
+                weight_service.calculate_weight(index, position, target, moving_id)
+
+        def move():
+            # Drag and drop: calculate the new weight, then update the index like apply_todo_task_batch does
+            for position, target_id, moving_id in requests:
+                if target_id == moving_id:
+                    continue
+                target = target_id if position in (MovePosition.BEFORE, MovePosition.AFTER) else None
+                weight = weight_service.calculate_weight(moving_index, position, target, moving_id)
+                moving_index.remove(moving_id)
+                moving_index.insert(moving_id, weight)
+
+        moving_index = WeightIndex(list(keys))
+        rebalance_index = WeightIndex(list(keys))
+        results[size] = {
+            "build_index": timed(1, lambda: WeightIndex(list(keys))),
+            "calculate_weight": timed(operations, calculate),
+            "move": timed(operations, move),
+            "rebalance": timed(1, lambda: rebalance_index.rebalance(weight_service.normal_step)),
+        }
+    return results
+
+
+def adversarial_benchmarks(sizes: list[int], operations: int) -> dict:
+    """Insert operations tasks one after another right after the first task of a list of size tasks."""
+    results = {}
+    weight_service = WeightService()
+    for size in sizes:
+        task_ids = [uuid.uuid4() for _ in range(size)]
+        index = WeightIndex(sorted((float(position + 1) * weight_service.normal_step, task_id) for position, task_id in enumerate(task_ids)))
+        anchor = task_ids[0]
+        rebalances: list[float] = []
+        started_at = time.perf_counter()
+        for _ in range(operations):
+            # Like TodoService._calculate_weight_in_index: rebalance once the gap is used up and place again
+            try:
+                weight = weight_service.calculate_weight(index, MovePosition.AFTER, anchor)
+            except WeightRebalanceRequiredException:
+                rebalance_started_at = time.perf_counter()
+                index.rebalance(weight_service.normal_step)
+                rebalances.append(time.perf_counter() - rebalance_started_at)
+                weight = weight_service.calculate_weight(index, MovePosition.AFTER, anchor)
+            index.insert(uuid.uuid4(), weight)
+        elapsed = time.perf_counter() - started_at
+        results[size] = {
+            "operations": operations,
+            "us_per_op": elapsed / operations * 1e6,
+            "rebalances": len(rebalances),
+            "inserts_per_rebalance": operations / len(rebalances) if rebalances else None,
+            "rebalance_ms": summarize(rebalances)["mean_ms"] if rebalances else None,
+            "rebalance_share": sum(rebalances) / elapsed,
+        }
+    return results
+
+
+async def slug_benchmarks(count: int, database_url: str | None) -> dict:
+    results = {}
+
+    async def generate(service: SlugService, session, batch: int) -> None:
+        for _ in range(count // batch):
+            await service.generate_slugs(session, batch)
+
+    random_service = SlugService(RandomSlugGenerator())
+    started_at = time.perf_counter()
+    await generate(random_service, None, 1)
+    results["random"] = _rate(count, time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    for number in range(count):
+        encode_slug(scramble(number))
+    results["encode_only"] = _rate(count, time.perf_counter() - started_at)
+
+    if database_url is None:
+        return results
+
+    from app.db.database import Database
+    db = Database(database_url)
+    try:
+        for name, generator in (
+            ("sequence", SequenceSlugGenerator(TodoListRepository())),
+            ("block", BlockSlugGenerator(TodoListRepository(), block_size=1000)),
+        ):
+            async with db.get_unit_of_work() as uow:
+                started_at = time.perf_counter()
+                await generate(SlugService(generator), uow.session, 1)
+                results[name] = _rate(count, time.perf_counter() - started_at)
+    finally:
+        await db.dispose()
+    return results
+
+
+def _rate(count: int, elapsed: float) -> dict:
+    return {"slugs": count, "seconds": elapsed, "slugs_per_s": count / elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--operations", type=int, default=10_000)
+    parser.add_argument("--slugs", type=int, default=20_000)
+    parser.add_argument("--database-url", help="dedicated database for the sequence and block slug strategies")
+    parser.add_argument("--with-database", action="store_true", help="use a throwaway pgserver database for them")
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = {"weight": weight_benchmarks(args.sizes, args.operations),
+               "adversarial": adversarial_benchmarks(args.sizes, args.operations)}
+    if args.database_url or args.with_database:
+        with database(args.database_url) as database_url:
+            migrate(database_url)
+            results["slug"] = asyncio.run(slug_benchmarks(args.slugs, database_url))
+    else:
+        results["slug"] = asyncio.run(slug_benchmarks(args.slugs, None))
+
+    print_table(
+        [{"size": size, "benchmark": name} | stats for size, benchmarks in results["weight"].items() for name, stats in benchmarks.items()],
+        ["size", "benchmark", "operations", "us_per_op", "ops_per_s"],
+    )
+    print()
+    print_table(
+        [{"size": size} | stats for size, stats in results["adversarial"].items()],
+        ["size", "operations", "us_per_op", "rebalances", "inserts_per_rebalance", "rebalance_ms", "rebalance_share"],
+    )
+    print()
+    print_table([{"strategy": name} | stats for name, stats in results["slug"].items()], ["strategy", "slugs", "slugs_per_s"])
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('micro', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
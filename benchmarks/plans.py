@@ -0,0 +1,140 @@
+"""Query plan regression check for the hot repository queries.
+
+Seeds a realistic amount of data inside a transaction, runs the hot repository methods while
+recording the SQL they emit, and EXPLAINs every recorded statement. Exits with status 1 if any
+of them scans todo_lists or todo_tasks sequentially. The transaction is rolled back, so the
+database is left as it was. tests/test_query_plans.py runs the same check under pytest.
+
+    python -m benchmarks.plans
+"""
+import argparse
+import asyncio
+import json
+import sys
+import uuid
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from benchmarks.common import database, migrate
+
+from app.db.repositories.todo_list_change_repository import TodoListChangeRepository
+from app.db.repositories.todo_list_repository import TodoListRepository
+from app.db.repositories.todo_task_repository import TodoTaskRepository
+
+WATCHED_TABLES = {"todo_lists", "todo_tasks", "todo_list_changes"}
+
+SEED = """
+INSERT INTO todo_lists (id, name, slug, is_free, version)
+SELECT gen_random_uuid(), 'plan check', 'PLAN' || lpad(i::text, 6, '0'), i % 50 = 0, 1
+FROM generate_series(1, :lists) AS i;
+
+INSERT INTO todo_tasks (id, task, is_done, todo_list_id, weight)
+SELECT gen_random_uuid(), 'task', false, l.id, t * 100.0
+FROM todo_lists AS l, generate_series(1, :tasks_per_list) AS t
+WHERE l.slug LIKE 'PLAN%' AND NOT l.is_free;
+
+INSERT INTO todo_list_changes (todo_list_id, version, op, task_id, data)
+SELECT t.todo_list_id, row_number() OVER (PARTITION BY t.todo_list_id ORDER BY t.weight), 'task_created', t.id, '{"task": "task"}'
+FROM todo_tasks AS t JOIN todo_lists AS l ON l.id = t.todo_list_id
+WHERE l.slug LIKE 'PLAN%';
+
+ANALYZE todo_lists;
+ANALYZE todo_tasks;
+ANALYZE todo_list_changes;
+"""
+
+
+async def hot_queries(session: AsyncSession) -> None:
+    todo_lists = TodoListRepository()
+    todo_tasks = TodoTaskRepository()
+    todo_list_changes = TodoListChangeRepository()
+    todo_list = await todo_lists.get_by_slug(session, "PLAN000001", with_tasks=True, with_block=True)
+    await todo_lists.get_version_by_slug(session, "PLAN000001")
+    keys = await todo_tasks.get_weight_keys(session, todo_list.id)
+    weight, task_id = keys[len(keys) // 2]
+    await todo_tasks.get_weight(session, todo_list.id, task_id)
+    await todo_tasks.get_by_id(session, task_id, with_block=True, list_id=todo_list.id)
+    await todo_tasks.get_boundary_weight(session, todo_list.id, last=True)
+    await todo_tasks.get_adjacent_weight(session, todo_list.id, task_id, weight, after=True)
+    await todo_tasks.get_page(session, todo_list.id, (weight, task_id), 100)
+    await todo_list_changes.get_min_version(session, todo_list.id)
+    await todo_list_changes.get_since(session, todo_list.id, 10, 20, 1001)
+    await todo_list_changes.delete_older_than(session, 86400.0, 1000)
+    rows = await todo_list_changes.get_list_ids_after(session, 0, 1000)
+    changed = list(dict.fromkeys(list_id for _, list_id in rows))
+    await todo_list_changes.get_list_ids_over(session, changed, 200)
+    await todo_list_changes.delete_behind(session, todo_list.id, 1000, 1000)
+    await todo_lists.claim_free(session, "plan check")
+    await todo_tasks.set_is_done_where(session, todo_list.id, True, is_done=False)
+    await todo_tasks.delete_where(session, todo_list.id, is_done=True)
+    await todo_tasks.delete_by_list_id(session, todo_list.id)
+    await todo_lists.lock_next_deleted(session)
+    await todo_tasks.delete_batch_by_list_id(session, todo_list.id, 1000)
+    await todo_tasks.rebalance(session, uuid.uuid4(), 100.0)
+
+
+def scanned_tables(plan: dict) -> set[str]:
+    tables = set()
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in WATCHED_TABLES:
+        tables.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables |= scanned_tables(child)
+    return tables
+
+
+async def check(database_url: str, lists: int, tasks_per_list: int) -> list[tuple[str, set[str]]]:
+    engine = create_async_engine(database_url)
+    statements: list[tuple[str, tuple]] = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")) and not executemany:
+            statements.append((statement, parameters))
+
+    failures = []
+    try:
+        async with engine.connect() as connection:
+            transaction = await connection.begin()
+            try:
+                for statement in SEED.split(";"):
+                    if statement.strip():
+                        await connection.execute(text(statement), {"lists": lists, "tasks_per_list": tasks_per_list})
+                statements.clear()
+                async with AsyncSession(bind=connection, join_transaction_mode="create_savepoint") as session:
+                    await hot_queries(session)
+
+                driver = (await connection.get_raw_connection()).driver_connection
+                for statement, parameters in statements:
+                    plan = await driver.fetchval(f"EXPLAIN (FORMAT JSON) {statement}", *(parameters or ()))
+                    # SQLAlchemy registers a json codec on its asyncpg connections, without it the plan is text
+                    plan = json.loads(plan) if isinstance(plan, str) else plan
+                    tables = scanned_tables(plan[0]["Plan"])
+                    print(("SEQ SCAN " + ", ".join(sorted(tables)) if tables else "ok") + ": " + " ".join(statement.split())[:160])
+                    if tables:
+                        failures.append((statement, tables))
+            finally:
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="database to check (default: throwaway pgserver instance)")
+    parser.add_argument("--lists", type=int, default=5_000)
+    parser.add_argument("--tasks-per-list", type=int, default=50)
+    args = parser.parse_args()
+
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        failures = asyncio.run(check(database_url, args.lists, args.tasks_per_list))
+    if failures:
+        print(f"{len(failures)} hot queries scan a table sequentially")
+        sys.exit(1)
+    print("All hot queries use indexes")
+
+
+if __name__ == "__main__":
+    main()
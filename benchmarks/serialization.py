@@ -0,0 +1,123 @@
+"""CPU cost of building list responses, on one list with --tasks tasks (5k by default).
+
+Variants, each run --runs times in this process against the database:
+
+- orm_models: the former GET /lists/{slug} path, ORM objects with selectinload -> TodoList.model_validate
+  -> model_dump_json;
+- rows_direct: the current path, task rows -> app.serialization.encode_todo_list;
+- page_validated / page_fast: GET /lists/{slug}/tasks?limit=1000 through the ASGI app, with FastAPI
+  validating the returned model against response_model, and with FAST_JSON_RESPONSES.
+
+Reports CPU time (process_time) and wall time per call. --profile prints the top functions of each
+variant by own time (cProfile).
+
+    python -m benchmarks.serialization --tasks 5000 --profile
+"""
+import argparse
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+import uuid
+
+from benchmarks.common import database, migrate, print_table, save_results, summarize
+
+
+async def seed(db, tasks: int) -> str:
+    async with db.get_unit_of_work() as uow:
+        slug = uuid.uuid4().hex[:8].upper()
+        todo_list = await uow.todo_lists.create(uow.session, name="serialization", slug=slug, is_free=False)
+        rows = [(uuid.uuid4(), f"task number {i}", i % 2 == 0, todo_list.id, (i + 1) * 100.0) for i in range(tasks)]
+        await uow.todo_tasks.copy_rows(uow.session, rows)
+        await uow.commit()
+    return slug
+
+
+async def measure_variant(name: str, runs: int, call, profile: bool) -> dict:
+    await call()  # warm-up: first queries, imports, schema caches
+    profiler = cProfile.Profile() if profile else None
+    cpu, wall = [], []
+    for _ in range(runs):
+        cpu_started_at, wall_started_at = time.process_time(), time.perf_counter()
+        if profiler:
+            profiler.enable()
+        await call()
+        if profiler:
+            profiler.disable()
+        cpu.append(time.process_time() - cpu_started_at)
+        wall.append(time.perf_counter() - wall_started_at)
+    if profiler:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("tottime").print_stats(12)
+        print(f"== {name}\n{output.getvalue()}")
+    return {"cpu": summarize(cpu), "wall": summarize(wall)}
+
+
+async def run(database_url: str, tasks: int, runs: int, profile: bool) -> dict:
+    # Settings are read at import time, the list cache would turn every run after the first into a lookup
+    os.environ.update({"DATABASE_URL": database_url, "LIST_CACHE_MAX_SIZE": "0", "METRICS_ENABLED": "false"})
+    import httpx
+
+    from app.core import settings
+    from app.entities import TodoList
+    from app.main import app
+    from app.serialization import encode_todo_list
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        db = app.state.database
+        slug = await seed(db, tasks)
+
+        async def orm_models():
+            async with db.get_unit_of_work() as uow:
+                todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug, with_tasks=True)
+                return TodoList.model_validate(todo_list_orm).model_dump_json().encode()
+
+        async def rows_direct():
+            async with db.get_unit_of_work() as uow:
+                todo_list_orm = await uow.todo_lists.get_by_slug(uow.session, slug)
+                rows = await uow.todo_tasks.get_rows_by_list_id(uow.session, todo_list_orm.id)
+                return encode_todo_list(todo_list_orm, rows)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            async def page():
+                response = await client.get(f"/lists/{slug}/tasks", params={"limit": settings.tasks_page_max_size})
+                response.raise_for_status()
+
+            results["orm_models"] = await measure_variant("orm_models", runs, orm_models, profile)
+            results["rows_direct"] = await measure_variant("rows_direct", runs, rows_direct, profile)
+            settings.fast_json_responses = False
+            results["page_validated"] = await measure_variant("page_validated", runs, page, profile)
+            settings.fast_json_responses = True
+            results["page_fast"] = await measure_variant("page_fast", runs, page, profile)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--tasks", type=int, default=5_000)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--profile", action="store_true", help="print a cProfile summary of every variant")
+    args = parser.parse_args()
+
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        results = asyncio.run(run(database_url, args.tasks, args.runs, args.profile))
+
+    print_table(
+        [
+            {"variant": name, "cpu_p50_ms": stats["cpu"]["p50_ms"], "cpu_p95_ms": stats["cpu"]["p95_ms"],
+             "wall_p50_ms": stats["wall"]["p50_ms"], "wall_p95_ms": stats["wall"]["p95_ms"]}
+            for name, stats in results.items()
+        ],
+        ["variant", "cpu_p50_ms", "cpu_p95_ms", "wall_p50_ms", "wall_p95_ms"],
+    )
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('serialization', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
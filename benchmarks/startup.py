@@ -0,0 +1,55 @@
+"""Startup benchmark: import time of app.main and time from process start to the first answered request.
+
+The first answered request is one that reaches the database (GET of a missing list), so the
+measured time includes the lifespan: engine creation, pool warm-up and event hub start.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import ROOT, database, migrate, print_table, save_results, server
+
+IMPORT_SNIPPET = "import time; started_at = time.perf_counter(); import app.main; print(time.perf_counter() - started_at)"
+
+
+def import_time() -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def first_response_time(database_url: str) -> float:
+    started_at = time.perf_counter()
+    with server(database_url):
+        return time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        imports = [import_time() for _ in range(args.runs)]
+        first_responses = [first_response_time(database_url) for _ in range(args.runs)]
+
+    results = {
+        name: {
+            "runs": len(values),
+            "median_ms": statistics.median(values) * 1000,
+            "min_ms": min(values) * 1000,
+            "max_ms": max(values) * 1000,
+        }
+        for name, values in (("import", imports), ("first_response", first_responses))
+    }
+    print_table([{"measure": name} | stats for name, stats in results.items()], ["measure", "runs", "median_ms", "min_ms", "max_ms"])
+    print(f"Saved {save_results('startup', {'runs': args.runs}, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Large list benchmark: import throughput, and time to first byte, total time and server peak RSS
+of reading a whole list for growing list sizes.
+
+Read modes: the full GET /lists/{slug} document, the NDJSON stream of GET /lists/{slug}/tasks,
+and the CSV export. Every read runs against a freshly started server, so peak RSS belongs to that read.
+
+    python -m benchmarks.streaming --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import time
+
+import httpx
+
+from benchmarks.common import database, migrate, print_table, process_memory, save_results, server
+
+READ_MODES = {
+    "full": lambda slug: (f"/lists/{slug}", {}, {}),
+    "ndjson": lambda slug: (f"/lists/{slug}/tasks", {}, {"Accept": "application/x-ndjson"}),
+    "csv_export": lambda slug: (f"/lists/{slug}/export", {"format": "csv"}, {}),
+}
+
+
+def import_list(base_url: str, size: int) -> tuple[str, dict]:
+    with httpx.Client(base_url=base_url, timeout=600) as client:
+        slug = client.post("/lists/", json={"name": f"size {size}"}).json()["slug"]
+        body = "".join(json.dumps({"task": f"task number {i}", "is_done": i % 2 == 0}) + "\n" for i in range(size)).encode()
+        started_at = time.perf_counter()
+        response = client.post(f"/lists/{slug}/import", content=body)
+        elapsed = time.perf_counter() - started_at
+        response.raise_for_status()
+    return slug, {"tasks": size, "seconds": elapsed, "tasks_per_minute": size / elapsed * 60}
+
+
+def read_list(base_url: str, pid: int, slug: str, mode: str) -> dict:
+    path, params, headers = READ_MODES[mode](slug)
+    memory_before = process_memory(pid)
+    with httpx.Client(base_url=base_url, timeout=600) as client:
+        started_at = time.perf_counter()
+        first_byte = None
+        received = 0
+        with client.stream("GET", path, params=params, headers=headers) as response:
+            response.raise_for_status()
+            for chunk in response.iter_raw():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started_at
+                received += len(chunk)
+        total = time.perf_counter() - started_at
+    memory_after = process_memory(pid)
+    return {
+        "ttfb_ms": (first_byte or total) * 1000,
+        "total_ms": total * 1000,
+        "bytes": received,
+        "rss_before_mib": memory_before["rss_mib"],
+        "peak_rss_mib": memory_after["peak_rss_mib"],
+        "peak_growth_mib": memory_after["peak_rss_mib"] - memory_before["rss_mib"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--modes", nargs="+", choices=list(READ_MODES), default=list(READ_MODES))
+    args = parser.parse_args()
+
+    results = {"import": {}, "read": {}}
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        slugs = {}
+        with server(database_url) as (base_url, _):
+            for size in args.sizes:
+                slugs[size], results["import"][size] = import_list(base_url, size)
+        for size in args.sizes:
+            for mode in args.modes:
+                with server(database_url) as (base_url, process):
+                    results["read"][f"{size}/{mode}"] = {"size": size, "mode": mode} | read_list(base_url, process.pid, slugs[size], mode)
+
+    print_table([{"size": size} | stats for size, stats in results["import"].items()], ["size", "seconds", "tasks_per_minute"])
+    print()
+    print_table(
+        list(results["read"].values()),
+        ["size", "mode", "ttfb_ms", "total_ms", "bytes", "rss_before_mib", "peak_rss_mib", "peak_growth_mib"],
+    )
+    print(f"Saved {save_results('streaming', {'sizes': args.sizes, 'modes': args.modes}, results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""p99 latency under concurrent clients: the asyncio app against the sync-on-event-loop one it replaced.
+
+The sync version (SQLAlchemy on psycopg2 called from async endpoints, so every query blocks the
+event loop) is run from a git worktree of --sync-revision, by default the first commit of the
+history. Both apps get the same workload on their own database: --clients concurrent clients, in
+steps, each for --duration seconds, reading a list (GET /lists/{slug}), editing a task's text
+(PUT /lists/{slug}/tasks/{id}) and adding tasks (POST /lists/{slug}/tasks) in --read-share,
+--edit-share and the remaining share of their requests. Reports throughput and p50/p99 per
+version and step.
+
+    python -m benchmarks.sync_async --clients 10 50 100 --duration 20
+
+The sync version creates its tables itself and needs its own database, so with --database-url
+also pass --sync-database-url. The sync version needs psycopg2 installed.
+"""
+import argparse
+import asyncio
+import contextlib
+import random
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmarks.common import ROOT, database, migrate, print_table, save_results, server, summarize
+
+
+@contextlib.contextmanager
+def worktree(revision: str):
+    """Check out revision into a temporary git worktree and yield its path."""
+    with tempfile.TemporaryDirectory(prefix="todo-bench-") as directory:
+        path = Path(directory) / "checkout"
+        subprocess.run(["git", "worktree", "add", "--detach", str(path), revision], cwd=ROOT, check=True, capture_output=True)
+        try:
+            yield path
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", str(path)], cwd=ROOT, capture_output=True)
+
+
+def first_revision() -> str:
+    return subprocess.run(
+        ["git", "rev-list", "--max-parents=0", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stdout.split()[0]
+
+
+async def client_loop(client: httpx.AsyncClient, lists: list[tuple[str, list[str]]], args, deadline: float,
+                      rng: random.Random, latencies: dict[str, list[float]], errors: dict[str, int]) -> None:
+    while time.perf_counter() < deadline:
+        slug, task_ids = rng.choice(lists)
+        draw = rng.random()
+        if draw < args.read_share:
+            endpoint, request = "get_list", client.get(f"/lists/{slug}")
+        elif draw < args.read_share + args.edit_share:
+            endpoint = "edit_task"
+            request = client.put(f"/lists/{slug}/tasks/{rng.choice(task_ids)}", json={"task": f"edit {rng.random():.6f}"})
+        else:
+            endpoint, request = "create_task", client.post(f"/lists/{slug}/tasks", json={"task": "added"})
+        started_at = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            errors[endpoint] += 1
+            continue
+        latencies[endpoint].append(time.perf_counter() - started_at)
+        if response.status_code >= 400:
+            errors[endpoint] += 1
+
+
+async def run(args, base_url: str) -> list[dict]:
+    limits = httpx.Limits(max_connections=max(args.clients) + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        lists = []
+        for index in range(args.lists):
+            slug = (await client.post("/lists/", json={"name": f"sync async {index}"})).json()["slug"]
+            task_ids = [
+                (await client.post(f"/lists/{slug}/tasks", json={"task": f"task {number}"})).json()["id"]
+                for number in range(args.tasks)
+            ]
+            lists.append((slug, task_ids))
+
+        steps = []
+        for clients in args.clients:
+            latencies: dict[str, list[float]] = defaultdict(list)
+            errors: dict[str, int] = defaultdict(int)
+            started_at = time.perf_counter()
+            deadline = started_at + args.duration
+            await asyncio.gather(*(
+                client_loop(client, lists, args, deadline, random.Random(args.seed + index), latencies, errors)
+                for index in range(clients)
+            ))
+            duration = time.perf_counter() - started_at
+            steps.append({
+                "clients": clients,
+                "all": summarize([value for values in latencies.values() for value in values], duration),
+                "endpoints": {endpoint: summarize(values, duration) for endpoint, values in latencies.items()},
+                "errors": dict(errors),
+            })
+    return steps
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database for the async app (default: throwaway pgserver instance)")
+    parser.add_argument("--sync-database-url", help="dedicated database for the sync app (default: throwaway pgserver instance)")
+    parser.add_argument("--sync-revision", help="commit of the sync app (default: the first commit)")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per step")
+    parser.add_argument("--lists", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=20, help="tasks per list created up front")
+    parser.add_argument("--read-share", type=float, default=0.7)
+    parser.add_argument("--edit-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra setting of both apps, repeatable")
+    args = parser.parse_args()
+    if args.database_url and not args.sync_database_url:
+        parser.error("--database-url needs --sync-database-url, the two apps cannot share a database")
+
+    # Compared as plain request handling, without the async app's load shedding
+    env = {"ADMISSION_ENABLED": "false"} | dict(item.split("=", 1) for item in args.env)
+    results = {}
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        with server(database_url, env=env) as (base_url, _):
+            results["async"] = asyncio.run(run(args, base_url))
+    revision = args.sync_revision or first_revision()
+    with database(args.sync_database_url) as database_url, worktree(revision) as checkout:
+        with server(database_url.replace("+asyncpg", "+psycopg2"), env=env, cwd=checkout) as (base_url, _):
+            results["sync"] = asyncio.run(run(args, base_url))
+
+    print_table(
+        [{
+            "version": version, "clients": step["clients"], "rps": step["all"]["throughput_rps"],
+            "p50_ms": step["all"]["p50_ms"], "p99_ms": step["all"]["p99_ms"], "max_ms": step["all"]["max_ms"],
+            "get_p99_ms": step["endpoints"].get("get_list", {}).get("p99_ms"),
+            "edit_p99_ms": step["endpoints"].get("edit_task", {}).get("p99_ms"),
+            "errors": sum(step["errors"].values()),
+        } for version in ("sync", "async") for step in results[version]],
+        ["version", "clients", "rps", "p50_ms", "p99_ms", "max_ms", "get_p99_ms", "edit_p99_ms", "errors"],
+    )
+    config = {key: value for key, value in vars(args).items() if key not in ("database_url", "sync_database_url")}
+    print(f"Saved {save_results('sync_async', config | {'sync_revision': revision}, results)}")
+
+
+if __name__ == "__main__":
+    main()
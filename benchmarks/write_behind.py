@@ -0,0 +1,118 @@
+"""Write-behind: --editors clients each typing into its own task of one list, --edits keystrokes each.
+
+Every keystroke is a PUT of the whole task text, as an editor saving as the user types. Runs in this
+process through the ASGI app, once with synchronous edits and once with WRITE_BEHIND_ENABLED, and
+reports the SQL statements executed, the list versions used up and the request latency.
+
+    python -m benchmarks.write_behind --editors 20 --edits 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import event
+
+from benchmarks.common import database, migrate, print_table, save_results, summarize
+
+
+async def seed(db, tasks: int) -> tuple[str, list[uuid.UUID]]:
+    async with db.get_unit_of_work() as uow:
+        slug = uuid.uuid4().hex[:8].upper()
+        todo_list = await uow.todo_lists.create(uow.session, name="write-behind", slug=slug, is_free=False)
+        rows = [(uuid.uuid4(), f"task number {i}", False, todo_list.id, (i + 1) * 100.0) for i in range(tasks)]
+        await uow.todo_tasks.copy_rows(uow.session, rows)
+        await uow.commit()
+    return slug, [row[0] for row in rows]
+
+
+async def run(database_url: str, editors: int, edits: int, tasks: int) -> dict:
+    # Settings are read at import time
+    os.environ.update({
+        "DATABASE_URL": database_url,
+        "METRICS_ENABLED": "false",
+        "ADMISSION_ENABLED": "false",
+        "WRITE_BEHIND_ENABLED": "true",
+        "WRITE_BEHIND_DIR": tempfile.mkdtemp(prefix="write-behind-"),
+    })
+    import httpx
+
+    from app.di import get_write_behind
+    from app.main import app
+
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        db = app.state.database
+        slug, task_ids = await seed(db, max(tasks, editors))
+        event.listen(db.engine.sync_engine, "before_cursor_execute", count)
+        write_behind = get_write_behind()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60) as client:
+            async def version() -> int:
+                response = await client.get(f"/lists/{slug}/changes", params={"since": 0})
+                return response.json()["version"]
+
+            async def edit(task_id: uuid.UUID, text: str) -> float:
+                started_at = time.perf_counter()
+                response = await client.put(f"/lists/{slug}/tasks/{task_id}", json={"task": text})
+                response.raise_for_status()
+                return time.perf_counter() - started_at
+
+            async def type_into(task_id: uuid.UUID) -> list[float]:
+                return [await edit(task_id, "x" * (i + 1)) for i in range(edits)]
+
+            for enabled in (False, True):
+                write_behind.enabled = enabled
+                first_version = await version()
+                statements = 0
+                started_at = time.perf_counter()
+                latencies = sum(await asyncio.gather(*(type_into(task_ids[i]) for i in range(editors))), [])
+                elapsed = time.perf_counter() - started_at
+                # The read flushes what is still pending, so both variants end with every edit written
+                last_version = await version()
+                results["write_behind" if enabled else "synchronous"] = {
+                    "edits_per_second": len(latencies) / elapsed,
+                    "statements_per_edit": statements / len(latencies),
+                    "versions": last_version - first_version,
+                    "latency": summarize(latencies),
+                }
+        results["buffer"] = write_behind.stats()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="dedicated database (default: throwaway pgserver instance)")
+    parser.add_argument("--editors", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=200)
+    args = parser.parse_args()
+
+    with database(args.database_url) as database_url:
+        migrate(database_url)
+        results = asyncio.run(run(database_url, args.editors, args.edits, args.tasks))
+
+    print_table(
+        [
+            {"variant": name, "edits_per_second": stats["edits_per_second"],
+             "statements_per_edit": stats["statements_per_edit"], "versions": stats["versions"],
+             "p50_ms": stats["latency"]["p50_ms"], "p95_ms": stats["latency"]["p95_ms"]}
+            for name, stats in results.items() if name != "buffer"
+        ],
+        ["variant", "edits_per_second", "statements_per_edit", "versions", "p50_ms", "p95_ms"],
+    )
+    print(f"write-behind buffer: {results['buffer']}")
+    config = {key: value for key, value in vars(args).items() if key != "database_url"}
+    print(f"Saved {save_results('write_behind', config, results)}")
+
+
+if __name__ == "__main__":
+    main()
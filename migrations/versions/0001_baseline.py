@@ -0,0 +1,49 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 12:00:00
+
+Schema as it was created by metadata.create_all before migrations were introduced.
+Databases that already have it are left untouched, so `alembic upgrade head` works for them too.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("todo_lists"):
+        return
+
+    op.create_table(
+        "todo_lists",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("slug", sa.String(length=16), nullable=False),
+        sa.Column("is_free", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("slug"),
+    )
+    op.create_table(
+        "todo_tasks",
+        sa.Column("id", sa.Uuid(), nullable=False),
+        sa.Column("task", sa.String(length=255), nullable=False),
+        sa.Column("is_done", sa.Boolean(), nullable=False),
+        sa.Column("todo_list_id", sa.Uuid(), nullable=False),
+        sa.Column("weight", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["todo_list_id"], ["todo_lists.id"]),
+        sa.PrimaryKeyConstraint("id", "todo_list_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("todo_tasks")
+    op.drop_table("todo_lists")
@@ -0,0 +1,64 @@
+"""list version, slug sequence and hot path indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:10:00
+
+IF NOT EXISTS everywhere: databases created by create_all after these objects
+were added to the models already have some of them.
+
+The version column was added to the models before migrations existed, and create_all
+does not add columns to existing tables. To run a commit from that span (e.g. during a
+bisect) against an older database, first apply this revision from a later checkout:
+`alembic upgrade 0002`. It is safe to apply again afterwards.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateSequence, DropSequence
+
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+slug_sequence = sa.Sequence("todo_list_slug_seq", start=0, minvalue=0)
+
+
+def upgrade() -> None:
+    # server_default fills existing rows, new rows get the version from the ORM
+    op.add_column(
+        "todo_lists",
+        sa.Column("version", sa.Integer(), nullable=False, server_default="1"),
+        if_not_exists=True,
+    )
+    op.alter_column("todo_lists", "version", server_default=None)
+
+    op.execute(CreateSequence(slug_sequence, if_not_exists=True))
+
+    # Built without blocking writes to the tables, which requires running outside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_todo_tasks_list_weight",
+            "todo_tasks",
+            ["todo_list_id", "weight", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_todo_lists_free",
+            "todo_lists",
+            ["id"],
+            postgresql_where=sa.text("is_free"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_todo_lists_free", table_name="todo_lists")
+    op.drop_index("ix_todo_tasks_list_weight", table_name="todo_tasks")
+    op.execute(DropSequence(slug_sequence))
+    op.drop_column("todo_lists", "version")
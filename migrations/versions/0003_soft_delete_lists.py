@@ -0,0 +1,44 @@
+"""soft delete of todo lists
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 16:40:00
+
+Deleted lists keep their row with a NULL slug and deleted_at set until
+the background purger has removed their tasks.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Both are metadata-only changes, no table rewrite
+    op.add_column("todo_lists", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+    op.alter_column("todo_lists", "slug", existing_type=sa.String(16), nullable=True)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_todo_lists_deleted",
+            "todo_lists",
+            ["deleted_at"],
+            postgresql_where=sa.text("deleted_at IS NOT NULL"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    # Lists still waiting for the purger can't get their slug back
+    op.execute("DELETE FROM todo_tasks WHERE todo_list_id IN (SELECT id FROM todo_lists WHERE deleted_at IS NOT NULL)")
+    op.execute("DELETE FROM todo_lists WHERE deleted_at IS NOT NULL")
+    op.drop_index("ix_todo_lists_deleted", table_name="todo_lists")
+    op.alter_column("todo_lists", "slug", existing_type=sa.String(16), nullable=False)
+    op.drop_column("todo_lists", "deleted_at")
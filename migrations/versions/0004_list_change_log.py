@@ -0,0 +1,43 @@
+"""change log of todo lists
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 19:20:00
+
+Append-only table read by GET /lists/{slug}/changes. Existing lists start
+with an empty log, so their first delta request gets a snapshot.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A new empty table: plain index creation doesn't block anyone
+    op.create_table(
+        "todo_list_changes",
+        sa.Column("id", sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column("todo_list_id", sa.Uuid(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("op", sa.String(length=16), nullable=False),
+        sa.Column("task_id", sa.Uuid(), nullable=True),
+        sa.Column("data", postgresql.JSONB(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.clock_timestamp(), nullable=False),
+        # Rows of a deleted list go away with the list row when the purger removes it
+        sa.ForeignKeyConstraint(["todo_list_id"], ["todo_lists.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_todo_list_changes_list_version", "todo_list_changes", ["todo_list_id", "version"])
+    op.create_index("ix_todo_list_changes_created", "todo_list_changes", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_table("todo_list_changes")
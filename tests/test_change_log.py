@@ -0,0 +1,154 @@
+"""Change log compaction rules, and when TodoService.get_todo_list_changes answers with a snapshot instead."""
+import asyncio
+import datetime
+import uuid
+from types import SimpleNamespace
+
+from app.change_log import compact_changes
+from app.db.models import TodoListChangeOrm
+from app.entities import TodoListEventType
+from app.list_cache import ListCache
+from app.todo_service import TodoService
+
+LIST_ID = uuid.uuid4()
+TASK_ID = uuid.uuid4()
+CREATED = TodoListEventType.TASK_CREATED.value
+UPDATED = TodoListEventType.TASK_UPDATED.value
+DELETED = TodoListEventType.TASK_DELETED.value
+RELOADED = TodoListEventType.LIST_RELOADED.value
+
+
+def change(change_id: int, op: str, task_id: uuid.UUID | None = TASK_ID, **data) -> TodoListChangeOrm:
+    return TodoListChangeOrm(
+        id=change_id, todo_list_id=LIST_ID, version=change_id, op=op, task_id=task_id, data=data or None,
+        created_at=datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=change_id),
+    )
+
+
+def test_create_then_updates_stay_a_create():
+    deleted, replacements = compact_changes([
+        change(1, CREATED, task="a", is_done=False, weight=1.0),
+        change(2, UPDATED, task="b"),
+        change(3, UPDATED, is_done=True),
+    ])
+    assert deleted == [1, 2, 3]
+    assert replacements == [{
+        "todo_list_id": LIST_ID, "version": 3, "op": CREATED, "task_id": TASK_ID,
+        "data": {"task": "b", "is_done": True, "weight": 1.0}, "created_at": change(3, UPDATED).created_at,
+    }]
+
+
+def test_create_then_delete_becomes_the_delete():
+    # The created task is gone, a client that saw the create learns of the deletion
+    deleted, replacements = compact_changes([change(1, CREATED, task="a"), change(2, DELETED)])
+    assert deleted == [1, 2]
+    assert [(row["op"], row["version"], row["data"]) for row in replacements] == [(DELETED, 2, None)]
+
+
+def test_update_then_delete_becomes_the_delete():
+    deleted, replacements = compact_changes([change(1, UPDATED, task="b"), change(2, DELETED)])
+    assert deleted == [1, 2]
+    assert [(row["op"], row["data"]) for row in replacements] == [(DELETED, None)]
+
+
+def test_single_changes_are_kept_and_earlier_reloads_dropped():
+    other = uuid.uuid4()
+    deleted, replacements = compact_changes([
+        change(1, UPDATED, task="before reload"),
+        change(2, RELOADED, task_id=None),
+        change(3, UPDATED, task="after reload"),
+        change(4, UPDATED, task_id=other, is_done=True),
+    ])
+    assert deleted == [1]
+    assert replacements == []
+
+
+class FakeTodoLists:
+    def __init__(self, todo_list):
+        self.todo_list = todo_list
+
+    async def get_version_by_slug(self, session, slug):
+        return self.todo_list.version
+
+    async def get_by_slug(self, session, slug, **options):
+        return self.todo_list
+
+
+class FakeChanges:
+    def __init__(self, changes: list[TodoListChangeOrm]):
+        self.changes = changes
+
+    async def get_min_version(self, session, list_id):
+        return min((change.version for change in self.changes), default=None)
+
+    async def get_since(self, session, list_id, since, version, limit):
+        return [change for change in self.changes if since < change.version <= version][:limit]
+
+
+class FakeTasks:
+    async def get_rows_by_list_id(self, session, list_id):
+        return [SimpleNamespace(id=TASK_ID, task="now", is_done=True, weight=1.0)]
+
+
+class FakeUnitOfWork:
+    def __init__(self, version: int, changes: list[TodoListChangeOrm]):
+        self.session = None
+        self.todo_lists = FakeTodoLists(SimpleNamespace(id=LIST_ID, slug="LIST0001", name="list", version=version, is_free=False))
+        self.todo_list_changes = FakeChanges(changes)
+        self.todo_tasks = FakeTasks()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeWriteBehind:
+    async def flush(self, slug):
+        pass
+
+
+def get_changes(version: int, changes: list[TodoListChangeOrm], since: int, max_changes: int = 100):
+    service = TodoService(uow=FakeUnitOfWork(version, changes), slug_service=None, weight_service=None, event_hub=None,
+                          list_cache=ListCache(), free_list_pool=None, retry_policy=None, single_flight=None,
+                          write_behind=FakeWriteBehind())
+    return asyncio.run(service.get_todo_list_changes("LIST0001", since, max_changes))
+
+
+def versions(first: int, last: int) -> list[TodoListChangeOrm]:
+    return [change(version, UPDATED, task=f"v{version}") for version in range(first, last + 1)]
+
+
+def test_changes_after_since_are_returned_in_order():
+    result = get_changes(5, versions(1, 5), since=3)
+    assert result.snapshot is None
+    assert [(item.version, item.task) for item in result.changes] == [(4, "v4"), (5, "v5")]
+
+
+def test_up_to_date_client_gets_no_changes():
+    result = get_changes(5, versions(1, 5), since=5)
+    assert (result.changes, result.snapshot) == ([], None)
+
+
+def test_trimmed_log_gives_a_snapshot():
+    # Version 4 was trimmed: the log cannot tell what changed after 3
+    result = get_changes(6, versions(5, 6), since=3)
+    assert result.changes is None
+    assert [task.task for task in result.snapshot.tasks] == ["now"]
+
+
+def test_reload_after_since_gives_a_snapshot():
+    changes = versions(1, 3) + [change(4, RELOADED, task_id=None)] + versions(5, 5)
+    result = get_changes(5, changes, since=2)
+    assert result.changes is None and result.snapshot.version == 5
+
+
+def test_too_many_changes_give_a_snapshot():
+    assert get_changes(5, versions(1, 5), since=1, max_changes=4).changes is not None
+    assert get_changes(5, versions(1, 5), since=0, max_changes=4).snapshot is not None
+
+
+def test_client_ahead_of_the_list_gets_a_snapshot():
+    result = get_changes(5, versions(1, 5), since=9)
+    assert result.changes is None and result.snapshot.version == 5
@@ -0,0 +1,30 @@
+"""Request validation that keeps values the database would reject out of the service."""
+import uuid
+
+import pytest
+from pydantic import ValidationError
+
+from app.entities import TodoTaskBatch, TodoTaskBatchOperation, TodoTaskCreate, TodoTaskUpdate
+
+
+@pytest.mark.parametrize("build", [
+    lambda task: TodoTaskCreate(task=task),
+    lambda task: TodoTaskUpdate(task=task),
+    lambda task: TodoTaskBatchOperation(op="create", task=task),
+    lambda task: TodoTaskBatchOperation(op="update", task_id=uuid.uuid4(), task=task),
+])
+def test_task_text_fits_the_column(build):
+    assert build("x" * 255).task == "x" * 255
+    with pytest.raises(ValidationError):
+        build("x" * 256)
+
+
+def test_batch_create_requires_task():
+    with pytest.raises(ValidationError, match="task is required"):
+        TodoTaskBatchOperation(op="create", is_done=True)
+    assert TodoTaskBatchOperation(op="create", task="").task == ""
+
+
+def test_one_invalid_operation_rejects_the_batch():
+    with pytest.raises(ValidationError):
+        TodoTaskBatch(operations=[{"op": "create", "task": "a"}, {"op": "create", "task": "x" * 256}])
@@ -0,0 +1,74 @@
+"""ListCache eviction and expiry, and fills that lost a race with a newer version of the list."""
+from types import SimpleNamespace
+
+import pytest
+
+from app.list_cache import ListCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr("app.list_cache.time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def fill(cache: ListCache, slug: str, version: int = 1) -> None:
+    cache.set(slug, version, f"{slug} v{version}".encode(), cache.generation)
+
+
+def test_least_recently_used_list_is_evicted():
+    cache = ListCache(max_size=2)
+    fill(cache, "A")
+    fill(cache, "B")
+    assert cache.get("A") is not None
+    fill(cache, "C")
+    assert cache.peek("B") is None
+    assert cache.get("A") == (1, b"A v1") and cache.get("C") == (1, b"C v1")
+    assert cache.evictions == 1
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ListCache(ttl=30.0)
+    fill(cache, "A")
+    clock.now += 29.0
+    assert cache.peek("A") == 1 and cache.get("A") is not None
+    clock.now += 1.0
+    assert cache.peek("A") is None
+    assert cache.get("A") is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+
+def test_fill_loaded_before_an_invalidation_is_dropped():
+    cache = ListCache()
+    generation = cache.generation
+    # A write commits and invalidates while the list is being loaded
+    cache.invalidate("A", 2)
+    cache.set("A", 1, b"A v1", generation)
+    assert cache.peek("A") is None
+    fill(cache, "A", 2)
+    assert cache.get("A") == (2, b"A v2")
+
+
+def test_fill_older_than_a_seen_version_is_dropped():
+    cache = ListCache()
+    cache.invalidate("A", 3)
+    # Loaded after the invalidation, e.g. from a replica that lags behind
+    fill(cache, "A", 2)
+    assert cache.peek("A") is None
+    fill(cache, "A", 3)
+    assert cache.peek("A") == 3
+
+
+def test_min_version_keeps_the_latest_change():
+    cache = ListCache()
+    cache.invalidate("A", 5)
+    cache.invalidate("A", 4)
+    cache.invalidate("A")
+    assert (cache.min_version("A"), cache.min_version("B")) == (5, 0)
+
+
+def test_zero_size_caches_nothing():
+    cache = ListCache(max_size=0)
+    fill(cache, "A")
+    assert cache.get("A") is None
@@ -0,0 +1,25 @@
+"""EXPLAIN regression check of the hot repository queries (see benchmarks/plans.py).
+
+Needs a dedicated PostgreSQL database, given as TEST_DATABASE_URL; skipped without one:
+
+    TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost/todo_test python -m pytest tests/test_query_plans.py
+"""
+import asyncio
+import os
+
+import pytest
+
+DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+def test_hot_queries_do_not_scan_sequentially():
+    # The benchmark harness needs httpx, which the app itself does not
+    from benchmarks.common import migrate
+    from benchmarks.plans import check
+
+    migrate(DATABASE_URL)
+    failures = asyncio.run(check(DATABASE_URL, lists=5_000, tasks_per_list=50))
+    assert not failures, "Sequential scans:\n" + "\n".join(
+        f"{', '.join(sorted(tables))}: {' '.join(statement.split())}" for statement, tables in failures
+    )
@@ -0,0 +1,111 @@
+"""SingleFlight: one call per key for concurrent callers, failures and cancellation of the caller that started it."""
+import asyncio
+
+from app.single_flight import SingleFlight
+
+
+class Call:
+    """A call that runs until released, counting how often it was started."""
+
+    def __init__(self, result=None, error: Exception | None = None):
+        self.result = result
+        self.error = error
+        self.started = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.started += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flights = SingleFlight()
+        call = Call(result="list")
+        callers = [asyncio.create_task(flights.do("key", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        call.release.set()
+        results = await asyncio.gather(*callers)
+        assert results == [("list", False), ("list", True), ("list", True)]
+        assert (call.started, flights.calls, flights.shared) == (1, 1, 2)
+        assert flights.stats()["in_flight"] == 0
+
+    run(scenario())
+
+
+def test_different_keys_do_not_share():
+    async def scenario():
+        flights = SingleFlight()
+        call = Call(result="list")
+        call.release.set()
+        await asyncio.gather(flights.do("a", call), flights.do("b", call))
+        assert call.started == 2
+
+    run(scenario())
+
+
+def test_exception_reaches_every_waiter():
+    async def scenario():
+        flights = SingleFlight(window=10.0)
+        call = Call(error=LookupError("missing"))
+        callers = [asyncio.create_task(flights.do("key", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        call.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, LookupError) for result in results)
+        # A failure is not handed out from the window, the next caller tries again
+        call.error = None
+        assert await flights.do("key", call) == (None, False)
+        assert call.started == 2
+
+    run(scenario())
+
+
+def test_cancelled_leader_does_not_strand_followers():
+    async def scenario():
+        flights = SingleFlight()
+        call = Call(result="list")
+        leader = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+
+        call.release.set()
+        assert await asyncio.wait_for(follower, 1) == ("list", True)
+        assert call.started == 1
+
+    run(scenario())
+
+
+def test_window_hands_out_the_finished_result_until_forgotten():
+    async def scenario():
+        flights = SingleFlight(window=10.0)
+        call = Call(result="list")
+        call.release.set()
+        assert await flights.do("key", call) == ("list", False)
+        assert await flights.do("key", call) == ("list", True)
+        flights.forget("key")
+        assert await flights.do("key", call) == ("list", False)
+        assert (call.started, flights.window_hits, flights.stale) == (2, 1, 1)
+
+    run(scenario())
+
+
+def test_disabled_runs_every_call():
+    async def scenario():
+        flights = SingleFlight(enabled=False)
+        call = Call(result="list")
+        call.release.set()
+        assert await asyncio.gather(flights.do("key", call), flights.do("key", call)) == [("list", False)] * 2
+        assert call.started == 2
+
+    run(scenario())
@@ -0,0 +1,74 @@
+"""Streaming import parsing: records split across chunks, final records and errors reported by record number."""
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.entities import TodoTaskTransferFormat
+from app.exceptions import InvalidImportException
+from app.task_transfer import _split_complete, format_header, format_rows, read_records
+
+NDJSON = TodoTaskTransferFormat.NDJSON
+CSV = TodoTaskTransferFormat.CSV
+
+
+def read(chunks: list[bytes], format: TodoTaskTransferFormat) -> list[tuple[int, dict]]:
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [item async for item in read_records(stream(), format)]
+
+    return asyncio.run(collect())
+
+
+def test_ndjson_record_split_across_chunks():
+    assert read([b'{"task": "fi', b'rst"}\n{"task"', b': "second"}\n'], NDJSON) == [
+        (1, {"task": "first"}), (2, {"task": "second"}),
+    ]
+
+
+def test_ndjson_final_line_without_newline():
+    assert read([b'{"task": "a"}\n{"task": "b"}'], NDJSON) == [(1, {"task": "a"}), (2, {"task": "b"})]
+
+
+def test_multibyte_character_split_across_chunks():
+    # With the byte order mark some editors write
+    data = '\ufeff{"task": "задача"}\n'.encode()
+    split = data.index("д".encode()) + 1
+    assert read([data[:split], data[split:]], NDJSON) == [(1, {"task": "задача"})]
+
+
+def test_invalid_ndjson_line_is_reported_by_number():
+    # Blank lines count, so the number is the line in the file
+    with pytest.raises(InvalidImportException, match="Record 3: invalid JSON"):
+        read([b'{"task": "a"}\n\n{"task": \n'], NDJSON)
+    with pytest.raises(InvalidImportException, match="Record 2: expected a JSON object"):
+        read([b'{"task": "a"}\n', b'["b"]\n'], NDJSON)
+
+
+def test_invalid_utf8_is_rejected():
+    with pytest.raises(InvalidImportException, match="UTF-8"):
+        read([b'{"task": "\xff"}\n'], NDJSON)
+
+
+def test_csv_record_with_quoted_newline_split_across_chunks():
+    chunks = [b'task,is_done\n"two\n', b'lines",true\nlast,']
+    assert read(chunks, CSV) == [(1, {"task": "two\nlines", "is_done": "true"}), (2, {"task": "last"})]
+
+
+def test_split_complete_keeps_the_unfinished_tail():
+    assert _split_complete('{"a": 1}\n{"b"', NDJSON) == ('{"a": 1}\n', '{"b"')
+    assert _split_complete('a,"b\nc",d\ne', CSV) == ('a,"b\nc",d\n', "e")
+    assert _split_complete('a,"b\nc', CSV) == ("", 'a,"b\nc')
+
+
+def test_csv_export_reads_back():
+    task_id = uuid.uuid4()
+    rows = [SimpleNamespace(id=task_id, task='say "hi",\nthen go', is_done=True, weight=1.5)]
+    data = format_header(CSV) + format_rows(rows, CSV)
+    assert read([data[:7], data[7:]], CSV) == [
+        (1, {"id": str(task_id), "task": 'say "hi",\nthen go', "is_done": "true", "weight": "1.5"}),
+    ]
@@ -0,0 +1,70 @@
+"""TodoService on a fake unit of work: a free list from the pool is not found by any slug lookup."""
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.entities import TodoListUpdate, TodoTaskCreate, TodoTaskUpdate
+from app.exceptions import TodoListNotFoundException
+from app.list_cache import ListCache
+from app.retry_policy import RetryPolicy
+from app.single_flight import SingleFlight
+from app.todo_service import TodoService
+
+SLUG = "FREE0001"
+
+
+class FakeTodoLists:
+    def __init__(self):
+        self.free_list = SimpleNamespace(id=uuid.uuid4(), slug=SLUG, name="", version=1, is_free=True, tasks=[])
+
+    async def get_by_slug(self, session, slug, **options):
+        return self.free_list
+
+    async def get_version_by_slug(self, session, slug):
+        # Only taken lists have a version to poll
+        return None
+
+
+class FakeUnitOfWork:
+    session_factory = None
+
+    def __init__(self):
+        self.session = None
+        self.todo_lists = FakeTodoLists()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeWriteBehind:
+    enabled = False
+
+    async def flush(self, slug):
+        pass
+
+    def pending_fields(self, slug, task_id):
+        return {}
+
+
+@pytest.mark.parametrize("call", [
+    lambda service: service.get_todo_list_by_slug(SLUG),
+    lambda service: service.get_todo_list_json_by_slug(SLUG),
+    lambda service: service.get_todo_list_changes(SLUG, since=0, max_changes=100),
+    lambda service: service.update_todo_list(SLUG, TodoListUpdate(name="taken")),
+    lambda service: service.delete_todo_list(SLUG),
+    lambda service: service.create_todo_task(SLUG, TodoTaskCreate(task="a")),
+    lambda service: service.update_todo_task(SLUG, uuid.uuid4(), TodoTaskUpdate(task="a")),
+    lambda service: service._record_todo_task_update(SLUG, uuid.uuid4(), TodoTaskUpdate(task="a")),
+    lambda service: service.delete_todo_task(SLUG, uuid.uuid4()),
+], ids=["get", "get_json", "changes", "update_list", "delete_list", "create_task", "update_task", "record_task_update", "delete_task"])
+def test_free_list_is_not_found(call):
+    service = TodoService(uow=FakeUnitOfWork(), slug_service=None, weight_service=None, event_hub=None,
+                          list_cache=ListCache(), free_list_pool=None, retry_policy=RetryPolicy(attempts=1),
+                          single_flight=SingleFlight(), write_behind=FakeWriteBehind())
+    with pytest.raises(TodoListNotFoundException):
+        asyncio.run(call(service))
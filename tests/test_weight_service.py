@@ -0,0 +1,165 @@
+"""Property tests of task weights: random neighbours and move sequences from fixed seeds."""
+import random
+import uuid
+
+import pytest
+
+from app.entities import MovePosition
+from app.exceptions import WeightRebalanceRequiredException
+from app.weight_service import WeightIndex, WeightService
+
+SEEDS = range(20)
+
+
+def random_weight(rng: random.Random) -> float:
+    # Small and huge magnitudes alike, on both sides of zero
+    return rng.choice((-1, 1)) * rng.uniform(0, 10.0 ** rng.randint(-3, 15))
+
+
+def random_index(rng: random.Random, size: int) -> WeightIndex:
+    return WeightIndex(sorted((random_weight(rng), uuid.UUID(int=rng.getrandbits(128))) for _ in range(size)))
+
+
+def random_move(rng: random.Random, index: WeightIndex) -> tuple[MovePosition, uuid.UUID | None, uuid.UUID | None]:
+    task_ids = [task_id for _, task_id in index.items()]
+    position = rng.choice(list(MovePosition))
+    moving_task_id = rng.choice(task_ids + [None])
+    target_task_id = rng.choice(task_ids) if position in (MovePosition.BEFORE, MovePosition.AFTER) else None
+    return position, target_task_id, moving_task_id
+
+
+def place(service: WeightService, index: WeightIndex, position, target_task_id, moving_task_id) -> uuid.UUID:
+    """Move (or create when moving_task_id is None) a task, rebalancing as TodoService does. Returns the task ID."""
+    try:
+        weight = service.calculate_weight(index, position, target_task_id, moving_task_id)
+    except WeightRebalanceRequiredException:
+        index.rebalance(service.normal_step)
+        weight = service.calculate_weight(index, position, target_task_id, moving_task_id)
+    task_id = moving_task_id or uuid.uuid4()
+    if moving_task_id is not None:
+        index.remove(moving_task_id)
+    index.insert(task_id, weight)
+    return task_id
+
+
+def order(index: WeightIndex) -> list[uuid.UUID]:
+    return [task_id for _, task_id in index.items()]
+
+
+def expected_order(before: list[uuid.UUID], task_id: uuid.UUID, position, target_task_id) -> list[uuid.UUID]:
+    rest = [other for other in before if other != task_id]
+    if position == MovePosition.FIRST:
+        return [task_id] + rest
+    if position in (MovePosition.BEFORE, MovePosition.AFTER) and target_task_id != task_id:
+        at = rest.index(target_task_id) + (position == MovePosition.AFTER)
+        return rest[:at] + [task_id] + rest[at:]
+    if target_task_id == task_id:
+        return before
+    return rest + [task_id]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_weight_between_is_strictly_between_neighbours(seed):
+    rng = random.Random(seed)
+    service = WeightService()
+    for _ in range(1000):
+        lower, upper = sorted((random_weight(rng), random_weight(rng)))
+        if rng.random() < 0.2:
+            lower = None
+        elif rng.random() < 0.2:
+            upper = None
+        try:
+            weight = service.weight_between(lower, upper)
+        except WeightRebalanceRequiredException:
+            continue
+        assert lower is None or lower < weight
+        assert upper is None or weight < upper
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_weight_between_respects_relative_gap(seed):
+    rng = random.Random(seed)
+    service = WeightService(min_gap=1e-6)
+    for _ in range(1000):
+        lower = random_weight(rng)
+        scale = max(abs(lower), 1.0)
+        gap = scale * 10.0 ** rng.uniform(-9, -3)
+        upper = lower + gap
+        if not lower < upper:
+            continue
+        if gap < service.min_gap * max(abs(lower), abs(upper), 1.0):
+            with pytest.raises(WeightRebalanceRequiredException):
+                service.weight_between(lower, upper)
+        else:
+            assert lower < service.weight_between(lower, upper) < upper
+
+
+def test_weight_between_refuses_before_equal_weights():
+    service = WeightService()
+    for lower in (1.0, 100.0, 1e12, -1e15):
+        upper = lower + lower * 1e-3
+        lower, upper = min(lower, upper), max(lower, upper)
+        for _ in range(200):
+            try:
+                upper = service.weight_between(lower, upper)
+            except WeightRebalanceRequiredException:
+                break
+            assert lower < upper
+        else:
+            pytest.fail(f"repeated halving above {lower} never asked for a rebalance")
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_moves_keep_order(seed):
+    rng = random.Random(seed)
+    service = WeightService()
+    index = random_index(rng, rng.randint(0, 30))
+    for _ in range(300):
+        position, target_task_id, moving_task_id = random_move(rng, index)
+        before = order(index)
+        task_id = place(service, index, position, target_task_id, moving_task_id)
+        assert order(index) == expected_order(before, task_id, position, target_task_id)
+        weights = [weight for weight, _ in index.items()]
+        assert weights == sorted(weights)
+        assert len(set(weights)) == len(weights)
+
+
+@pytest.mark.parametrize("position", [MovePosition.BEFORE, MovePosition.AFTER])
+def test_adversarial_moves_into_one_gap_rebalance(position):
+    # Every move lands in the gap left by the previous one, which halves it each time
+    service = WeightService()
+    index = WeightIndex([])
+    anchor = place(service, index, MovePosition.LAST, None, None)
+    place(service, index, MovePosition.LAST, None, None)
+    expected = order(index)
+    for _ in range(500):
+        task_id = place(service, index, position, anchor, None)
+        expected = expected_order(expected, task_id, position, anchor)
+        anchor = task_id
+        assert order(index) == expected
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rebalance_keeps_order(seed):
+    rng = random.Random(seed)
+    index = random_index(rng, rng.randint(0, 100))
+    before = order(index)
+    step = rng.choice((1.0, 100.0, 1000.0))
+    index.rebalance(step)
+    assert order(index) == before
+    assert [weight for weight, _ in index.items()] == [(position + 1) * step for position in range(len(before))]
+    for weight, task_id in index.items():
+        assert index.weight_of(task_id) == weight
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_index_neighbours_match_sorted_keys(seed):
+    rng = random.Random(seed)
+    index = random_index(rng, rng.randint(1, 30))
+    keys = index.items()
+    for position, (weight, task_id) in enumerate(keys):
+        assert task_id in index
+        assert index.previous(task_id) == (keys[position - 1][0] if position > 0 else None)
+        assert index.next(task_id) == (keys[position + 1][0] if position + 1 < len(keys) else None)
+    assert index.first() == keys[0][0]
+    assert index.last() == keys[-1][0]
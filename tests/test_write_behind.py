@@ -0,0 +1,235 @@
+"""WriteBehindBuffer without a database: its writes and change log lookups are replaced by fakes."""
+import asyncio
+import json
+import uuid
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from app.entities import TodoTask
+from app.event_hub import EventHub
+from app.list_cache import ListCache
+from app.retry_policy import RetryPolicy
+from app.write_behind import WriteBehindBuffer, _Edit
+
+SLUG = "LIST0001"
+LIST_ID = uuid.uuid4()
+
+
+class DatabaseError(Exception):
+    def __init__(self, sqlstate: str | None):
+        super().__init__(f"sqlstate {sqlstate}")
+        self.sqlstate = sqlstate
+
+
+def db_error(sqlstate: str | None = None) -> DBAPIError:
+    return DBAPIError("UPDATE todo_tasks", {}, DatabaseError(sqlstate))
+
+
+class FakeChanges:
+    def __init__(self, latest: dict):
+        self.latest = latest
+        self.calls = []
+
+    async def get_latest_versions(self, session, list_id, task_ids, since, list_ops, own_versions):
+        self.calls.append((list_id, set(task_ids), since, own_versions))
+        return self.latest
+
+
+class FakeUnitOfWork:
+    def __init__(self, changes: FakeChanges):
+        self.session = None
+        self.todo_list_changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeDatabase:
+    def __init__(self, latest: dict | None = None, error: Exception | None = None):
+        self.changes = FakeChanges(latest or {})
+        self.error = error
+
+    def get_unit_of_work(self):
+        if self.error is not None:
+            raise self.error
+        return FakeUnitOfWork(self.changes)
+
+
+class FakeWrites:
+    """Stands in for WriteBehindBuffer._write_list: keeps what it wrote, rejects texts over 255 characters."""
+
+    def __init__(self):
+        self.version = 1
+        self.tasks: dict[uuid.UUID, dict] = {}
+        self.error: Exception | None = None
+
+    async def __call__(self, list_id, edits):
+        if self.error is not None:
+            raise self.error
+        if any(len(edit.fields.get("task", "")) > 255 for edit in edits.values()):
+            raise db_error("22001")
+        self.version += 1
+        for task_id, edit in edits.items():
+            self.tasks.setdefault(task_id, {"task": "", "is_done": False}).update(edit.fields)
+        return self.version, [TodoTask(id=task_id, weight=1.0, **self.tasks[task_id]) for task_id in edits]
+
+
+def make_buffer(directory, database=None) -> tuple[WriteBehindBuffer, FakeWrites]:
+    buffer = WriteBehindBuffer(ListCache(), RetryPolicy(attempts=1), enabled=True, directory=str(directory),
+                               flush_interval=60.0, fsync=False)
+    writes = FakeWrites()
+    buffer._write_list = writes
+    buffer._database = database or FakeDatabase()
+    return buffer, writes
+
+
+def log_line(record: dict) -> bytes:
+    return json.dumps(record, default=str).encode()
+
+
+def edit_record(seq: int, task_id: uuid.UUID, version: int = 1, **fields) -> dict:
+    return {"seq": seq, "slug": SLUG, "list_id": str(LIST_ID), "task_id": str(task_id), "version": version, **fields}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_read_log_skips_edits_up_to_the_flushed_seq(tmp_path):
+    buffer, _ = make_buffer(tmp_path)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    lines = [
+        log_line(edit_record(1, first, task="a")),
+        log_line(edit_record(2, second, task="b")),
+        log_line({"flushed": [[SLUG, str(first), 1], [SLUG, str(second), 2]], "list_id": str(LIST_ID), "version": 5}),
+        log_line(edit_record(3, first, task="a2")),
+    ]
+    edits, own_versions = buffer._read_log(lines)
+    assert [(edit["seq"], edit["task"]) for edit in edits] == [(3, "a2")]
+    assert own_versions == {str(LIST_ID): [5]}
+
+
+def test_read_log_ignores_a_truncated_last_line(tmp_path):
+    buffer, _ = make_buffer(tmp_path)
+    task_id = uuid.uuid4()
+    complete = log_line(edit_record(1, task_id, task="a"))
+    edits, _ = buffer._read_log([complete, log_line(edit_record(2, task_id, task="b"))[:20]])
+    assert [edit["seq"] for edit in edits] == [1]
+
+
+def test_read_log_keeps_no_version_of_a_flush_that_wrote_nothing(tmp_path):
+    buffer, _ = make_buffer(tmp_path)
+    task_id = uuid.uuid4()
+    lines = [
+        log_line(edit_record(1, task_id, task="a")),
+        log_line({"flushed": [[SLUG, str(task_id), 1]], "list_id": str(LIST_ID), "version": None}),
+    ]
+    assert buffer._read_log(lines) == ([], {})
+
+
+def test_drop_overwritten_skips_edits_older_than_a_change(tmp_path):
+    changed, unchanged = uuid.uuid4(), uuid.uuid4()
+    database = FakeDatabase(latest={changed: 7})
+    buffer, _ = make_buffer(tmp_path, database)
+    edits = [edit_record(2, unchanged, version=5, task="kept"), edit_record(1, changed, version=5, task="stale")]
+    kept = run(buffer._drop_overwritten(edits, {str(LIST_ID): [6]}))
+    assert [edit["task"] for edit in kept] == ["kept"]
+    assert buffer.overwritten == 1
+    list_id, task_ids, since, own_versions = database.changes.calls[0]
+    assert (list_id, task_ids, since, own_versions) == (LIST_ID, {changed, unchanged}, 5, [6])
+
+
+def test_drop_overwritten_skips_every_edit_older_than_a_list_reload(tmp_path):
+    buffer, _ = make_buffer(tmp_path, FakeDatabase(latest={None: 6}))
+    edits = [edit_record(1, uuid.uuid4(), version=5, task="a"), edit_record(2, uuid.uuid4(), version=6, task="b")]
+    kept = run(buffer._drop_overwritten(edits, {}))
+    assert [edit["task"] for edit in kept] == ["b"]
+
+
+def test_failed_flush_requeues_the_edits(tmp_path):
+    async def scenario():
+        buffer, writes = make_buffer(tmp_path)
+        await buffer.start(buffer._database, EventHub())
+        task_id = uuid.uuid4()
+        await buffer.record(SLUG, LIST_ID, task_id, 1, task="a")
+        writes.error = db_error()
+        with pytest.raises(DBAPIError):
+            await buffer.flush(SLUG)
+        assert buffer.pending_fields(SLUG, task_id) == {"task": "a"}
+
+        writes.error = None
+        await buffer.flush(SLUG)
+        assert writes.tasks[task_id]["task"] == "a"
+        assert buffer.pending_fields(SLUG, task_id) == {}
+        await buffer.stop()
+        assert not list(tmp_path.iterdir())
+
+    run(scenario())
+
+
+def test_requeue_keeps_edits_made_during_the_flush(tmp_path):
+    buffer, _ = make_buffer(tmp_path)
+    task_id = uuid.uuid4()
+    failed = {task_id: _Edit(LIST_ID, 1, {"task": "old", "is_done": True})}
+    buffer._merge(SLUG, LIST_ID, task_id, 2, {"task": "new"})
+    buffer._requeue(SLUG, failed)
+    assert buffer.pending_fields(SLUG, task_id) == {"task": "new", "is_done": True}
+    assert buffer._pending_tasks == 1
+
+
+def test_rejected_edit_does_not_block_the_rest_of_the_list(tmp_path):
+    async def scenario():
+        buffer, writes = make_buffer(tmp_path)
+        await buffer.start(buffer._database, EventHub())
+        poisoned, other = uuid.uuid4(), uuid.uuid4()
+        await buffer.record(SLUG, LIST_ID, poisoned, 1, task="x" * 300)
+        await buffer.record(SLUG, LIST_ID, other, 1, is_done=True)
+        await buffer.flush(SLUG)
+
+        assert writes.tasks == {other: {"task": "", "is_done": True}}
+        assert (buffer.rejected, buffer.flushed_tasks) == (1, 1)
+        assert buffer.pending_fields(SLUG, poisoned) == {}
+        # Both are logged as flushed, a replay of this log writes neither
+        edits, _ = buffer._read_log(buffer._path.read_bytes().splitlines())
+        assert edits == []
+        await buffer.stop()
+
+    run(scenario())
+
+
+def test_recovery_writes_the_edits_of_a_dead_worker(tmp_path):
+    poisoned, other = uuid.uuid4(), uuid.uuid4()
+    (tmp_path / "writes-1.log").write_bytes(b"\n".join([
+        log_line(edit_record(1, poisoned, task="x" * 300)),
+        log_line(edit_record(2, other, task="kept")),
+    ]) + b"\n")
+
+    async def scenario():
+        buffer, writes = make_buffer(tmp_path)
+        await buffer.start(buffer._database, EventHub())
+        assert writes.tasks == {other: {"task": "kept", "is_done": False}}
+        assert (buffer.recovered, buffer.rejected) == (2, 1)
+        assert not (tmp_path / "writes-1.log").exists()
+        await buffer.stop()
+
+    run(scenario())
+
+
+def test_failed_recovery_does_not_stop_the_worker_from_starting(tmp_path):
+    log = tmp_path / "writes-1.log"
+    log.write_bytes(log_line(edit_record(1, uuid.uuid4(), task="a")) + b"\n")
+
+    async def scenario():
+        buffer, _ = make_buffer(tmp_path, FakeDatabase(error=ConnectionRefusedError()))
+        await buffer.start(buffer._database, EventHub())
+        assert buffer.failures == 1
+        assert buffer._pending_tasks == 0
+        # Left for the next worker that starts
+        assert log.exists()
+        await buffer.stop()
+
+    run(scenario())